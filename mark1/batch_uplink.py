@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from codec_registry import available_codecs, get_codec
+from ground_client import parse_endpoint
+from protocol import SESSION_RESPONSE_FORMAT, SESSION_RESPONSE_SIZE, EXTENDED_STATS_SIZE, STAGE_TIMINGS_SIZE, \
+                     FLAG_SHARED, FLAG_TIMINGS, STATUS_OK, PRIORITY_AUTO, PRIORITY_COMMAND, PRIORITY_NORMAL, PRIORITY_BULK, \
+                     pack_header, unpack_extended_stats, unpack_stage_timings
+from transport import share_payload, shared_ring
+
+# Headless batch uplink: compress a directory or manifest of payloads and
+# send them to one or more satellites, then report what it took as JSON.
+#
+# Payloads are read and compressed on a process pool and uploaded over
+# asyncio on persistent binary-header connections. Requests on a connection
+# are pipelined and told apart by their request id, since the async
+# satellite answers them as they finish. Each payload goes to the
+# connection with the fewest requests in flight. At most --window payloads
+# are being compressed or uploaded at once, which also bounds the memory
+# held for them.
+#
+# The report goes to stdout; everything else printed, codec loading
+# included, goes to stderr so the report can be piped on.
+
+DEFAULT_WINDOW = 16
+PRIORITIES = {"auto": PRIORITY_AUTO, "command": PRIORITY_COMMAND, "normal": PRIORITY_NORMAL, "bulk": PRIORITY_BULK}
+
+Job = namedtuple("Job", ["path", "method", "level", "target_method", "target_level"])
+
+def directory_jobs(directory: str, method: str, level=None, target_method=None, target_level=None) -> list:
+    """One job per regular file under directory, in sorted order."""
+    jobs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                jobs.append(Job(path, method, level, target_method, target_level))
+    return jobs
+
+def manifest_jobs(manifest: str, method: str, level=None, target_method=None, target_level=None) -> list:
+    """Jobs of a manifest: one path per line, or a JSON object with "path" and optionally
+    "codec", "level", "target_codec" and "target_level" overriding the command line.
+    Relative paths are taken from the manifest's directory; blank lines and # comments are skipped."""
+    base = os.path.dirname(os.path.abspath(manifest))
+    jobs = []
+    with open(manifest, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            if "path" not in entry:
+                raise ValueError(f"{manifest}:{line_number}: entry has no path")
+            jobs.append(Job(os.path.join(base, entry["path"]), entry.get("codec", method),
+                            entry.get("level", level), entry.get("target_codec", target_method),
+                            entry.get("target_level", target_level)))
+    return jobs
+
+def compress_file(path: str, compression_method: str, level=None):
+    """Read and compress one file; module level so worker processes can run it.
+
+    Returns (original size, compressed payload, compress seconds).
+    """
+    with open(path, "rb") as f:
+        payload = f.read()
+    start = time.perf_counter()
+    compressed = get_codec(compression_method).compress(payload, level)
+    return len(payload), compressed, time.perf_counter() - start
+
+class Uplink:
+    """Asyncio connection to a satellite carrying pipelined binary-header requests, reopened
+    once it has been lost."""
+
+    def __init__(self, endpoint, timeout=15.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.writer = None
+        self.receiver = None
+        self.pending = {}
+        self.next_request_id = 0
+        self.in_flight = 0
+        self._connecting = asyncio.Lock()
+
+    def __str__(self) -> str:
+        if self.endpoint.transport == "tcp":
+            return f"{self.endpoint.server_ip}:{self.endpoint.server_port}"
+        return f"{self.endpoint.transport}:{self.endpoint.socket_path}"
+
+    async def _ensure_open(self) -> None:
+        async with self._connecting:
+            if self.receiver is not None and not self.receiver.done() and not self.writer.is_closing():
+                return
+            if self.endpoint.transport == "tcp":
+                connecting = asyncio.open_connection(self.endpoint.server_ip, self.endpoint.server_port)
+            else:
+                connecting = asyncio.open_unix_connection(self.endpoint.socket_path)
+            reader, self.writer = await asyncio.wait_for(connecting, self.timeout)
+            # Requests belong to their connection, so one that is lost only fails its own
+            self.pending = {}
+            self.receiver = asyncio.create_task(self._receive(reader, self.writer, self.pending))
+
+    async def _receive(self, reader, writer, pending) -> None:
+        """Hand every response to the request waiting for its id, until the connection goes away."""
+        error = ConnectionError(f"Connection to {self} closed")
+        try:
+            while True:
+                request_id, status, body_length = struct.unpack(
+                    SESSION_RESPONSE_FORMAT, await reader.readexactly(SESSION_RESPONSE_SIZE))
+                body = await reader.readexactly(body_length)
+                future = pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result((status, body))
+        except (asyncio.IncompleteReadError, OSError) as e:
+            error = ConnectionError(f"Connection to {self} lost: {e}")
+        finally:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            pending.clear()
+            writer.close()
+
+    @staticmethod
+    async def _exchange(writer, buffers, future):
+        writer.writelines(buffers)
+        await writer.drain()
+        return await future
+
+    async def send(self, payload, compression_method: str, **header_fields):
+        """One request; returns (status, response body).
+
+        A request that is not answered within the timeout closes the connection, failing
+        the others on it as well, since the satellite has stopped keeping up with it.
+        """
+        await self._ensure_open()
+        writer, pending = self.writer, self.pending
+        request_id = self.next_request_id
+        self.next_request_id = (self.next_request_id + 1) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        pending[request_id] = future
+        shared_offset = share_payload(payload) if self.endpoint.transport == "shm" else None
+        flags = FLAG_TIMINGS | (FLAG_SHARED if shared_offset is not None else 0)
+        header = pack_header(compression_method, len(payload), flags=flags, request_id=request_id, **header_fields)
+        buffers = [header, shared_ring().descriptor(shared_offset) if shared_offset is not None else payload]
+        self.in_flight += 1
+        try:
+            try:
+                return await asyncio.wait_for(self._exchange(writer, buffers, future), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"No answer from {self} within {self.timeout:g} s") from None
+        except BaseException:
+            pending.pop(request_id, None)
+            # The satellite drops its view of the shared segment with the connection,
+            # so the region can be handed back once it is closed
+            writer.close()
+            raise
+        finally:
+            self.in_flight -= 1
+            if shared_offset is not None:
+                shared_ring().free(shared_offset)
+
+    async def close(self) -> None:
+        if self.receiver is None:
+            return
+        self.writer.close()
+        with contextlib.suppress(Exception):
+            await self.writer.wait_closed()
+        self.receiver.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.receiver
+
+async def upload_job(job: Job, uplinks, window: asyncio.Semaphore, pool, priority: int) -> dict:
+    """Compress and upload one payload; returns its entry of the report."""
+    entry = {"path": job.path, "codec": job.method, "level": job.level}
+    loop = asyncio.get_running_loop()
+    async with window:
+        try:
+            original_size, compressed, compress_time = await loop.run_in_executor(
+                pool, compress_file, job.path, job.method, job.level)
+            entry.update(size=original_size, compressed_size=len(compressed), compress_time=compress_time)
+            uplink = min(uplinks, key=lambda candidate: candidate.in_flight)
+            entry["endpoint"] = str(uplink)
+            start = time.perf_counter()
+            status, body = await uplink.send(compressed, job.method, level=job.level,
+                                             target_method=job.target_method, target_level=job.target_level,
+                                             priority=priority)
+            entry["upload_time"] = time.perf_counter() - start
+        except Exception as e:
+            print(f"{job.path}: {e}")
+            entry.update(status="error", error=str(e))
+            return entry
+    if status != STATUS_OK:
+        message = body.decode('utf-8', errors='replace')
+        print(f"{job.path}: satellite error: {message}")
+        entry.update(status="error", error=message)
+        return entry
+    stats = unpack_extended_stats(body)
+    timings = unpack_stage_timings(body)
+    entry.update(status="ok", target_codec=stats.target_method, target_level=stats.target_level,
+                 recompressed_size=stats.recompressed_size,
+                 satellite_decompress_time=stats.decompress_time,
+                 satellite_recompress_time=stats.recompress_time,
+                 satellite_receive_time=timings.receive_time)
+    if len(body) - EXTENDED_STATS_SIZE - STAGE_TIMINGS_SIZE != stats.recompressed_size:
+        entry.update(status="error", error="Response payload does not match its stats")
+    return entry
+
+def summarize(entries, elapsed: float) -> dict:
+    """Aggregate totals over the uploaded payloads."""
+    uploaded = [entry for entry in entries if entry["status"] == "ok"]
+    original_bytes = sum(entry["size"] for entry in uploaded)
+    compressed_bytes = sum(entry["compressed_size"] for entry in uploaded)
+    per_endpoint = {}
+    for entry in uploaded:
+        totals = per_endpoint.setdefault(entry["endpoint"], {"files": 0, "compressed_bytes": 0})
+        totals["files"] += 1
+        totals["compressed_bytes"] += entry["compressed_size"]
+    return {
+        "files": len(entries),
+        "failed": len(entries) - len(uploaded),
+        "bytes": original_bytes,
+        "compressed_bytes": compressed_bytes,
+        "compression_ratio": original_bytes / compressed_bytes if compressed_bytes else None,
+        "elapsed": elapsed,
+        # Payload bytes delivered per second, and what actually crossed the link
+        "throughput_mb_s": original_bytes / elapsed / 1e6 if elapsed else None,
+        "uplink_mb_s": compressed_bytes / elapsed / 1e6 if elapsed else None,
+        "endpoints": per_endpoint,
+    }
+
+async def run_batch(jobs, endpoints, window=DEFAULT_WINDOW, workers=None, connections=1,
+                    priority=PRIORITY_AUTO, timeout=15.0) -> dict:
+    """Upload every job; returns the report with aggregate totals and per-file entries in job order."""
+    uplinks = [Uplink(endpoint, timeout) for endpoint in endpoints for _ in range(connections)]
+    limit = asyncio.Semaphore(window)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        try:
+            entries = await asyncio.gather(*(upload_job(job, uplinks, limit, pool, priority) for job in jobs))
+        finally:
+            for uplink in uplinks:
+                await uplink.close()
+    elapsed = time.perf_counter() - start
+    return {"total": summarize(entries, elapsed), "files": entries}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compress a batch of payloads and upload them to satellites")
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument("--directory", help="Upload every file under this directory")
+    sources.add_argument("--manifest",
+                         help="File listing the payloads, one path or JSON object per line")
+    parser.add_argument("--endpoint", action="append", dest="endpoints", type=parse_endpoint,
+                        help='Satellite as "host:port", "unix:/path" or "shm:/path"; '
+                             "repeat for several (default 127.0.0.1:1222)")
+    parser.add_argument("--codec", default="zstd", choices=available_codecs(),
+                        help="Codec payloads are compressed with on the ground")
+    parser.add_argument("--level", type=int, default=None)
+    parser.add_argument("--target-codec", default=None, choices=available_codecs(),
+                        help="Codec the satellite recompresses to (default: the source codec)")
+    parser.add_argument("--target-level", type=int, default=None)
+    parser.add_argument("--priority", choices=PRIORITIES, default="auto",
+                        help="Scheduling class asked of the satellite (auto classifies by size)")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW,
+                        help="Payloads being compressed or uploaded at once")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="Connections opened to every endpoint; more than one needs async satellites, "
+                             "a sync one serves a single connection at a time")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes compressing payloads")
+    parser.add_argument("--timeout", type=float, default=15.0,
+                        help="Seconds to wait for a connection, and for every request to be answered")
+    parser.add_argument("--output", default="-",
+                        help="Where the JSON report is written (default stdout)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    report_stream = sys.stdout
+    # Worker processes inherit the redirection when they are started
+    with contextlib.redirect_stdout(sys.stderr):
+        source = args.directory or args.manifest
+        make_jobs = directory_jobs if args.directory else manifest_jobs
+        batch = make_jobs(source, args.codec, args.level, args.target_codec, args.target_level)
+        print(f"Uploading {len(batch)} payloads from {source}")
+        report = asyncio.run(run_batch(batch, args.endpoints or [parse_endpoint("127.0.0.1:1222")],
+                                       args.window, args.workers, args.connections,
+                                       PRIORITIES[args.priority], args.timeout))
+    if args.output == "-":
+        json.dump(report, report_stream, indent=2)
+        report_stream.write("\n")
+    else:
+        with open(args.output, "w", encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["total"]["failed"] else 0)
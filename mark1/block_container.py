@@ -0,0 +1,282 @@
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from codec_registry import DecompressionLimitExceeded, codec_threads, get_codec
+from protocol import CODEC_IDS, codec_name
+
+# Seekable block container.
+#
+# The payload is cut into blocks of a fixed uncompressed size that are
+# compressed independently, each with any registry codec, so they can be
+# compressed and decompressed in parallel and any byte range can be read
+# by inflating only the blocks it touches.
+#
+#   CONTAINER_MAGIC + version
+#   per block: BLOCK_HEADER_FORMAT (codec id, compressed size, uncompressed size) + block
+#   BLOCK_HEADER_FORMAT with codec id 0: end of the blocks
+#   per block: INDEX_ENTRY_FORMAT (data offset, compressed size, uncompressed size,
+#              codec id, CRC32 of the compressed block, CRC32 of its data)
+#   FOOTER_FORMAT (block count, CRC32 of the index, total uncompressed size, FOOTER_MAGIC)
+#
+# The block headers let a stream be decoded front to back as it arrives;
+# the index and footer let a complete container be read from the end.
+
+CONTAINER_MAGIC = b"BLKS"
+CONTAINER_VERSION = 1
+CONTAINER_HEADER_SIZE = len(CONTAINER_MAGIC) + 1
+BLOCK_HEADER_FORMAT = "!BII"
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER_FORMAT)
+INDEX_ENTRY_FORMAT = "!QIIBII"
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+FOOTER_MAGIC = b"BLKX"
+FOOTER_FORMAT = "!IIQ4s"
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT)
+
+DEFAULT_BLOCK_METHOD = "zstd"
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def block_pool() -> ThreadPoolExecutor:
+    """Threads (de)compressing container blocks; kept apart from the pools the codecs use themselves."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=codec_threads(), thread_name_prefix="container-block")
+        return _pool
+
+def _map(codec, function, items):
+    """function over items in order, in parallel when the codec releases the GIL."""
+    if codec.releases_gil and len(items) > 1:
+        return list(block_pool().map(function, items))
+    return [function(item) for item in items]
+
+def block_codec(compression_method: str):
+    codec = get_codec(compression_method)
+    if compression_method == "blocks" or not codec.streaming:
+        raise ValueError(f"Compression method {compression_method} cannot be used for container blocks")
+    return codec
+
+class IndexEntry:
+    __slots__ = ("offset", "compressed_size", "size", "method", "compressed_crc", "crc", "start")
+
+    def __init__(self, offset, compressed_size, size, codec_id, compressed_crc, crc, start=0):
+        self.offset = offset
+        self.compressed_size = compressed_size
+        self.size = size
+        self.method = codec_name(codec_id)
+        self.compressed_crc = compressed_crc
+        self.crc = crc
+        # Uncompressed offset of the block's first byte
+        self.start = start
+
+    def pack(self) -> bytes:
+        return struct.pack(INDEX_ENTRY_FORMAT, self.offset, self.compressed_size, self.size,
+                           CODEC_IDS[self.method], self.compressed_crc, self.crc)
+
+def _decode_block(entry: IndexEntry, compressed, dictionary=None) -> bytes:
+    if zlib.crc32(compressed) != entry.compressed_crc:
+        raise ValueError(f"Block at offset {entry.offset} is corrupt")
+    codec = get_codec(entry.method)
+    data = codec.decompress_bounded(compressed, entry.size, None, dictionary if codec.dictionary else None)
+    if len(data) != entry.size or zlib.crc32(data) != entry.crc:
+        raise ValueError(f"Block at offset {entry.offset} does not match its checksum")
+    return data
+
+def pack_trailer(entries, total_size: int) -> bytes:
+    """End-of-blocks marker, index and footer."""
+    index = b"".join(entry.pack() for entry in entries)
+    return (struct.pack(BLOCK_HEADER_FORMAT, 0, 0, 0) + index
+            + struct.pack(FOOTER_FORMAT, len(entries), zlib.crc32(index), total_size, FOOTER_MAGIC))
+
+def compress_blocks(data, compression_method=DEFAULT_BLOCK_METHOD, level=None, block_size=DEFAULT_BLOCK_SIZE,
+                    dictionary=None) -> bytes:
+    """Compress data into a container of independently compressed blocks, in parallel."""
+    codec = block_codec(compression_method)
+    codec.check_dictionary(dictionary)
+    view = memoryview(data)
+    chunks = [view[start:start + block_size] for start in range(0, len(view), block_size)]
+    blocks = _map(codec, lambda chunk: codec.compress(chunk, level, None, dictionary), chunks)
+    parts = [CONTAINER_MAGIC + bytes([CONTAINER_VERSION])]
+    entries = []
+    offset = CONTAINER_HEADER_SIZE
+    for chunk, block in zip(chunks, blocks):
+        parts += [struct.pack(BLOCK_HEADER_FORMAT, codec.codec_id, len(block), len(chunk)), block]
+        offset += BLOCK_HEADER_SIZE
+        entries.append(IndexEntry(offset, len(block), len(chunk), codec.codec_id,
+                                  zlib.crc32(block), zlib.crc32(chunk)))
+        offset += len(block)
+    parts.append(pack_trailer(entries, len(view)))
+    return b"".join(parts)
+
+class BlockReader:
+    """Random access to a complete container held in memory or in a seekable binary file.
+
+    Only the blocks overlapping a requested range are read and decompressed.
+    """
+
+    def __init__(self, source, dictionary=None):
+        self.source = source
+        self.dictionary = dictionary
+        self._lock = threading.Lock()
+        end = self._size()
+        if end < CONTAINER_HEADER_SIZE + BLOCK_HEADER_SIZE + FOOTER_SIZE or \
+                self._read(0, len(CONTAINER_MAGIC)) != CONTAINER_MAGIC:
+            raise ValueError("Not a block container")
+        count, index_crc, self.size, magic = struct.unpack(FOOTER_FORMAT, self._read(end - FOOTER_SIZE, FOOTER_SIZE))
+        if magic != FOOTER_MAGIC:
+            raise ValueError("Block container is truncated")
+        index = self._read(end - FOOTER_SIZE - count * INDEX_ENTRY_SIZE, count * INDEX_ENTRY_SIZE)
+        if zlib.crc32(index) != index_crc:
+            raise ValueError("Block container index is corrupt")
+        self.entries = []
+        start = 0
+        for position in range(0, len(index), INDEX_ENTRY_SIZE):
+            entry = IndexEntry(*struct.unpack_from(INDEX_ENTRY_FORMAT, index, position), start)
+            self.entries.append(entry)
+            start += entry.size
+
+    def _size(self) -> int:
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            return len(self.source)
+        return self.source.seek(0, 2)
+
+    def _read(self, offset: int, size: int) -> bytes:
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            return bytes(self.source[offset:offset + size])
+        with self._lock:
+            self.source.seek(offset)
+            return self.source.read(size)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def block(self, number: int) -> bytes:
+        """Decompressed contents of one block."""
+        entry = self.entries[number]
+        return _decode_block(entry, self._read(entry.offset, entry.compressed_size), self.dictionary)
+
+    def read(self, offset=0, size=None) -> bytes:
+        """size bytes of the uncompressed payload from offset (to the end when None)."""
+        end = self.size if size is None else min(self.size, offset + size)
+        numbers = [number for number, entry in enumerate(self.entries)
+                   if entry.start < end and entry.start + entry.size > offset]
+        if not numbers:
+            return b""
+        blocks = list(block_pool().map(self.block, numbers)) if len(numbers) > 1 else [self.block(numbers[0])]
+        first = self.entries[numbers[0]].start
+        return b"".join(blocks)[offset - first:end - first]
+
+def decompress_blocks(data, dictionary=None) -> bytes:
+    """Decompress a whole container, blocks in parallel."""
+    return BlockReader(data, dictionary).read()
+
+class BlockStreamCompressor:
+    """Incremental container writer with a compress/flush interface; one block is compressed at a time."""
+
+    def __init__(self, compression_method=DEFAULT_BLOCK_METHOD, level=None, block_size=DEFAULT_BLOCK_SIZE,
+                 dictionary=None):
+        self.codec = block_codec(compression_method)
+        self.codec.check_dictionary(dictionary)
+        self.level = level
+        self.block_size = block_size
+        self.dictionary = dictionary
+        self.buffer = bytearray()
+        self.entries = []
+        self.offset = CONTAINER_HEADER_SIZE
+        self.total_size = 0
+        self.started = False
+
+    def _block(self, chunk) -> bytes:
+        block = self.codec.compress(chunk, self.level, None, self.dictionary)
+        self.offset += BLOCK_HEADER_SIZE
+        self.entries.append(IndexEntry(self.offset, len(block), len(chunk), self.codec.codec_id,
+                                       zlib.crc32(block), zlib.crc32(chunk)))
+        self.offset += len(block)
+        self.total_size += len(chunk)
+        return struct.pack(BLOCK_HEADER_FORMAT, self.codec.codec_id, len(block), len(chunk)) + block
+
+    def _header(self) -> bytes:
+        if self.started:
+            return b""
+        self.started = True
+        return CONTAINER_MAGIC + bytes([CONTAINER_VERSION])
+
+    def compress(self, data) -> bytes:
+        self.buffer += data
+        output = [self._header()]
+        while len(self.buffer) >= self.block_size:
+            output.append(self._block(bytes(self.buffer[:self.block_size])))
+            del self.buffer[:self.block_size]
+        return b"".join(output)
+
+    def flush(self) -> bytes:
+        output = [self._header()]
+        if self.buffer:
+            output.append(self._block(bytes(self.buffer)))
+            self.buffer = bytearray()
+        output.append(pack_trailer(self.entries, self.total_size))
+        return b"".join(output)
+
+class BlockStreamDecompressor:
+    """Incremental container reader: blocks are decoded as soon as they have fully arrived,
+    and checked against the index once the end of the container is reached."""
+
+    def __init__(self, dictionary=None):
+        self.dictionary = dictionary
+        self.buffer = bytearray()
+        self.header_read = False
+        self.blocks_done = False
+        self.checksums = []
+
+    def _next_block(self):
+        """Decode the block at the front of the buffer, or return None when it has not fully arrived."""
+        codec_id, compressed_size, size = struct.unpack_from(BLOCK_HEADER_FORMAT, self.buffer)
+        if codec_id == 0:
+            self.blocks_done = True
+            return None
+        if len(self.buffer) < BLOCK_HEADER_SIZE + compressed_size:
+            return None
+        compressed = bytes(self.buffer[BLOCK_HEADER_SIZE:BLOCK_HEADER_SIZE + compressed_size])
+        del self.buffer[:BLOCK_HEADER_SIZE + compressed_size]
+        codec = get_codec(codec_name(codec_id))
+        try:
+            block = codec.decompress_bounded(compressed, size, None, self.dictionary if codec.dictionary else None)
+        except DecompressionLimitExceeded:
+            raise
+        except Exception as error:
+            # Each codec raises its own error type; the checksums only arrive with the index
+            raise ValueError(f"Container block {len(self.checksums)} is corrupt") from error
+        if len(block) != size:
+            raise ValueError(f"Container block {len(self.checksums)} does not match its size")
+        self.checksums.append((zlib.crc32(compressed), zlib.crc32(block)))
+        return block
+
+    def decompress(self, data) -> bytes:
+        self.buffer += data
+        if not self.header_read:
+            if len(self.buffer) < CONTAINER_HEADER_SIZE:
+                return b""
+            if self.buffer[:len(CONTAINER_MAGIC)] != CONTAINER_MAGIC:
+                raise ValueError("Not a block container")
+            del self.buffer[:CONTAINER_HEADER_SIZE]
+            self.header_read = True
+        output = []
+        while not self.blocks_done and len(self.buffer) >= BLOCK_HEADER_SIZE:
+            block = self._next_block()
+            if block is None:
+                break
+            output.append(block)
+        return b"".join(output)
+
+    def flush(self) -> bytes:
+        expected = BLOCK_HEADER_SIZE + len(self.checksums) * INDEX_ENTRY_SIZE + FOOTER_SIZE
+        if not self.blocks_done or len(self.buffer) != expected:
+            raise ValueError("Truncated block container.")
+        for number, checksums in enumerate(self.checksums):
+            entry = struct.unpack_from(INDEX_ENTRY_FORMAT, self.buffer, BLOCK_HEADER_SIZE + number * INDEX_ENTRY_SIZE)
+            if entry[4:6] != checksums:
+                raise ValueError(f"Container block {number} does not match its checksum")
+        return b""
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from codec_registry import available_codecs, get_codec
+from offload import CodecExecutor
+
+# Time-budgeted recompression: several codec/level candidates run in parallel
+# and the smallest output that is ready by the deadline wins.
+#
+# Codecs that release the GIL run on a thread pool; pure Python ones
+# (RLE) run on worker processes, with the payload handed over through
+# shared memory like any other offloaded request.
+#
+# Candidates that miss the deadline keep their worker until they finish,
+# so the pools are sized for a few overlapping races and a candidate is
+# only submitted when a worker is free to start it straight away.
+
+# (codec, level) pairs tried by default, level None meaning the codec default
+DEFAULT_CANDIDATES = [("zstd", 19), ("lzma", 9), ("brotli", 11), ("bzip2", 9), ("deflate", 9), ("lz4", 12)]
+DEFAULT_DEADLINE = 1.0
+# Races the default thread pool has room for at once
+OVERLAPPING_RACES = 2
+
+def parse_candidates(spec: str):
+    """Parse "zstd:19,lzma,brotli:11" into [("zstd", 19), ("lzma", None), ("brotli", 11)]."""
+    candidates = []
+    for item in spec.split(","):
+        method, _, level = item.strip().partition(":")
+        if method not in available_codecs():
+            raise ValueError(f"Unknown compression method: {method}")
+        candidates.append((method, int(level) if level else None))
+    return candidates
+
+def compress_candidate(payload, compression_method: str, level=None):
+    """Compress with one candidate; module level so worker processes can run it."""
+    return level, get_codec(compression_method).compress(payload, level)
+
+class CandidateRunner:
+    """Races compression candidates against a deadline."""
+
+    def __init__(self, candidates=DEFAULT_CANDIDATES, deadline=DEFAULT_DEADLINE, thread_workers=None,
+                 process_workers=None):
+        self.candidates = list(candidates)
+        self.deadline = deadline
+        self.thread_workers = thread_workers or len(self.candidates) * OVERLAPPING_RACES
+        self.process_executor = CodecExecutor(compress_candidate, workers=process_workers or os.cpu_count())
+        self._threads = None
+        self._busy_threads = 0
+        self._lock = threading.Lock()
+
+    def _get_threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.thread_workers)
+        return self._threads
+
+    def _thread_finished(self, _) -> None:
+        with self._lock:
+            self._busy_threads -= 1
+
+    def _submit(self, payload, compression_method: str, level):
+        """Future for one candidate, or None when no worker is free to start it now."""
+        if get_codec(compression_method).releases_gil:
+            with self._lock:
+                if self._busy_threads >= self.thread_workers:
+                    return None
+                self._busy_threads += 1
+            future = self._get_threads().submit(compress_candidate, payload, compression_method, level)
+            future.add_done_callback(self._thread_finished)
+            return future
+        if self.process_executor.in_flight >= self.process_executor.workers:
+            return None
+        return self.process_executor.submit(payload, compression_method, level=level)
+
+    def run(self, payload, deadline=None, candidates=None):
+        """Return (method, level, compressed) for the smallest candidate done within deadline seconds.
+
+        Candidates still queued at the deadline are cancelled; running ones are
+        left to finish in the background and their output is dropped. Candidates
+        with no free worker are skipped, and when none has one the first candidate
+        is compressed on the calling thread instead of racing.
+        """
+        deadline = deadline or self.deadline
+        expires = time.monotonic() + deadline
+        candidates = candidates or self.candidates
+        futures = {}
+        for method, level in candidates:
+            future = self._submit(payload, method, level)
+            if future is not None:
+                futures[future] = method
+        if not futures:
+            method, level = candidates[0]
+            print(f"No free worker for a candidate race, compressing with {method} level {level}")
+            return (method, *compress_candidate(payload, method, level))
+        best = None
+        errors = []
+        pending = set(futures)
+        while pending:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    level, compressed = future.result()
+                except Exception as e:
+                    errors.append(f"{futures[future]}: {e}")
+                    continue
+                if best is None or len(compressed) < len(best[2]):
+                    best = (futures[future], level, compressed)
+
+        for future in pending:
+            future.cancel()
+        if best is None:
+            detail = f" ({'; '.join(errors)})" if errors else ""
+            raise RuntimeError(f"No compression candidate finished within {deadline:.3f} s{detail}")
+        print(f"Smallest candidate: {best[0]} level {best[1]}, {len(best[2])} bytes "
+              f"({len(futures) - len(pending)} of {len(futures)} candidates finished, "
+              f"{len(candidates) - len(futures)} skipped for want of a worker)")
+        return best
+
+    def shutdown(self) -> None:
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+        self.process_executor.shutdown()
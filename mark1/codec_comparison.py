@@ -0,0 +1,102 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from codec_registry import get_codec
+from offload import CodecExecutor
+
+# Every codec at a grid of levels on one payload, to pick the codec for a
+# class of payloads.
+#
+# Candidates run concurrently like the satellite's candidate race: codecs
+# that release the GIL on a thread pool, pure Python ones on worker
+# processes. Each candidate times its own compression and decompression,
+# so queueing for a worker is not counted, though candidates running side
+# by side still share the CPUs.
+
+# Bits per second of the link time-on-air is estimated for, a 9k6 UHF downlink
+DEFAULT_LINK_RATE = 9600
+
+ComparisonResult = namedtuple(
+    "ComparisonResult",
+    ["method", "level", "original_size", "compressed_size", "compress_time", "decompress_time"])
+
+def level_grid(compression_method: str, points=3) -> list:
+    """points levels spread evenly over the codec's range, plus its default; [None] when it has no levels."""
+    level_range = get_codec(compression_method).level_range
+    if level_range is None:
+        return [None]
+    low, high, default = level_range
+    levels = {default}
+    if points > 1:
+        levels.update(round(low + (high - low) * i / (points - 1)) for i in range(points))
+    return sorted(levels)
+
+def benchmark_candidate(payload, compression_method: str, level=None):
+    """Compress and decompress once, checking the round trip; module level so worker processes can run it.
+
+    Returns ((compress seconds, decompress seconds), compressed payload).
+    """
+    codec = get_codec(compression_method)
+    start = time.perf_counter()
+    compressed = codec.compress(payload, level)
+    compress_time = time.perf_counter() - start
+    start = time.perf_counter()
+    restored = codec.decompress(compressed)
+    decompress_time = time.perf_counter() - start
+    if restored != payload:
+        raise ValueError(f"{compression_method} level {level} did not round-trip")
+    return (compress_time, decompress_time), compressed
+
+def ratio(result: ComparisonResult) -> float:
+    return result.original_size / max(1, result.compressed_size)
+
+def compress_speed(result: ComparisonResult) -> float:
+    """MB of payload compressed per second."""
+    return result.original_size / max(result.compress_time, 1e-9) / 1e6
+
+def decompress_speed(result: ComparisonResult) -> float:
+    return result.original_size / max(result.decompress_time, 1e-9) / 1e6
+
+def time_on_air(result: ComparisonResult, link_rate=DEFAULT_LINK_RATE) -> float:
+    """Seconds the compressed payload occupies a link of link_rate bits per second."""
+    return result.compressed_size * 8 / link_rate
+
+class CodecComparator:
+    """Runs comparison grids; keeps its pools between runs."""
+
+    def __init__(self, thread_workers=None, process_workers=None):
+        self.thread_workers = thread_workers or os.cpu_count()
+        self.process_executor = CodecExecutor(benchmark_candidate, workers=process_workers or os.cpu_count())
+        self._threads = None
+
+    def _get_threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="comparison")
+        return self._threads
+
+    def _submit(self, payload, compression_method: str, level):
+        if get_codec(compression_method).releases_gil:
+            return self._get_threads().submit(benchmark_candidate, payload, compression_method, level)
+        return self.process_executor.submit(payload, compression_method, level=level)
+
+    def run(self, payload, candidates):
+        """Benchmark (method, level) candidates; returns (results in completion order, error messages)."""
+        futures = {self._submit(payload, method, level): (method, level) for method, level in candidates}
+        results, errors = [], []
+        for future in as_completed(futures):
+            method, level = futures[future]
+            try:
+                (compress_time, decompress_time), compressed = future.result()
+            except Exception as e:
+                errors.append(f"{method} level {level}: {e}")
+                continue
+            results.append(ComparisonResult(method, level, len(payload), len(compressed),
+                                            compress_time, decompress_time))
+        return results, errors
+
+    def shutdown(self) -> None:
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+        self.process_executor.shutdown()
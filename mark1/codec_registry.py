@@ -0,0 +1,867 @@
+import importlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import protocol
+
+# Shared codec registry for the satellite server and the ground station.
+#
+# Every codec exposes one-shot compress/decompress, incremental stream
+# factories returning (feed_chunk, finish) function pairs, capability flags
+# and the parameter ranges the ground station offers. Third-party codecs
+# subclass Codec and call register_codec().
+#
+# Codec libraries are imported on first use through get_codec(), so a
+# server only pays startup time and memory for the codecs it serves;
+# set_allowed_codecs() keeps the others from ever being loaded.
+
+_codecs = {}
+# Codecs registered but switched off by set_allowed_codecs()
+_disabled = {}
+_load_lock = threading.Lock()
+
+# Payloads from this size on are compressed with every worker thread by the plain
+# zstd, lzma and deflate codecs; the *_mt variants always use them.
+MULTITHREAD_THRESHOLD = 8 * 1024 * 1024
+# Largest piece of output a piecewise decompressor hands on at a time
+DECOMPRESS_PIECE_SIZE = 256 * 1024
+_threads = None
+_multithread_threshold = MULTITHREAD_THRESHOLD
+_block_pool = None
+# Codec the blocks of new containers are compressed with
+_block_method = "zstd"
+# Set by bound_decoders(): decoders are held to the windows decompress_memory() assumes
+_bounded_decoders = False
+
+def configure_multithreading(threads=None, threshold=MULTITHREAD_THRESHOLD) -> None:
+    """Set the worker threads of the multithreaded codecs (None = one per core) and the
+    payload size from which the plain codecs use them (None = never)."""
+    global _threads, _multithread_threshold, _block_pool
+    with _load_lock:
+        _threads = threads
+        _multithread_threshold = threshold
+        if _block_pool is not None:
+            _block_pool.shutdown(wait=False)
+            _block_pool = None
+
+def bound_decoders(enabled=True) -> None:
+    """Hold decoders to the windows decompress_memory() assumes unless a request gives a
+    window log, for a memory budget built on those estimates. Otherwise each library
+    applies its own limit (128 MiB for zstd, none for xz)."""
+    global _bounded_decoders
+    _bounded_decoders = enabled
+
+class DecompressionLimitExceeded(ValueError):
+    """A payload decompresses to more than decompress_bounded() was allowed to produce."""
+
+def codec_threads() -> int:
+    return _threads or os.cpu_count() or 1
+
+def block_pool() -> ThreadPoolExecutor:
+    """Threads compressing the blocks of parallel xz and deflate streams."""
+    global _block_pool
+    with _load_lock:
+        if _block_pool is None:
+            _block_pool = ThreadPoolExecutor(max_workers=codec_threads(), thread_name_prefix="codec-block")
+        return _block_pool
+
+def resident_memory() -> int:
+    """Current resident set size of this process in bytes (0 where it cannot be read)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class Codec:
+    name = None
+    codec_id = None
+    # Capability flags
+    streaming = True
+    dictionary = False
+    # Compresses with codec_threads() threads whatever the payload size
+    multithread = False
+    # False for pure Python codecs, which only run in parallel in separate processes
+    releases_gil = True
+    # (min, max, default) for the level and window log, None when not tunable
+    level_range = None
+    window_log_range = None
+    # Attribute name -> module imported into it on first use
+    modules = {}
+    loaded = False
+    load_time = None
+    load_memory = None
+
+    def load(self) -> None:
+        """Import the codec's modules, recording how long that took and the memory it added."""
+        with _load_lock:
+            if self.loaded:
+                return
+            memory = resident_memory()
+            start = time.perf_counter()
+            for attribute, module in self.modules.items():
+                setattr(self, attribute, importlib.import_module(module))
+            self.load_time = time.perf_counter() - start
+            self.load_memory = max(0, resident_memory() - memory)
+            self.loaded = True
+        print(f"Loaded codec {self.name} in {self.load_time * 1000:.1f} ms "
+              f"(+{self.load_memory // 1024} KiB resident)")
+
+    def compress(self, data, level=None, window_log=None, dictionary=None) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data, window_log=None, dictionary=None) -> bytes:
+        raise NotImplementedError
+
+    def decompress_bounded(self, data, limit: int, window_log=None, dictionary=None):
+        """decompress(), raising DecompressionLimitExceeded instead of producing more than
+        limit bytes; the output is built piece by piece so a bomb never gets further.
+        Codecs without streaming support decompress in one go."""
+        if not self.streaming:
+            return self.decompress(data, window_log, dictionary)
+        output = bytearray()
+
+        def emit(piece):
+            if len(output) + len(piece) > limit:
+                # Freed now rather than when the traceback goes
+                output.clear()
+                raise DecompressionLimitExceeded(f"{self.name} payload decompresses to more than {limit} bytes")
+            output.extend(piece)
+
+        decompress_chunk, finish = self.piecewise_decompressor(emit, window_log, dictionary)
+        decompress_chunk(data)
+        finish()
+        return output
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        """Return (compress_chunk, finish) functions for incremental compression."""
+        raise ValueError(f"Streaming is not supported for compression method: {self.name}")
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        """Return (decompress_chunk, finish) functions for incremental decompression."""
+        raise ValueError(f"Streaming is not supported for compression method: {self.name}")
+
+    def piecewise_decompressor(self, emit, window_log=None, dictionary=None, piece_size=DECOMPRESS_PIECE_SIZE):
+        """Return (decompress_chunk, finish) functions for incremental decompression that hand
+        the output to emit in pieces of about piece_size bytes, so a small chunk that expands
+        enormously is never held whole. Codecs without a bounded mode emit each call's output."""
+        decompress, finish = self.stream_decompressor(window_log, dictionary)
+        return (lambda data: emit_output(emit, decompress(data)), lambda: emit_output(emit, finish()))
+
+    def check_dictionary(self, dictionary) -> None:
+        if dictionary is not None and not self.dictionary:
+            raise ValueError(f"Compression method {self.name} does not support dictionaries")
+
+    def compress_threads(self, size=None) -> int:
+        """Threads to compress size bytes (None = unknown) with, for codecs with a
+        multithreaded mode; 0 keeps them single threaded."""
+        if self.multithread:
+            return codec_threads()
+        if size is not None and _multithread_threshold is not None and size >= _multithread_threshold:
+            return codec_threads()
+        return 0
+
+    def compress_memory(self, level=None, window_log=None) -> int:
+        """Estimated bytes a compressor allocates for these parameters (None = codec default)."""
+        return 0
+
+    def decompress_memory(self, window_log=None) -> int:
+        """Estimated bytes a decompressor allocates for a stream with this window."""
+        return 0
+
+    def fit_memory(self, budget: int, level=None, window_log=None, tune_window=True):
+        """Return the (level, window_log) closest to the requested ones whose compressor fits
+        within budget bytes, shrinking the window before the level.
+
+        The requested values come back unchanged when they fit; a ValueError is raised
+        when even the smallest settings do not.
+        """
+        if self.compress_memory(level, window_log) <= budget:
+            return level, window_log
+        levels = [level]
+        if self.level_range is not None:
+            low, _, default = self.level_range
+            levels = range(default if level is None else level, low - 1, -1)
+        windows = [window_log]
+        if tune_window and self.window_log_range is not None:
+            low, _, default = self.window_log_range
+            windows = range(window_log or default, low - 1, -1)
+        for candidate_level in levels:
+            for candidate_window in windows:
+                if self.compress_memory(candidate_level, candidate_window) <= budget:
+                    return candidate_level, candidate_window
+        raise ValueError(f"Compression method {self.name} needs more than the {budget // 1024} KiB "
+                         f"memory budget left")
+
+def register_codec(codec: Codec) -> Codec:
+    """Make a codec available by name, and by id in the binary header."""
+    if codec.codec_id is not None:
+        owner = protocol.CODEC_NAMES.get(codec.codec_id)
+        if owner is not None and owner != codec.name:
+            raise ValueError(f"Codec id {codec.codec_id} is already used by {owner}")
+        protocol.CODEC_IDS[codec.name] = codec.codec_id
+        protocol.CODEC_NAMES[codec.codec_id] = codec.name
+    _codecs[codec.name] = codec
+    return codec
+
+def get_codec(name: str) -> Codec:
+    """Look a codec up by name, importing its modules on first use."""
+    codec = _codecs.get(name)
+    if codec is None:
+        if name in _disabled:
+            raise ValueError(f"Compression method {name} is not enabled on this server")
+        raise ValueError(f"Unknown compression method: {name}")
+    if not codec.loaded:
+        codec.load()
+    return codec
+
+def available_codecs():
+    """Enabled codec names, in registration order."""
+    return list(_codecs)
+
+def set_allowed_codecs(names) -> None:
+    """Restrict the registry to the given codecs; the others are never imported."""
+    names = set(names)
+    unknown = names - set(_codecs) - set(_disabled)
+    if unknown:
+        raise ValueError(f"Unknown compression method: {', '.join(sorted(unknown))}")
+    for name in list(_codecs):
+        if name not in names:
+            _disabled[name] = _codecs.pop(name)
+    for name in list(_disabled):
+        if name in names:
+            _codecs[name] = _disabled.pop(name)
+
+def configure_block_codec(name: str) -> None:
+    """Set the codec the blocks of new containers are compressed with. Checked against
+    the registry without importing the codec, which stays loaded on first use."""
+    global _block_method
+    codec = _codecs.get(name)
+    if codec is None:
+        if name in _disabled:
+            raise ValueError(f"Compression method {name} is not enabled on this server")
+        raise ValueError(f"Unknown compression method: {name}")
+    if name == "blocks" or not codec.streaming:
+        raise ValueError(f"Compression method {name} cannot be used for container blocks")
+    _block_method = name
+
+def load_report():
+    """(name, loaded, import seconds, resident bytes added) for every enabled codec."""
+    return [(codec.name, codec.loaded, codec.load_time, codec.load_memory) for codec in _codecs.values()]
+
+# Compression contexts are not thread safe, so each thread keeps its own.
+# Keys come from request parameters, so only the most recently used few are kept,
+# and at most _context_cache_limit bytes of them across all threads once configured.
+_contexts = threading.local()
+CONTEXT_CACHE_SIZE = 4
+_context_cache_limit = None
+_context_cache_bytes = 0
+_context_cache_lock = threading.Lock()
+
+def configure_context_cache(max_bytes=None) -> None:
+    """Cap the estimated bytes of contexts all threads keep between requests (None = no cap)."""
+    global _context_cache_limit
+    _context_cache_limit = max_bytes
+
+def context_cache_bytes() -> int:
+    """Estimated bytes of the contexts all threads keep cached."""
+    return _context_cache_bytes
+
+def _account_context(size: int) -> bool:
+    global _context_cache_bytes
+    with _context_cache_lock:
+        if size > 0 and _context_cache_limit is not None and _context_cache_bytes + size > _context_cache_limit:
+            return False
+        _context_cache_bytes += size
+        return True
+
+def cached_context(key, factory, cacheable=True, size=0):
+    """Return this thread's context for key, building it with factory when it is not cached.
+
+    size is an estimate of the memory the context holds on to. With cacheable false,
+    or when the cap leaves no room for it, the context is built for this use only.
+    """
+    if not cacheable:
+        return factory()
+    cache = getattr(_contexts, "cache", None)
+    if cache is None:
+        cache = _contexts.cache = OrderedDict()
+    entry = cache.get(key)
+    if entry is not None:
+        cache.move_to_end(key)
+        return entry[0]
+    context = factory()
+    if not _account_context(size):
+        return context
+    cache[key] = (context, size)
+    if len(cache) > CONTEXT_CACHE_SIZE:
+        _, (_, evicted_size) = cache.popitem(last=False)
+        _account_context(-evicted_size)
+    return context
+
+# Compression with RLE (Run-Length Encoding)
+def compress_with_rle(data: bytes) -> bytes:
+    if not data:
+        return b""
+    compressed = bytearray()
+    previous_byte = data[0]
+    count = 1
+    for current_byte in data[1:]:
+        if current_byte == previous_byte and count < 255:
+            count += 1
+        else:
+            compressed.append(previous_byte)
+            compressed.append(count)
+            previous_byte = current_byte
+            count = 1
+    compressed.append(previous_byte)
+    compressed.append(count)
+    return bytes(compressed)
+
+def decompress_with_rle(data: bytes) -> bytes:
+    decompressed = bytearray()
+    i = 0
+    while i < len(data):
+        byte = data[i]
+        count = data[i + 1]
+        decompressed.extend([byte] * count)
+        i += 2
+    return bytes(decompressed)
+
+class RLEStreamCompressor:
+    """Incremental version of compress_with_rle; runs may span chunk boundaries."""
+
+    def __init__(self):
+        self.previous_byte = None
+        self.count = 0
+
+    def compress(self, data: bytes) -> bytes:
+        compressed = bytearray()
+        for current_byte in data:
+            if current_byte == self.previous_byte and self.count < 255:
+                self.count += 1
+            else:
+                if self.previous_byte is not None:
+                    compressed.append(self.previous_byte)
+                    compressed.append(self.count)
+                self.previous_byte = current_byte
+                self.count = 1
+        return bytes(compressed)
+
+    def flush(self) -> bytes:
+        if self.previous_byte is None:
+            return b""
+        return bytes([self.previous_byte, self.count])
+
+class RLEStreamDecompressor:
+    """Incremental version of decompress_with_rle; a pair may be split across chunks."""
+
+    def __init__(self):
+        self.pending = b""
+
+    def decompress(self, data: bytes) -> bytes:
+        data = self.pending + bytes(data)
+        even_length = len(data) - len(data) % 2
+        self.pending = data[even_length:]
+        return decompress_with_rle(data[:even_length])
+
+    def flush(self) -> bytes:
+        if self.pending:
+            raise ValueError("Truncated RLE stream.")
+        return b""
+
+def emit_output(emit, output) -> None:
+    if output:
+        emit(output)
+
+def piecewise(decompressor, emit, piece_size: int):
+    """decompress_chunk for the max_length/needs_input interface of lzma, bz2 and lz4.frame."""
+    def decompress_chunk(data):
+        while True:
+            emit_output(emit, decompressor.decompress(data, piece_size))
+            if decompressor.eof or decompressor.needs_input:
+                return
+            data = b""
+    return decompress_chunk
+
+class PieceSink:
+    """File-like target of a zstd stream_writer, handing every write on."""
+
+    def __init__(self, emit):
+        self.write = lambda data: emit(bytes(data)) or len(data)
+
+def brotli_options(level=None, window_log=None) -> dict:
+    options = {}
+    if level is not None:
+        options["quality"] = level
+    if window_log:
+        options["lgwin"] = window_log
+    return options
+
+class DeflateCodec(Codec):
+    name = "deflate"
+    codec_id = 1
+    dictionary = True
+    level_range = (0, 9, 6)
+    window_log_range = (9, 15, 15)
+    modules = {"zlib": "zlib", "parallel_deflate": "parallel_deflate"}
+
+    def parallel_threads(self, size=None, window_log=None, dictionary=None) -> int:
+        """compress_threads(), but only for the plain 32 KiB window zlib streams the parallel path writes."""
+        if dictionary is not None or window_log not in (None, self.zlib.MAX_WBITS):
+            return 0
+        return self.compress_threads(size)
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        threads = self.parallel_threads(len(data), window_log, dictionary)
+        if threads > 1:
+            compressor = self.parallel_deflate.ParallelDeflateCompressor(block_pool(), threads, level)
+            return compressor.compress(data) + compressor.flush()
+        compressor, finish = self.stream_compressor(level, window_log, dictionary)
+        return compressor(data) + finish()
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        if dictionary is None:
+            return self.zlib.decompress(data, window_log or self.zlib.MAX_WBITS)
+        decompressor, finish = self.stream_decompressor(window_log, dictionary)
+        return decompressor(data) + finish()
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        threads = self.parallel_threads(None, window_log, dictionary)
+        if threads > 1:
+            compressor = self.parallel_deflate.ParallelDeflateCompressor(block_pool(), threads, level)
+            return compressor.compress, compressor.flush
+        # zlib only keeps a preset dictionary as raw window content
+        options = {} if dictionary is None else {"zdict": dictionary}
+        compressor = self.zlib.compressobj(-1 if level is None else level, self.zlib.DEFLATED,
+                                           window_log or self.zlib.MAX_WBITS, **options)
+        return compressor.compress, compressor.flush
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        options = {} if dictionary is None else {"zdict": dictionary}
+        decompressor = self.zlib.decompressobj(window_log or self.zlib.MAX_WBITS, **options)
+        return decompressor.decompress, decompressor.flush
+
+    def piecewise_decompressor(self, emit, window_log=None, dictionary=None, piece_size=DECOMPRESS_PIECE_SIZE):
+        options = {} if dictionary is None else {"zdict": dictionary}
+        decompressor = self.zlib.decompressobj(window_log or self.zlib.MAX_WBITS, **options)
+
+        def decompress_chunk(data):
+            while True:
+                piece = decompressor.decompress(data, piece_size)
+                emit_output(emit, piece)
+                # Input left over, or a full piece that may have more output behind it
+                data = decompressor.unconsumed_tail
+                if not data and len(piece) < piece_size:
+                    return
+
+        return decompress_chunk, lambda: emit_output(emit, decompressor.flush())
+
+    def compress_memory(self, level=None, window_log=None):
+        # zlib's own formula with the default memLevel of 8
+        return (1 << ((window_log or 15) + 2)) + (1 << 17)
+
+    def decompress_memory(self, window_log=None):
+        return (1 << (window_log or 15)) + 7 * 1024
+
+class DeflateMTCodec(DeflateCodec):
+    """Deflate compressed in parallel blocks, pigz style; one ordinary zlib stream."""
+    name = "deflate_mt"
+    codec_id = 12
+    multithread = True
+
+    def compress_memory(self, level=None, window_log=None):
+        # A compressor per thread plus up to two blocks per thread in flight
+        return codec_threads() * (super().compress_memory(level, window_log) + 4 * 128 * 1024)
+
+class LZMACodec(Codec):
+    name = "lzma"
+    codec_id = 2
+    level_range = (0, 9, 6)
+    window_log_range = (12, 30, 23)
+    modules = {"lzma": "lzma", "xz_blocks": "xz_blocks"}
+    # Dictionary size of each preset, as log2
+    preset_window_logs = (18, 20, 21, 22, 22, 23, 23, 24, 25, 26)
+
+    def filters(self, level=None, window_log=None):
+        """LZMA2 filter chain for a preset level with an optional dictionary size."""
+        lzma_filter = {"id": self.lzma.FILTER_LZMA2,
+                       "preset": self.lzma.PRESET_DEFAULT if level is None else level}
+        if window_log:
+            lzma_filter["dict_size"] = 1 << window_log
+        return [lzma_filter]
+
+    def parallel_compressor(self, threads, level=None, window_log=None, size=None):
+        """Compressor writing one .xz stream of independently compressed blocks."""
+        level = self.lzma.PRESET_DEFAULT if level is None else level
+        return self.xz_blocks.ParallelXZCompressor(
+            block_pool(), threads, level, 1 << (window_log or self.preset_window_logs[level]), size)
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        threads = self.compress_threads(len(data))
+        if threads > 1:
+            compressor = self.parallel_compressor(threads, level, window_log, len(data))
+            return compressor.compress(data) + compressor.flush()
+        return self.lzma.compress(data, filters=self.filters(level, window_log))
+
+    def memlimit(self, window_log=None):
+        """Decoder memory limit: what decompress_memory() assumes once decoders are bounded."""
+        return self.decompress_memory(window_log) if _bounded_decoders else None
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        return self.lzma.decompress(data, memlimit=self.memlimit(window_log))
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        threads = self.compress_threads()
+        if threads > 1:
+            compressor = self.parallel_compressor(threads, level, window_log)
+        else:
+            compressor = self.lzma.LZMACompressor(filters=self.filters(level, window_log))
+        return compressor.compress, compressor.flush
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        return self.lzma.LZMADecompressor(memlimit=self.memlimit(window_log)).decompress, lambda: b""
+
+    def piecewise_decompressor(self, emit, window_log=None, dictionary=None, piece_size=DECOMPRESS_PIECE_SIZE):
+        return piecewise(self.lzma.LZMADecompressor(memlimit=self.memlimit(window_log)), emit, piece_size), \
+               lambda: None
+
+    def compress_memory(self, level=None, window_log=None):
+        level = 6 if level is None else level
+        dict_size = 1 << (window_log or self.preset_window_logs[level])
+        # Presets 0-3 use the hash chain match finder, 4-9 the larger binary tree one (xz(1) table)
+        if level <= 3:
+            return dict_size * 15 // 2 + (1 << 20)
+        return dict_size * 11 + (4 << 20)
+
+    def decompress_memory(self, window_log=None):
+        return (1 << (window_log or self.preset_window_logs[6])) + (1 << 20)
+
+class BrotliCodec(Codec):
+    name = "brotli"
+    codec_id = 3
+    level_range = (0, 11, 11)
+    window_log_range = (10, 24, 22)
+    modules = {"brotli": "brotli"}
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        return self.brotli.compress(data, **brotli_options(level, window_log))
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        return self.brotli.decompress(data)
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        compressor = self.brotli.Compressor(**brotli_options(level, window_log))
+        return compressor.process, compressor.finish
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        return self.brotli.Decompressor().process, lambda: b""
+
+    def piecewise_decompressor(self, emit, window_log=None, dictionary=None, piece_size=DECOMPRESS_PIECE_SIZE):
+        decompressor = self.brotli.Decompressor()
+
+        def decompress_chunk(data):
+            emit_output(emit, decompressor.process(data, output_buffer_limit=piece_size))
+            # No new input may be given until the output held back has been taken
+            while not decompressor.can_accept_more_data():
+                emit_output(emit, decompressor.process(b"", output_buffer_limit=piece_size))
+
+        def finish():
+            while not decompressor.is_finished():
+                piece = decompressor.process(b"", output_buffer_limit=piece_size)
+                if not piece:
+                    return
+                emit(piece)
+
+        return decompress_chunk, finish
+
+    def compress_memory(self, level=None, window_log=None):
+        level = 11 if level is None else level
+        window = 1 << (window_log or 22)
+        # Calibrated against the resident growth of brotli.compress on incompressible input
+        if level >= 10:
+            return 2 * window + (12 << 20)
+        if level >= 5:
+            return 10 * window + (1 << 20)
+        return window // 2 + (1 << 20)
+
+    def decompress_memory(self, window_log=None):
+        # The decoder cannot be held to a window, so assume the largest a stream may ask for
+        return 1 << self.window_log_range[1]
+
+class LZ4Codec(Codec):
+    name = "lz4"
+    codec_id = 4
+    level_range = (0, 16, 0)
+    modules = {"lz4_frame": "lz4.frame"}
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        return self.lz4_frame.compress(data, compression_level=level or 0)
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        return self.lz4_frame.decompress(data)
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        compressor = self.lz4_frame.LZ4FrameCompressor(compression_level=level or 0)
+        frame_header = [compressor.begin()]
+
+        def compress_chunk(data):
+            # The frame header goes out in front of the first block
+            return (frame_header.pop() if frame_header else b"") + compressor.compress(data)
+
+        def finish():
+            return (frame_header.pop() if frame_header else b"") + compressor.flush()
+
+        return compress_chunk, finish
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        return self.lz4_frame.LZ4FrameDecompressor().decompress, lambda: b""
+
+    def piecewise_decompressor(self, emit, window_log=None, dictionary=None, piece_size=DECOMPRESS_PIECE_SIZE):
+        return piecewise(self.lz4_frame.LZ4FrameDecompressor(), emit, piece_size), lambda: None
+
+    def compress_memory(self, level=None, window_log=None):
+        return 512 * 1024  # HC state plus the 64 KiB block buffers
+
+    def decompress_memory(self, window_log=None):
+        return 128 * 1024
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    codec_id = 5
+    dictionary = True
+    level_range = (1, 22, 3)
+    window_log_range = (10, 27, 20)
+    modules = {"zstd": "zstandard"}
+    # Contexts for levels above this are not kept between requests
+    max_cached_level = 19
+    # Window decompress_memory() assumes when none is given, as log2
+    decode_window_log = 23
+
+    def compressor(self, level=None, window_log=None, dictionary=None, threads=0):
+        """This thread's cached ZstdCompressor for the given parameters; threads > 0
+        compresses with that many libzstd workers into an ordinary single frame."""
+        level = 3 if level is None else level
+
+        def factory():
+            options = {}
+            if dictionary is not None:
+                options["dict_data"] = self.zstd.ZstdCompressionDict(dictionary)
+            if window_log:
+                params = self.zstd.ZstdCompressionParameters.from_level(level, window_log=window_log,
+                                                                        threads=threads)
+                return self.zstd.ZstdCompressor(compression_params=params, **options)
+            return self.zstd.ZstdCompressor(level=level, threads=threads, **options)
+
+        # Ultra levels and custom windows build large contexts that few requests share
+        cacheable = not window_log and level <= self.max_cached_level
+        size = self.parameters(level).estimated_compression_context_size() * (threads + 1) if cacheable else 0
+        return cached_context(("zstd-c", level, window_log, dictionary, threads), factory, cacheable, size)
+
+    def parameters(self, level=None, window_log=None):
+        """Parameters for a level with the window overridden, hash and chain tables clamped
+        to the window the way libzstd clamps them before allocating."""
+        params = self.zstd.ZstdCompressionParameters.from_level(3 if level is None else level)
+        window_log = window_log or params.window_log
+        binary_tree = params.strategy >= self.zstd.STRATEGY_BTLAZY2
+        return self.zstd.ZstdCompressionParameters(
+            window_log=window_log, hash_log=min(params.hash_log, window_log + 1),
+            chain_log=min(params.chain_log, window_log + binary_tree), search_log=params.search_log,
+            min_match=params.min_match, target_length=params.target_length, strategy=params.strategy)
+
+    def decompressor(self, window_log=None, dictionary=None):
+        def factory():
+            options = {}
+            if dictionary is not None:
+                options["dict_data"] = self.zstd.ZstdCompressionDict(dictionary)
+            if window_log or _bounded_decoders:
+                options["max_window_size"] = 1 << (window_log or self.decode_window_log)
+            return self.zstd.ZstdDecompressor(**options)
+
+        return cached_context(("zstd-d", window_log, dictionary), factory, cacheable=not window_log,
+                              size=self.decompress_memory())
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        return self.compressor(level, window_log, dictionary, self.compress_threads(len(data))).compress(data)
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        # Streamed frames carry no content size, which one-shot decompress() requires
+        decompressor = self.decompressor(window_log, dictionary).decompressobj()
+        output = decompressor.decompress(data)
+        # decompressobj waits for more input where one-shot decompress() fails
+        if not decompressor.eof:
+            raise ValueError("zstd payload is truncated")
+        return output
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        compressor = self.compressor(level, window_log, dictionary, self.compress_threads()).compressobj()
+        return compressor.compress, compressor.flush
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        decompressor = self.decompressor(window_log, dictionary).decompressobj()
+        return decompressor.decompress, decompressor.flush
+
+    def piecewise_decompressor(self, emit, window_log=None, dictionary=None, piece_size=DECOMPRESS_PIECE_SIZE):
+        # decompressobj has no output limit, a stream writer hands on its output as it goes
+        writer = self.decompressor(window_log, dictionary).stream_writer(PieceSink(emit), write_size=piece_size)
+        return writer.write, lambda: None
+
+    def compress_memory(self, level=None, window_log=None):
+        return self.parameters(level, window_log).estimated_compression_context_size()
+
+    def decompress_memory(self, window_log=None):
+        return (1 << (window_log or self.decode_window_log)) + self.zstd.estimate_decompression_context_size()
+
+    def decompress_bounded(self, data, limit: int, window_log=None, dictionary=None):
+        # A frame that states its size is refused before anything is allocated for it
+        if self.zstd.frame_content_size(data) > limit:
+            raise DecompressionLimitExceeded(f"{self.name} payload decompresses to more than {limit} bytes")
+        output = super().decompress_bounded(data, limit, window_log, dictionary)
+        if self.zstd.frame_content_size(data) not in (-1, len(output)):
+            raise ValueError("zstd payload is truncated")
+        return output
+
+class ZstdMTCodec(ZstdCodec):
+    """zstd compressed by libzstd's worker threads; the frames decode like plain zstd."""
+    name = "zstd_mt"
+    codec_id = 9
+    multithread = True
+
+    def compress_memory(self, level=None, window_log=None):
+        # Every worker holds its own context and job buffers
+        return super().compress_memory(level, window_log) * (codec_threads() + 1)
+
+class Bzip2Codec(Codec):
+    name = "bzip2"
+    codec_id = 6
+    level_range = (1, 9, 9)
+    modules = {"bz2": "bz2"}
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        return self.bz2.compress(data, 9 if level is None else level)
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        return self.bz2.decompress(data)
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        compressor = self.bz2.BZ2Compressor(9 if level is None else level)
+        return compressor.compress, compressor.flush
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        return self.bz2.BZ2Decompressor().decompress, lambda: b""
+
+    def piecewise_decompressor(self, emit, window_log=None, dictionary=None, piece_size=DECOMPRESS_PIECE_SIZE):
+        return piecewise(self.bz2.BZ2Decompressor(), emit, piece_size), lambda: None
+
+    def compress_memory(self, level=None, window_log=None):
+        # The level is the block size in 100 kB units (bzip2(1) memory table)
+        return 400 * 1000 + (9 if level is None else level) * 800 * 1000
+
+    def decompress_memory(self, window_log=None):
+        return 100 * 1000 + 9 * 400 * 1000
+
+class LZMAMTCodec(LZMACodec):
+    """xz compressed as independent blocks in parallel; one standard multi-block .xz stream."""
+    name = "lzma_mt"
+    codec_id = 10
+    multithread = True
+
+    def compress_memory(self, level=None, window_log=None):
+        # Up to two blocks per thread in flight, each up to three dictionaries of input
+        dict_size = 1 << (window_log or self.preset_window_logs[6 if level is None else level])
+        return codec_threads() * (super().compress_memory(level, window_log) + 12 * dict_size)
+
+class RLECodec(Codec):
+    name = "rle"
+    codec_id = 7
+    releases_gil = False
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        return compress_with_rle(data)
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        return decompress_with_rle(data)
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        compressor = RLEStreamCompressor()
+        return compressor.compress, compressor.flush
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        decompressor = RLEStreamDecompressor()
+        return decompressor.decompress, decompressor.flush
+
+class LosslessImageCodec(Codec):
+    name = "lossless_image"
+    codec_id = 8
+    streaming = False
+    releases_gil = False
+    modules = {"Image": "PIL.Image"}
+
+    def compress_image(self, image_bytes: bytes) -> bytes:
+        """Compress an image using lossless JPEG compression."""
+        with self.Image.open(io.BytesIO(image_bytes)) as img:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=100, optimize=True)
+            return buffer.getvalue()
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        return self.compress_image(data)  # Image is compressed in lossless JPEG
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        return self.compress_image(data)  # In this case, it's recompression
+
+class BlockContainerCodec(Codec):
+    """Seekable container of independently compressed blocks, see block_container.py.
+
+    The level applies to the block codec and the window log sets the block size.
+    """
+    name = "blocks"
+    codec_id = 11
+    dictionary = True
+    window_log_range = (16, 26, 20)
+    modules = {"container": "block_container"}
+
+    @property
+    def block_method(self) -> str:
+        """Codec new containers are compressed with, see configure_block_codec()."""
+        return _block_method
+
+    def compress(self, data, level=None, window_log=None, dictionary=None):
+        return self.container.compress_blocks(data, self.block_method, level, 1 << (window_log or 20), dictionary)
+
+    def decompress(self, data, window_log=None, dictionary=None):
+        return self.container.decompress_blocks(data, dictionary)
+
+    def decompress_bounded(self, data, limit: int, window_log=None, dictionary=None):
+        # The index states every block's size, and each block is held to its own
+        reader = self.container.BlockReader(data, dictionary)
+        if max(len(reader), sum(entry.size for entry in reader.entries)) > limit:
+            raise DecompressionLimitExceeded(f"{self.name} payload decompresses to more than {limit} bytes")
+        return reader.read()
+
+    def stream_compressor(self, level=None, window_log=None, dictionary=None):
+        compressor = self.container.BlockStreamCompressor(self.block_method, level, 1 << (window_log or 20),
+                                                          dictionary)
+        return compressor.compress, compressor.flush
+
+    def stream_decompressor(self, window_log=None, dictionary=None):
+        decompressor = self.container.BlockStreamDecompressor(dictionary)
+        return decompressor.decompress, decompressor.flush
+
+    def compress_memory(self, level=None, window_log=None):
+        # Every thread holds a block, its output and a compressor
+        block_size = 1 << (window_log or 20)
+        return codec_threads() * (2 * block_size + get_codec(self.block_method).compress_memory(level))
+
+    def decompress_memory(self, window_log=None):
+        return codec_threads() * 2 * (1 << (window_log or 20))
+
+for codec in (DeflateCodec(), LZMACodec(), BrotliCodec(), LZ4Codec(), ZstdCodec(),
+              Bzip2Codec(), RLECodec(), LosslessImageCodec(), ZstdMTCodec(), LZMAMTCodec(),
+              BlockContainerCodec(), DeflateMTCodec()):
+    register_codec(codec)
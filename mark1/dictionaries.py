@@ -0,0 +1,89 @@
+import argparse
+import os
+import threading
+
+# Versioned compression dictionaries shared by the satellite and the ground station.
+#
+# Dictionaries are stored as <id>.dict files in one directory. A new training
+# run always gets a fresh, higher id and old files are kept, so payloads that
+# are still in flight can be decoded with the dictionary they were made with.
+# Id 0 means "no dictionary" in the binary header.
+
+DICTIONARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dictionaries")
+DEFAULT_DICTIONARY_SIZE = 16 * 1024
+
+def train_dictionary(samples, dict_size=DEFAULT_DICTIONARY_SIZE) -> bytes:
+    """Train a zstd dictionary from a list of sample frames.
+
+    The result also works as a deflate preset dictionary, since zlib only
+    uses its trailing 32 KiB of content.
+    """
+    import zstandard  # Only needed for training, so servers never load it for this module
+    return zstandard.train_dictionary(dict_size, list(samples)).as_bytes()
+
+def split_frames(data: bytes, frame_size: int):
+    """Cut a raw capture into fixed-size frames, e.g. 256-byte TMTC frames."""
+    return [data[i:i + frame_size] for i in range(0, len(data), frame_size)]
+
+class DictionaryStore:
+    def __init__(self, directory=DICTIONARY_DIR):
+        self.directory = directory
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def path(self, dict_id: int) -> str:
+        return os.path.join(self.directory, f"{dict_id:08d}.dict")
+
+    def ids(self):
+        """Stored dictionary ids, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name[:-5]) for name in os.listdir(self.directory)
+                      if name.endswith(".dict") and name[:-5].isdigit())
+
+    def add(self, dictionary: bytes) -> int:
+        """Store a dictionary under the next free id and return that id."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            ids = self.ids()
+            dict_id = ids[-1] + 1 if ids else 1
+            with open(self.path(dict_id), "wb") as f:
+                f.write(dictionary)
+            self._cache[dict_id] = dictionary
+        return dict_id
+
+    def get(self, dict_id: int) -> bytes:
+        """Dictionary bytes for an id; the same object is returned on every call."""
+        dictionary = self._cache.get(dict_id)
+        if dictionary is None:
+            try:
+                with open(self.path(dict_id), "rb") as f:
+                    dictionary = f.read()
+            except FileNotFoundError:
+                raise ValueError(f"Unknown dictionary id: {dict_id}")
+            with self._lock:
+                dictionary = self._cache.setdefault(dict_id, dictionary)
+        return dictionary
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a compression dictionary from captured frames")
+    parser.add_argument("captures", nargs="+",
+                        help="Sample files; with --frame-size each file is cut into frames")
+    parser.add_argument("--frame-size", type=int, default=0,
+                        help="Split captures into frames of this many bytes (0 keeps one sample per file)")
+    parser.add_argument("--size", type=int, default=DEFAULT_DICTIONARY_SIZE, help="Dictionary size in bytes")
+    parser.add_argument("--dictionary-dir", default=DICTIONARY_DIR)
+    args = parser.parse_args()
+
+    samples = []
+    for capture in args.captures:
+        with open(capture, "rb") as f:
+            data = f.read()
+        samples.extend(split_frames(data, args.frame_size) if args.frame_size else [data])
+
+    dictionary = train_dictionary(samples, args.size)
+    dict_id = DictionaryStore(args.dictionary_dir).add(dictionary)
+    print(f"Trained a {len(dictionary)} byte dictionary from {len(samples)} samples, stored as id {dict_id}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from codec_registry import get_codec
+from protocol import SESSION_RESPONSE_FORMAT, SESSION_RESPONSE_SIZE, EXTENDED_STATS_SIZE, STAGE_TIMINGS_SIZE, \
+                     STREAM_CHUNK_FORMAT, STREAM_CHUNK_HEADER_SIZE, STREAM_ERROR_MARKER, FLAG_CHUNKED, \
+                     FLAG_SHARED, FLAG_STREAM, FLAG_TIMINGS, STATUS_OK, BufferPool, pack_header, \
+                     pack_stream_chunk_header, recv_exactly, recv_exactly_into, send_buffers, \
+                     unpack_extended_stats, unpack_stage_timings
+from transport import DEFAULT_SOCKET_PATH, connect, describe, share_payload, shared_ring
+
+# Persistent connections from the ground station to its satellites.
+#
+# Binary-header connections stay open between requests, so the client keeps
+# idle ones in a pool per endpoint instead of paying connection setup on
+# every send. An idle connection is checked before it is reused and dropped
+# once it has been idle for longer than the satellite waits for the next
+# header; an endpoint that refuses connections is not tried again until its
+# backoff, doubling with every failure, has run out. Responses are received
+# into pooled buffers.
+#
+# Streamed uploads get a connection of their own: the payload is compressed
+# chunk by chunk on the calling thread, sent on a second one through a
+# bounded queue and the satellite's streamed response is read on a third,
+# so only a few chunks are held at a time and compression overlaps with
+# the transfer in both directions. The idle connections of the endpoint are
+# closed first, since a sync satellite serves one connection at a time.
+
+DEFAULT_MAX_IDLE = 4
+# Below the satellite's default read timeout of 15 s
+DEFAULT_IDLE_TIMEOUT = 10.0
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+# Compressed chunks waiting to be sent during a streamed upload
+UPLOAD_QUEUE_DEPTH = 4
+
+Endpoint = namedtuple("Endpoint", ["transport", "server_ip", "server_port", "socket_path"],
+                      defaults=["tcp", '127.0.0.1', 1222, DEFAULT_SOCKET_PATH])
+
+Response = namedtuple("Response", ["stats", "timings", "payload"])
+
+StreamResult = namedtuple("StreamResult", ["stats", "timings", "sent_size", "received_size"])
+
+def parse_endpoint(spec: str) -> Endpoint:
+    """"host:port" for tcp, "unix:/path" or "shm:/path" for the local transports."""
+    transport, _, path = spec.partition(":")
+    if transport in ("unix", "shm"):
+        return Endpoint(transport, socket_path=path or DEFAULT_SOCKET_PATH)
+    host, _, port = spec.rpartition(":")
+    return Endpoint("tcp", host or '127.0.0.1', int(port))
+
+def is_alive(sock) -> bool:
+    """An idle connection is usable while it has nothing to read and has not been closed by the peer."""
+    # With a timeout set, recv would wait for data instead of reporting there is none
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(timeout)
+    # Either closed, or bytes nobody asked for: the connection is out of step
+    return False
+
+def recv_patiently(sock, view, waiting) -> None:
+    """recv_exactly_into that keeps going past socket timeouts for as long as waiting() is true."""
+    received = 0
+    while received < len(view):
+        try:
+            count = sock.recv_into(view[received:])
+        except socket.timeout:
+            if waiting():
+                continue
+            raise
+        if count == 0:
+            raise ConnectionError("Connection closed unexpectedly.")
+        received += count
+
+class GroundStationClient:
+    """Pool of persistent satellite connections, safe to share between threads."""
+
+    def __init__(self, endpoints, timeout=15, max_idle=DEFAULT_MAX_IDLE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.endpoints = list(endpoints)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.buffer_pool = BufferPool()
+        self._idle = {endpoint: [] for endpoint in self.endpoints}  # (socket, idle since)
+        self._failures = {endpoint: 0 for endpoint in self.endpoints}
+        self._retry_at = {endpoint: 0.0 for endpoint in self.endpoints}
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.reuses = 0
+
+    def _connect(self, endpoint: Endpoint):
+        wait = self._retry_at[endpoint] - time.monotonic()
+        if wait > 0:
+            raise ConnectionError(f"{describe(*endpoint)} is unreachable, next attempt in {wait:.1f} s")
+        try:
+            sock = connect(*endpoint, timeout=self.timeout)
+        except OSError:
+            with self._lock:
+                self._failures[endpoint] += 1
+                backoff = min(MAX_BACKOFF, MIN_BACKOFF * 2 ** (self._failures[endpoint] - 1))
+                self._retry_at[endpoint] = time.monotonic() + backoff
+            raise
+        with self._lock:
+            self._failures[endpoint] = 0
+            self.connects += 1
+        return sock
+
+    def _pop_idle(self, endpoint: Endpoint):
+        """Most recently used idle connection that is still alive, or None."""
+        while True:
+            with self._lock:
+                if not self._idle[endpoint]:
+                    return None
+                sock, idle_since = self._idle[endpoint].pop()
+            if time.monotonic() - idle_since < self.idle_timeout and is_alive(sock):
+                with self._lock:
+                    self.reuses += 1
+                return sock
+            sock.close()
+
+    def acquire(self, endpoint=None, fresh=False):
+        """(endpoint, socket, reused) for the given endpoint, or else the first one that can be reached.
+
+        fresh skips the pool, for requests that end their connection, and closes the
+        endpoint's idle connections first.
+        """
+        error = None
+        for candidate in [endpoint] if endpoint else self.endpoints:
+            if fresh:
+                self.close_idle(candidate)
+            sock = None if fresh else self._pop_idle(candidate)
+            if sock is not None:
+                return candidate, sock, True
+            try:
+                return candidate, self._connect(candidate), False
+            except OSError as e:
+                error = e
+        raise error
+
+    def release(self, endpoint: Endpoint, sock, reusable=True) -> None:
+        """Return a connection to the pool, or close it when it is out of step or the pool is full."""
+        with self._lock:
+            if reusable and len(self._idle[endpoint]) < self.max_idle:
+                self._idle[endpoint].append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    def _exchange(self, sock, endpoint: Endpoint, payload, compression_method: str, header_fields: dict):
+        """One binary-header request; returns (status, pooled buffer, body view)."""
+        shared_offset = share_payload(payload) if endpoint.transport == "shm" else None
+        try:
+            flags = header_fields.get("flags", 0) | FLAG_TIMINGS | (FLAG_SHARED if shared_offset is not None else 0)
+            header = pack_header(compression_method, len(payload), **dict(header_fields, flags=flags))
+            if shared_offset is not None:
+                send_buffers(sock, [header, shared_ring().descriptor(shared_offset)])
+            else:
+                send_buffers(sock, [header, payload])
+            _, status, body_length = struct.unpack(SESSION_RESPONSE_FORMAT,
+                                                   recv_exactly(sock, SESSION_RESPONSE_SIZE))
+        except BaseException:
+            # The satellite drops its view of the segment once the connection is gone,
+            # so close it before the region is handed back
+            if shared_offset is not None:
+                sock.close()
+            raise
+        finally:
+            if shared_offset is not None:
+                shared_ring().free(shared_offset)
+        buffer = self.buffer_pool.acquire(body_length)
+        body = memoryview(buffer)[:body_length]
+        try:
+            recv_exactly_into(sock, body)
+        except BaseException:
+            body.release()
+            self.buffer_pool.release(buffer)
+            raise
+        return status, buffer, body
+
+    @contextmanager
+    def transcode(self, payload, compression_method: str, endpoint=None, **header_fields):
+        """Send one request over a pooled connection and yield its Response.
+
+        header_fields are pack_header keywords. The response payload is a view of a
+        pooled buffer and only valid inside the with block. A reused connection the
+        satellite has closed in the meantime is replaced once, transparently.
+        """
+        while True:
+            used, sock, reused = self.acquire(endpoint)
+            try:
+                status, buffer, body = self._exchange(sock, used, payload, compression_method, header_fields)
+            except ConnectionError:
+                self.release(used, sock, reusable=False)
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                self.release(used, sock, reusable=False)
+                raise
+            break
+        self.release(used, sock)
+        try:
+            if status != STATUS_OK:
+                raise RuntimeError(bytes(body).decode('utf-8', errors='replace'))
+            stats = unpack_extended_stats(body)
+            timings = unpack_stage_timings(body)
+            with body[EXTENDED_STATS_SIZE + STAGE_TIMINGS_SIZE:] as recompressed_payload:
+                yield Response(stats, timings, recompressed_payload)
+        finally:
+            body.release()
+            self.buffer_pool.release(buffer)
+
+    def _receive_stream(self, sock, on_output, waiting):
+        """Read a streamed response, handing every recompressed chunk to on_output.
+
+        Returns (stats, timings, recompressed size); raises RuntimeError when the satellite failed.
+        """
+        frame_header = bytearray(STREAM_CHUNK_HEADER_SIZE)
+        received_size = 0
+        while True:
+            recv_patiently(sock, memoryview(frame_header), waiting)
+            chunk_size = struct.unpack(STREAM_CHUNK_FORMAT, frame_header)[0]
+            if chunk_size == STREAM_ERROR_MARKER:
+                message_size = struct.unpack("!I", recv_exactly(sock, 4))[0]
+                raise RuntimeError(recv_exactly(sock, message_size).decode('utf-8', errors='replace'))
+            if chunk_size == 0:
+                break
+            buffer = self.buffer_pool.acquire(chunk_size)
+            try:
+                with memoryview(buffer)[:chunk_size] as chunk:
+                    recv_patiently(sock, chunk, waiting)
+                    if on_output is not None:
+                        on_output(chunk)
+            finally:
+                self.buffer_pool.release(buffer)
+            received_size += chunk_size
+        trailer = recv_exactly(sock, EXTENDED_STATS_SIZE + STAGE_TIMINGS_SIZE)
+        return unpack_extended_stats(trailer), unpack_stage_timings(trailer), received_size
+
+    def stream_transcode(self, chunks, compression_method: str, size_hint=0, level=None, window_log=None,
+                         dictionary=None, endpoint=None, on_output=None, **header_fields) -> StreamResult:
+        """Compress the payload chunk by chunk while it is sent and the response streams back.
+
+        chunks yields the uncompressed payload in pieces; size_hint (the uncompressed size will do)
+        lets the satellite schedule the request. on_output gets every recompressed chunk as a view
+        that is only valid during the call. header_fields are further pack_header keywords.
+        """
+        compress_chunk, finish = get_codec(compression_method).stream_compressor(level, window_log, dictionary)
+        flags = header_fields.get("flags", 0) | FLAG_STREAM | FLAG_CHUNKED | FLAG_TIMINGS
+        header = pack_header(compression_method, size_hint, level, window_log, **dict(header_fields, flags=flags))
+        used, sock, _ = self.acquire(endpoint, fresh=True)
+        outgoing = queue.Queue(UPLOAD_QUEUE_DEPTH)
+        uploading = threading.Event()
+        uploading.set()
+        outcome = {}
+
+        def send():
+            try:
+                while (buffers := outgoing.get()) is not None:
+                    if "send_error" not in outcome:
+                        send_buffers(sock, buffers)
+            except OSError as e:
+                # The satellite stopped reading; why arrives on the receiving side
+                outcome["send_error"] = e
+                while outgoing.get() is not None:
+                    pass
+            finally:
+                uploading.clear()
+
+        def receive():
+            try:
+                outcome["result"] = self._receive_stream(sock, on_output, uploading.is_set)
+            except BaseException as e:
+                outcome["receive_error"] = e
+
+        sender = threading.Thread(target=send, name="uplink-send", daemon=True)
+        receiver = threading.Thread(target=receive, name="uplink-receive", daemon=True)
+        sender.start()
+        receiver.start()
+        sent_size = 0
+        try:
+            try:
+                outgoing.put([header])
+                for chunk in chunks:
+                    if "send_error" in outcome or "receive_error" in outcome:
+                        break
+                    output = compress_chunk(chunk)
+                    if output:
+                        outgoing.put([pack_stream_chunk_header(output), output])
+                        sent_size += len(output)
+                else:
+                    output = finish()
+                    if output:
+                        outgoing.put([pack_stream_chunk_header(output), output])
+                        sent_size += len(output)
+                    outgoing.put([pack_stream_chunk_header(b"")])
+            finally:
+                outgoing.put(None)
+                sender.join()
+        except BaseException:
+            # Unblock the receiver, the satellite would otherwise wait for the rest of the payload
+            sock.shutdown(socket.SHUT_RDWR)
+            raise
+        finally:
+            receiver.join()
+            sock.close()
+        if "receive_error" in outcome:
+            raise outcome["receive_error"]
+        if "send_error" in outcome:
+            raise outcome["send_error"]
+        stats, timings, received_size = outcome["result"]
+        return StreamResult(stats, timings, sent_size, received_size)
+
+    def counters(self) -> dict:
+        with self._lock:
+            return {"connects": self.connects, "reuses": self.reuses,
+                    "idle": sum(len(idle) for idle in self._idle.values())}
+
+    def close_idle(self, endpoint=None) -> None:
+        """Close the idle connections of one endpoint, or of all of them.
+
+        A sync satellite serves one connection at a time and would otherwise wait
+        on an idle one of ours before it gets to a new connection.
+        """
+        with self._lock:
+            pools = [self._idle[endpoint]] if endpoint else list(self._idle.values())
+            idle = [sock for connections in pools for sock, _ in connections]
+            for connections in pools:
+                connections.clear()
+        for sock in idle:
+            sock.close()
+
+    def close(self) -> None:
+        self.close_idle()
@@ -1,78 +1,117 @@
 import streamlit as st
-import brotli
-import lz4.frame
-import zlib
+import hashlib
+import mmap
 import random
 import math
-import bz2
-import zstandard as zstd
-import lzma
-from PIL import Image
-import io
 from collections import Counter
+from contextlib import closing, contextmanager, suppress
+import os
 import socket
 import struct
-
-# Compression functions
-def compress_with_rle(data: bytes) -> bytes:
-    """Compress data using Run-Length Encoding (RLE)."""
-    if not data:
-        return b""
-
-    compressed = bytearray()
-    previous_byte = data[0]
-    count = 1
-
-    for current_byte in data[1:]:
-        if current_byte == previous_byte and count < 255:  # Limit run length to 255 to fit in a byte
-            count += 1
-        else:
-            compressed.append(previous_byte)
-            compressed.append(count)
-            previous_byte = current_byte
-            count = 1
-
-    # Append the last byte and its count
-    compressed.append(previous_byte)
-    compressed.append(count)
-
-    return bytes(compressed)
-
-def compress_with_bzip2(data: bytes) -> bytes:
-    """Compress data using Bzip2."""
-    return bz2.compress(data)
-
-def compress_with_zstd(data: bytes) -> bytes:
-    """Compress data using Zstandard."""
-    cctx = zstd.ZstdCompressor()
-    return cctx.compress(data)
-
-def compress_with_lzma(data: bytes) -> bytes:
-    """Compress data using LZMA."""
-    return lzma.compress(data)
-
-def compress_with_brotli(data: bytes) -> bytes:
-    return brotli.compress(data)
-
-def compress_with_lz4(data: bytes) -> bytes:
-    return lz4.frame.compress(data)
-
-def compress_with_deflate(data: bytes) -> bytes:
-    return zlib.compress(data)
-
-def compress_image_lossless(image_path: bytes) -> bytes:
-    """Compress an image using lossless JPEG compression."""
-    with Image.open(io.BytesIO(image_path)) as img:
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=100, optimize=True)
-        return buffer.getvalue()
+import threading
+from block_container import BlockReader, compress_blocks
+from codec_comparison import DEFAULT_LINK_RATE, CodecComparator, compress_speed, decompress_speed, level_grid, \
+                             ratio, time_on_air
+from codec_registry import available_codecs, get_codec
+from ground_client import Endpoint, GroundStationClient, parse_endpoint
+from transport import DEFAULT_SOCKET_PATH, connect
+from dictionaries import DEFAULT_DICTIONARY_SIZE, DictionaryStore, split_frames, train_dictionary
+from result_cache import DEFAULT_CACHE_BYTES, ResultCache, cache_key
+from protocol import SESSION_PREAMBLE, SESSION_RESPONSE_FORMAT, SESSION_RESPONSE_SIZE, FLAG_STREAM, \
+                     FLAG_SMALLEST, STREAM_CHUNK_FORMAT, STREAM_CHUNK_HEADER_SIZE, STREAM_ERROR_MARKER, \
+                     STATS_HEADER_FORMAT, STATS_HEADER_SIZE, EXTENDED_STATS_SIZE, STATUS_OK, \
+                     PRIORITY_AUTO, PRIORITY_COMMAND, PRIORITY_NORMAL, PRIORITY_BULK, \
+                     pack_header, pack_session_frame, unpack_extended_stats, recv_exactly, send_buffers
+
+dictionary_store = DictionaryStore()
+
+# Link to the satellite: tcp, or unix / shm when both run on this host (see transport.py)
+TRANSPORT = os.environ.get("MARK1_TRANSPORT", "tcp")
+SOCKET_PATH = os.environ.get("MARK1_SOCKET_PATH", DEFAULT_SOCKET_PATH)
+
+# Satellites to send to, in order of preference, e.g. "10.0.0.2:1222,unix:/tmp/mark1-satellite.sock"
+ENDPOINTS = [parse_endpoint(spec) for spec in os.environ.get("MARK1_ENDPOINTS", "").split(",") if spec] \
+            or [Endpoint(TRANSPORT, '127.0.0.1', 1222, SOCKET_PATH)]
+
+@st.cache_resource
+def satellite_client() -> GroundStationClient:
+    """Connection pool kept across reruns and shared by every session of this ground station."""
+    return GroundStationClient(ENDPOINTS)
+
+@st.cache_resource
+def result_cache() -> ResultCache:
+    """Entropy and compression results shared by every session, bounded by their total size."""
+    return ResultCache(DEFAULT_CACHE_BYTES)
+
+def memoized(payload, name: str, options: dict, compute):
+    """compute() once per distinct payload, name and options; it returns (value, result bytes)."""
+    cache = result_cache()
+    key = cache_key(payload, name, options)
+    cached = cache.get(key)
+    if cached is None:
+        cached = compute()
+        cache.put(key, *cached)
+    return cached
+
+@st.cache_resource
+def codec_comparator() -> CodecComparator:
+    """Comparison pools kept across reruns."""
+    return CodecComparator()
+
+# How the winner of a codec comparison is picked, from a result and the link rate
+WINNER_CRITERIA = {
+    "Shortest time on air": lambda result, link_rate: time_on_air(result, link_rate),
+    "Shortest compression plus time on air":
+        lambda result, link_rate: result.compress_time + time_on_air(result, link_rate),
+    "Fastest decompression": lambda result, link_rate: result.decompress_time,
+}
+
+# Scheduling class asked of the satellite; Auto lets it decide by payload size
+PRIORITIES = {"Auto": PRIORITY_AUTO, "Telecommand": PRIORITY_COMMAND, "Normal": PRIORITY_NORMAL,
+              "Bulk": PRIORITY_BULK}
 
 # Read file bytes
 def read_file(file) -> bytes:
     return file.read()
 
+# Uncompressed bytes read per step of a streamed upload
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+@contextmanager
+def uploaded_buffer(file):
+    """The bytes of an uploaded file, without copying them."""
+    with file.getbuffer() as view:
+        yield view
+
+@contextmanager
+def mapped_file(path: str):
+    """A file on this machine, memory-mapped so only the pages being compressed are resident."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(mapped) as view:
+                yield view
+        except BaseException:
+            # A view the traceback still holds would make close() raise over the actual error;
+            # the mapping then goes when the last view does
+            with suppress(BufferError):
+                mapped.close()
+            raise
+        mapped.close()
+
+def upload_chunks(view, on_progress=None):
+    """view in UPLOAD_CHUNK_SIZE slices for a streamed upload.
+
+    Every slice is released once the next one is taken or the generator is closed,
+    so the buffer behind view can be closed even when the upload fails part way.
+    """
+    size = len(view)
+    for start in range(0, size, UPLOAD_CHUNK_SIZE):
+        with view[start:start + UPLOAD_CHUNK_SIZE] as chunk:
+            yield chunk
+        if on_progress is not None:
+            on_progress(min(1.0, (start + UPLOAD_CHUNK_SIZE) / size))
+
 # Entropy calculation
 def calculate_entropy(data: bytes) -> float:
     if not data:
@@ -110,87 +149,230 @@ def simulate_transmission(payload: bytes, compressed_payload: bytes):
     else:
         st.write("Compression did not reduce the size.")
 
-def send_payload_to_server(compressed_payload: bytes, compression_method: str) -> None:
-    server_ip = '127.0.0.1'
-    server_port = 1222  # Updated port to 1222
-
+def send_payload_to_server(compressed_payload: bytes, compression_method: str, level=None, window_log=None,
+                           dict_id=None, target_method=None, target_level=None, deadline_ms=None,
+                           priority=PRIORITY_AUTO) -> None:
+    """deadline_ms asks the satellite for the smallest of its candidate codecs instead of target_method."""
+    client = satellite_client()
     try:
-        sock_fd = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock_fd.settimeout(15)
-        st.write(f"Connecting to satellite...")
-
-        sock_fd.connect((server_ip, server_port))
-        st.write(f"Connected to satellite!")
-
-        preamble_bytes = b'\xaa\xbb\xcc\xdd'
-        size_header = struct.pack("!I", len(compressed_payload))  # 4-byte header in network byte order
-        method_header = f"{compression_method}\n".encode('utf-8')  # Compression method followed by newline
-        full_message = preamble_bytes + size_header + method_header + compressed_payload
-
-        # Send the compression method and the compressed payload with null termination
         st.write(f"Sending {compression_method} compressed payload (size: {len(compressed_payload)} bytes)...")
-        sock_fd.sendall(full_message)
-        st.write("Payload sent.")
-
-        # Define the format for the packed header
-        header_format = "iii f"
-        header_size = struct.calcsize(header_format)
-
-        # Receive the packed header first
-        packed_header = b""
-        while len(packed_header) < header_size:
-            try:
-                chunk = sock_fd.recv(header_size - len(packed_header))
-                if not chunk:
-                    raise socket.error("Connection closed unexpectedly")
-                packed_header += chunk
-            except socket.timeout:
-                st.write("Timeout while waiting for server response")
-                return
-
-        if len(packed_header) != header_size:
-            st.write("Error: Incomplete header received")
-            return
-
-        # Unpack the header
-        original_size, decompressed_size, recompressed_size, compression_ratio = struct.unpack(header_format, packed_header)
-
-        # Display the stats
-        st.write("Stats received from satellite:")
-        st.write(f"Size of the received payload (in compressed form): {original_size} bytes")
-        st.write(f"Decompressed size: {decompressed_size} bytes")
-        st.write(f"Recompressed size: {recompressed_size} bytes")
-        st.write(f"Compression ratio: {compression_ratio:.2f}%")
-
-        recompressed_payload = b""
-        received_bytes = 0  # Track the number of bytes received so far
-
-        while received_bytes < recompressed_size:
-            try:
-                # Receive up to 1024 bytes or the remaining bytes, whichever is smaller
-                chunk = sock_fd.recv(min(1024, recompressed_size - received_bytes))
-        
-                if not chunk:
-                    raise socket.error("Connection closed unexpectedly")
-        
-                recompressed_payload += chunk
-                received_bytes += len(chunk)
-    
-            except socket.timeout:
-                st.write("Timeout while waiting for the recompressed payload")
-                return
-
-        # Process the recompressed payload (if needed)
-        st.write(f"Received recompressed payload of size: {len(recompressed_payload)} bytes")
-
+        # Binary header carrying the codec and the parameters the satellite should recompress with
+        with client.transcode(compressed_payload, compression_method, level=level, window_log=window_log,
+                              dict_id=dict_id, target_method=target_method, target_level=target_level,
+                              flags=FLAG_SMALLEST if deadline_ms else 0, deadline_ms=deadline_ms,
+                              priority=priority) as response:
+            # Display the stats
+            st.write("Stats received from satellite:")
+            show_transcode_stats(response.stats, response.timings)
+
+            # Process the recompressed payload (if needed)
+            st.write(f"Received recompressed payload of size: {len(response.payload)} bytes")
+            if response.stats.target_method == "blocks":
+                show_container(response.payload, dictionary_store.get(dict_id) if dict_id else None)
+    except socket.timeout:
+        st.write("Timeout while waiting for server response")
+    except RuntimeError as e:
+        st.write(str(e))
     except socket.error as e:
         st.write(f"Socket error: {e}")
-    finally:
-        sock_fd.close()
+    counters = client.counters()
+    st.caption(f"Satellite link: {counters['connects']} connections opened, {counters['reuses']} reused")
+
+def send_payloads_in_session(payloads, server_ip='127.0.0.1', server_port=1222, timeout=15):
+    """Send many (compressed_payload, compression_method) pairs over one connection.
+
+    Requests are pipelined and tagged with their index as request ID; the satellite
+    answers them as they complete, so responses are matched back by ID.
+    Returns a dict of request ID -> (stats tuple, recompressed payload) or error message.
+    """
+    results = {}
+    # A sync satellite would wait on the idle pooled connections before this one
+    satellite_client().close_idle()
+    with connect(TRANSPORT, server_ip, server_port, SOCKET_PATH, timeout) as sock_fd:
+        frames = [pack_session_frame(request_id, compressed_payload, compression_method)
+                  for request_id, (compressed_payload, compression_method) in enumerate(payloads)]
+        sock_fd.sendall(SESSION_PREAMBLE + b"".join(frames))
+        # Tell the satellite no more requests are coming; it closes once all are answered
+        sock_fd.shutdown(socket.SHUT_WR)
+
+        while len(results) < len(payloads):
+            request_id, status, body_length = struct.unpack(
+                SESSION_RESPONSE_FORMAT, recv_exactly(sock_fd, SESSION_RESPONSE_SIZE))
+            body = recv_exactly(sock_fd, body_length)
+            if status == STATUS_OK:
+                stats = struct.unpack(STATS_HEADER_FORMAT, body[:STATS_HEADER_SIZE])
+                results[request_id] = (stats, body[STATS_HEADER_SIZE:])
+            else:
+                results[request_id] = body.decode('utf-8', errors='replace')
+    return results
+
+def send_payload_streaming(compressed_payload: bytes, compression_method: str, level=None, window_log=None, dict_id=None,
+                           target_method=None, target_level=None, priority=PRIORITY_AUTO, on_chunk=None,
+                           server_ip='127.0.0.1', server_port=1222, timeout=15):
+    """Send a payload in streaming mode, reading the chunked response while it is sent.
+
+    The satellite answers before it has read the whole payload, so the payload goes out
+    on its own thread; on_chunk gets every recompressed chunk as it arrives.
+    Returns (TranscodeStats, number of chunks received).
+    """
+    # A sync satellite would wait on the idle pooled connections before this one
+    satellite_client().close_idle()
+    with connect(TRANSPORT, server_ip, server_port, SOCKET_PATH, timeout) as sock_fd:
+        header = pack_header(compression_method, len(compressed_payload), level, window_log,
+                             flags=FLAG_STREAM, dict_id=dict_id,
+                             target_method=target_method, target_level=target_level, priority=priority)
+        send_errors = []
+
+        def send():
+            try:
+                send_buffers(sock_fd, [header, compressed_payload])
+            except OSError as e:
+                # The satellite stopped reading; why arrives on the receiving side
+                send_errors.append(e)
+
+        sender = threading.Thread(target=send, name="stream-send", daemon=True)
+        sender.start()
+        try:
+            chunk_count = 0
+            while True:
+                chunk_size = struct.unpack(STREAM_CHUNK_FORMAT, recv_exactly(sock_fd, STREAM_CHUNK_HEADER_SIZE))[0]
+                if chunk_size == STREAM_ERROR_MARKER:
+                    message_size = struct.unpack("!I", recv_exactly(sock_fd, 4))[0]
+                    raise RuntimeError(recv_exactly(sock_fd, message_size).decode('utf-8', errors='replace'))
+                if chunk_size == 0:
+                    break
+                chunk = recv_exactly(sock_fd, chunk_size)
+                chunk_count += 1
+                if on_chunk is not None:
+                    on_chunk(chunk)
+            stats = unpack_extended_stats(recv_exactly(sock_fd, EXTENDED_STATS_SIZE))
+        except BaseException:
+            # Unblock the sender, the satellite will not read the rest of the payload
+            sock_fd.shutdown(socket.SHUT_RDWR)
+            raise
+        finally:
+            sender.join()
+    if send_errors:
+        raise send_errors[0]
+    return stats, chunk_count
+
+def show_transcode_stats(stats, timings=None) -> None:
+    """Show uplink and downlink sizes and where the satellite spent its time."""
+    st.write(f"Size of the received payload (in compressed form): {stats.original_size} bytes ({stats.source_method})")
+    st.write(f"Decompressed size: {stats.decompressed_size} bytes")
+    st.write(f"Recompressed size: {stats.recompressed_size} bytes ({stats.target_method})")
+    # What the satellite actually ran with, which a memory-budgeted satellite may have lowered
+    st.write(f"Downlink level: {'default' if stats.target_level is None else stats.target_level}, "
+             f"window log: {stats.target_window_log or 'default'}")
+    st.write(f"Compression ratio: {stats.compression_ratio:.2f}%")
+    st.write(f"Decompression time ({stats.source_method}): {stats.decompress_time * 1000:.2f} ms")
+    st.write(f"Recompression time ({stats.target_method}): {stats.recompress_time * 1000:.2f} ms")
+    if timings is not None:
+        st.write(f"Header read time: {timings.header_time * 1000:.2f} ms")
+        st.write(f"Payload receive time: {timings.receive_time * 1000:.2f} ms")
+
+def show_container(container, dictionary=None) -> None:
+    """List the blocks of a downlinked container and read any byte range out of it."""
+    reader = BlockReader(container, dictionary)
+    st.write(f"Container of {len(reader.entries)} blocks, {len(reader)} bytes uncompressed")
+    st.table([{"block": number, "codec": entry.method, "offset": entry.start, "size": entry.size,
+               "compressed": entry.compressed_size} for number, entry in enumerate(reader.entries)])
+    offset = st.number_input("Read from byte", 0, max(0, len(reader) - 1), 0)
+    size = st.number_input("Bytes to read", 1, 65536, 256)
+    try:
+        st.code(reader.read(offset, size).hex(" "))
+    except ValueError as e:
+        st.write(f"Reading the container failed: {e}")
+
+def compare_codecs_widget(payload: bytes, codecs) -> None:
+    """Benchmark every codec at a grid of levels side by side, and optionally uplink the winner."""
+    points = st.slider("Levels per codec", 1, 5, 3)
+    link_rate = st.number_input("Link rate (bit/s) for the time on air", 300, 100_000_000, DEFAULT_LINK_RATE)
+    candidates = [(method, level) for method in codecs for level in level_grid(method, points)]
+
+    # Results outlive the rerun triggered by any widget below, as long as the payload stays the same
+    digest = hashlib.sha256(payload).hexdigest()
+    if st.button(f"Compare {len(candidates)} codec and level combinations"):
+        with st.spinner("Compressing with every candidate..."):
+            results, errors = codec_comparator().run(payload, candidates)
+        st.session_state["comparison"] = (digest, results, errors)
+    comparison = st.session_state.get("comparison")
+    if comparison is None or comparison[0] != digest:
+        return
+    _, results, errors = comparison
+    for error in errors:
+        st.write(f"Failed: {error}")
+    if not results:
+        return
+
+    # Click a column header to sort by it
+    st.dataframe([{"codec": result.method, "level": result.level, "size": result.compressed_size,
+                   "ratio": round(ratio(result), 3),
+                   "compress MB/s": round(compress_speed(result), 2),
+                   "decompress MB/s": round(decompress_speed(result), 2),
+                   "time on air (s)": round(time_on_air(result, link_rate), 3)} for result in results],
+                 hide_index=True)
+
+    criterion = WINNER_CRITERIA[st.selectbox("Pick the winner by", list(WINNER_CRITERIA))]
+    winner = min(results, key=lambda result: criterion(result, link_rate))
+    st.write(f"Winner: {winner.method} level {'default' if winner.level is None else winner.level}, "
+             f"{winner.compressed_size} bytes ({ratio(winner):.2f}x)")
+    if st.button("Uplink the winner"):
+        send_payload_to_server(get_codec(winner.method).compress(payload, winner.level), winner.method,
+                               winner.level)
+
+def stream_upload_widget(source_name: str, open_source) -> None:
+    """Compress a file chunk by chunk while it is sent, so it is never held compressed in memory.
+
+    open_source is a context manager factory for a buffer with the file's bytes.
+    """
+    streaming_codecs = [name for name in available_codecs() if get_codec(name).streaming]
+    compression_method = st.selectbox("Choose a streaming compression method", streaming_codecs)
+    codec = get_codec(compression_method)
+    level = None
+    if codec.level_range and st.checkbox("Custom level"):
+        level = st.slider("Level", *codec.level_range)
+    downlink = st.selectbox("Downlink codec", ["Same as uplink"] + streaming_codecs)
+    target_method = None if downlink == "Same as uplink" else downlink
+    priority = PRIORITIES[st.selectbox("Priority", list(PRIORITIES))]
+    if not st.button(f"Stream {source_name} to the satellite"):
+        return
+
+    progress = st.progress(0.0)
+    try:
+        with open_source() as view, closing(upload_chunks(view, progress.progress)) as chunks:
+            size = len(view)
+            result = satellite_client().stream_transcode(chunks, compression_method, size, level,
+                                                         target_method=target_method, priority=priority)
+    except (OSError, ValueError, RuntimeError) as e:
+        st.write(f"Streaming failed: {e}")
+        return
+    st.write(f"Sent {result.sent_size} compressed bytes for {size} bytes, "
+             f"received {result.received_size} recompressed bytes.")
+    show_transcode_stats(result.stats, result.timings)
 
 # Updated main function
+def train_dictionary_widget():
+    """Train a new dictionary version from uploaded frame captures."""
+    with st.expander("Train a dictionary from captured frames"):
+        captures = st.file_uploader("Frame captures", accept_multiple_files=True)
+        frame_size = st.number_input("Frame size in bytes (0 keeps one sample per file)", 0, 65536, 256)
+        dict_size = st.number_input("Dictionary size in bytes", 256, 1024 * 1024, DEFAULT_DICTIONARY_SIZE)
+        if captures and st.button("Train dictionary"):
+            samples = []
+            for capture in captures:
+                data = read_file(capture)
+                samples.extend(split_frames(data, frame_size) if frame_size else [data])
+            try:
+                dict_id = dictionary_store.add(train_dictionary(samples, dict_size))
+            except Exception as e:
+                st.write(f"Training failed: {e}")
+            else:
+                st.write(f"Stored dictionary {dict_id}. Copy {dictionary_store.path(dict_id)} to the satellite.")
+
 def main():
     st.title("Payload Compression Simulation")
+    train_dictionary_widget()
 
     # Payload Type selection
     payload_type = st.radio("Select Payload Type", ['String', 'File', 'Image', 'Random'])
@@ -203,11 +385,23 @@ def main():
 
     elif payload_type == "File":
         file = st.file_uploader("Upload a file", type=None)
+        if st.checkbox("Stream the file to the satellite while compressing it"):
+            # A file on this machine is memory-mapped instead of going through the upload
+            local_path = st.text_input("Path of a file on this machine (instead of uploading it)")
+            if local_path:
+                stream_upload_widget(local_path, lambda: mapped_file(local_path))
+            elif file:
+                stream_upload_widget(file.name, lambda: uploaded_buffer(file))
+            return
         if file:
             payload = read_file(file)
 
     elif payload_type == "Image":
         image_file = st.file_uploader("Upload an image", type=["png", "jpg", "jpeg", "dng", "raw", "nef", "cr2", "arw"])
+        # Lossless image compression needs the whole image, streaming treats it as binary data
+        if image_file and st.checkbox("Stream the image to the satellite as binary data"):
+            stream_upload_widget(image_file.name, lambda: uploaded_buffer(image_file))
+            return
         if image_file:
             payload = read_file(image_file)
 
@@ -215,7 +409,7 @@ def main():
                 st.write("RAW image detected, processing as binary data.")
                 compressed_payload = payload  # Can apply general compression later
             else:
-                compressed_payload = compress_image_lossless(payload)
+                compressed_payload = get_codec("lossless_image").compress(payload)
                 st.write("Lossless compression applied to image.")
 
             # simulate_transmission(payload, compressed_payload)
@@ -225,32 +419,99 @@ def main():
     elif payload_type == "Random":
         size = st.slider("Select the size of the random payload (in bytes)", 1, 100000, 1024)
         entropy = st.slider("Select the entropy (bits per byte)", 0.0, 8.0, 4.0)
-        payload = generate_random_payload_with_entropy(size, entropy)
+        # Kept until the sliders move, so reruns from other widgets hit the result cache
+        if st.session_state.get("random_parameters") != (size, entropy):
+            st.session_state["random_payload"] = generate_random_payload_with_entropy(size, entropy)
+            st.session_state["random_parameters"] = (size, entropy)
+        payload = st.session_state["random_payload"]
 
     # Compression Algorithm selection
     if payload:
-        compression_method = st.selectbox("Choose a compression method", ['brotli', 'lz4', 'deflate', 'rle', 'bzip2', 'zstd', 'lzma'])
+        general_codecs = [name for name in available_codecs() if name != "lossless_image"]
+        if st.checkbox("Compare all codecs"):
+            compare_codecs_widget(payload, general_codecs)
+            return
+        compression_method = st.selectbox("Choose a compression method", general_codecs)
+        codec = get_codec(compression_method)
 
-        entropy = calculate_entropy(payload)
+        entropy = memoized(payload, "entropy", {}, lambda: (calculate_entropy(payload), b""))[0]
         st.write(f"Entropy of the original payload: {entropy:.2f} bits per byte")
 
-        if compression_method == "brotli":
-            compressed_payload = compress_with_brotli(payload)
-        elif compression_method == "lz4":
-            compressed_payload = compress_with_lz4(payload)
-        elif compression_method == "deflate":
-            compressed_payload = compress_with_deflate(payload)
-        elif compression_method == "rle":
-            compressed_payload = compress_with_rle(payload)
-        elif compression_method == "bzip2":
-            compressed_payload = compress_with_bzip2(payload)
-        elif compression_method == "zstd":
-            compressed_payload = compress_with_zstd(payload)
-        elif compression_method == "lzma":
-            compressed_payload = compress_with_lzma(payload)
+        # Compression parameters, used for the uplink and by the satellite for the downlink
+        level, window_log = None, None
+        block_method = None
+        if compression_method == "blocks":
+            # Seekable container: the level belongs to the block codec, the window log is the block size
+            with st.expander("Container parameters"):
+                block_method = st.selectbox("Block codec", [name for name in general_codecs
+                                                            if name != "blocks" and get_codec(name).streaming])
+                block_codec = get_codec(block_method)
+                if block_codec.level_range and st.checkbox("Custom block level"):
+                    level = st.slider("Block level", *block_codec.level_range)
+                window_log = st.slider("Block size (log2 bytes)", *codec.window_log_range)
+        elif codec.level_range or codec.window_log_range:
+            with st.expander("Compression parameters"):
+                if codec.level_range and st.checkbox("Custom level"):
+                    level = st.slider("Level", *codec.level_range)
+                if codec.window_log_range and st.checkbox("Custom window size"):
+                    window_log = st.slider("Window log (bits)", *codec.window_log_range)
+
+        # Trained dictionaries shared with the satellite, see dictionaries.py
+        dict_id = None
+        if codec.dictionary and dictionary_store.ids():
+            dict_id = st.selectbox("Dictionary", [None] + dictionary_store.ids()[::-1],
+                                   format_func=lambda i: "None" if i is None else f"Dictionary {i}")
+        dictionary = dictionary_store.get(dict_id) if dict_id else None
+
+        options = {"level": level, "window_log": window_log, "dict_id": dict_id, "block_method": block_method}
+        if block_method is not None:
+            compressed_payload = memoized(payload, compression_method, options, lambda: (
+                None, compress_blocks(payload, block_method, level, 1 << window_log, dictionary)))[1]
+            st.write(f"Container of {len(BlockReader(compressed_payload).entries)} {block_method} blocks")
+        else:
+            compressed_payload = memoized(payload, compression_method, options, lambda: (
+                None, codec.compress(payload, level, window_log, dictionary)))[1]
+
+        # The satellite can recompress the downlink with a different codec than the uplink
+        target_method, target_level, deadline_ms = None, None, None
+        downlink = st.selectbox("Downlink codec", ["Same as uplink", "Smallest within a deadline"] + general_codecs)
+        if downlink == "Smallest within a deadline":
+            deadline_ms = st.slider("Deadline (ms)", 10, 5000, 1000)
+        elif downlink != "Same as uplink" and downlink != compression_method:
+            target_method = downlink
+            target_codec = get_codec(target_method)
+            if target_codec.level_range and st.checkbox("Custom downlink level"):
+                target_level = st.slider("Downlink level", *target_codec.level_range)
 
         simulate_transmission(payload, compressed_payload)
-        send_payload_to_server(compressed_payload, compression_method)  # Send the compressed payload to server
+
+        priority = PRIORITIES[st.selectbox("Priority", list(PRIORITIES))]
+        burst_size = st.number_input("Number of copies to send in one session", 1, 10000, 1)
+        # Candidates are raced on whole payloads, so streaming is not offered with a deadline
+        streaming = not deadline_ms and st.checkbox("Stream the response back in chunks")
+        if streaming:
+            try:
+                stats, chunk_count = send_payload_streaming(compressed_payload, compression_method, level,
+                                                            window_log, dict_id, target_method, target_level,
+                                                            priority)
+            except (socket.error, RuntimeError) as e:
+                st.write(f"Streaming failed: {e}")
+            else:
+                st.write(f"Received {chunk_count} chunks.")
+                show_transcode_stats(stats)
+        elif burst_size == 1:
+            send_payload_to_server(compressed_payload, compression_method, level, window_log, dict_id,
+                                   target_method, target_level, deadline_ms, priority)  # Send the compressed payload to server
+        else:
+            try:
+                results = send_payloads_in_session([(compressed_payload, compression_method)] * burst_size)
+            except socket.error as e:
+                st.write(f"Socket error: {e}")
+            else:
+                failures = [r for r in results.values() if isinstance(r, str)]
+                st.write(f"Session completed: {len(results) - len(failures)} of {burst_size} payloads recompressed.")
+                for failure in failures[:5]:
+                    st.write(failure)
 
 if __name__ == "__main__":
     main()
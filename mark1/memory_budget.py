@@ -0,0 +1,114 @@
+import re
+import threading
+from codec_registry import get_codec
+
+# Global memory budget for running the satellite on a small flight computer.
+#
+# Before a request's payload is even read, the memory its buffers and codecs
+# will allocate is estimated from the header and reserved against the budget
+# until the request finishes. Target parameters that do not fit what is left are lowered,
+# window first and level second; a request whose buffers and decoder alone
+# exceed it is refused. The parameters actually used are reported back in
+# the version 5 extended stats.
+#
+# The estimates only hold because the codecs are held to them: decoders to
+# the windows decompress_memory() assumes (bound_decoders()), and a whole
+# payload to the decompressed size its buffers were reserved for
+# (decompress_bounded()). Memory kept between requests, idle buffers and
+# cached codec contexts, is capped and taken off the budget up front.
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+def parse_size(spec: str) -> int:
+    """Parse a byte count such as "256M", "64KiB" or "1048576"."""
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?)(?:i?B)?\s*", spec, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {spec}")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
+class MemoryBudget:
+    def __init__(self, total=None):
+        # None leaves every request untouched
+        self.total = total
+        self.reserved = 0
+        self.downgraded = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.total is not None
+
+    def admit(self, compression_method: str, working_size: int, options: dict, candidates=None):
+        """Reserve memory for one request of process_payload options.
+
+        working_size is what the request holds in buffers besides the codecs.
+        Returns the options with the target parameters lowered where needed and
+        the number of bytes reserved, to be handed back to release(). Raises
+        ValueError when the request cannot run in what is left of the budget.
+        """
+        if not self.enabled:
+            return options, 0
+        options = dict(options)
+        fixed = working_size + get_codec(compression_method).decompress_memory(options.get("window_log"))
+        with self._lock:
+            free = self.total - self.reserved - fixed
+            try:
+                if free < 0:
+                    raise ValueError(f"Request needs {fixed // 1024} KiB before recompressing, only "
+                                     f"{(self.total - self.reserved) // 1024} KiB of the memory budget is left")
+                if options.get("smallest"):
+                    compress = self._fit_candidates(free, options, candidates)
+                else:
+                    compress = self._fit_target(free, compression_method, options)
+            except ValueError:
+                self.refused += 1
+                raise
+            self.reserved += fixed + compress
+        return options, fixed + compress
+
+    def _fit_target(self, free: int, compression_method: str, options: dict) -> int:
+        explicit = options.get("target_method") is not None
+        target_method = options["target_method"] if explicit else compression_method
+        requested = (options.get("target_level"), options.get("target_window_log")) if explicit \
+            else (options.get("level"), options.get("window_log"))
+        codec = get_codec(target_method)
+        fitted = codec.fit_memory(free, *requested)
+        if fitted != requested:
+            self.downgraded += 1
+            print(f"Memory budget: {target_method} level {requested[0]}, window log {requested[1]} "
+                  f"lowered to level {fitted[0]}, window log {fitted[1]}")
+            if not explicit:
+                # Spell the target out so the source parameters stay as they are
+                options.update(target_method=target_method, target_dict_id=options.get("dict_id"))
+            options["target_level"], options["target_window_log"] = fitted
+        return codec.compress_memory(*fitted)
+
+    def _fit_candidates(self, free: int, options: dict, candidates) -> int:
+        """Keep the candidates, in order, whose compressors fit side by side."""
+        kept = []
+        total = 0
+        for method, level in options.get("candidates") or candidates:
+            codec = get_codec(method)
+            try:
+                level, _ = codec.fit_memory(free - total, level, None, tune_window=False)
+            except ValueError:
+                continue
+            kept.append((method, level))
+            total += codec.compress_memory(level)
+        if not kept:
+            raise ValueError("No compression candidate fits in what is left of the memory budget")
+        if kept != list(candidates):
+            self.downgraded += 1
+            print(f"Memory budget: candidates lowered to {kept}")
+            options["candidates"] = kept
+        return total
+
+    def release(self, reserved: int) -> None:
+        with self._lock:
+            self.reserved -= reserved
+
+    def counters(self) -> dict:
+        with self._lock:
+            return {"total": self.total or 0, "reserved": self.reserved,
+                    "downgraded": self.downgraded, "refused": self.refused}
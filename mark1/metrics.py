@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Per-request stage timings aggregated per codec, served in the Prometheus
+# text exposition format.
+#
+# Each (codec, stage) pair keeps a sliding window of recent samples, from
+# which the p50/p95/p99 quantiles are computed when the endpoint is scraped,
+# plus a running count and sum over the whole lifetime of the server.
+
+STAGES = ("header", "receive", "decompress", "recompress", "send")
+QUANTILES = (0.5, 0.95, 0.99)
+SAMPLE_WINDOW = 1024
+
+class RequestTimer:
+    """Splits the wall time of one request into consecutive stages."""
+
+    def __init__(self):
+        self.stages = {}
+        self._mark = time.perf_counter()
+
+    def lap(self, stage=None) -> float:
+        """Charge the time since the previous lap to stage; None drops it."""
+        now = time.perf_counter()
+        elapsed = now - self._mark
+        self._mark = now
+        if stage is not None:
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+        return elapsed
+
+class Summary:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return [(q, 0.0) for q in QUANTILES]
+        return [(q, ordered[min(len(ordered) - 1, int(q * len(ordered)))]) for q in QUANTILES]
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+class Metrics:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.window = window
+        self._seconds = {}
+        self._throughput = {}
+        # Other summaries: name -> (help, {sorted label items: Summary})
+        self._summaries = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def add_collector(self, collector) -> None:
+        """Register a function returning (name, type, help, [(labels, value), ...]) tuples,
+        evaluated on every scrape."""
+        self._collectors.append(collector)
+
+    def observe(self, codec: str, stage: str, seconds: float, size=None) -> None:
+        with self._lock:
+            key = (codec, stage)
+            self._seconds.setdefault(key, Summary(self.window)).observe(seconds)
+            if size and seconds > 0:
+                self._throughput.setdefault(key, Summary(self.window)).observe(size / seconds)
+
+    def observe_summary(self, name: str, help_text: str, labels: dict, value: float) -> None:
+        """Record a sample of a summary other than the per-stage ones."""
+        with self._lock:
+            _, summaries = self._summaries.setdefault(name, (help_text, {}))
+            summaries.setdefault(tuple(sorted(labels.items())), Summary(self.window)).observe(value)
+
+    def observe_request(self, stats, timer: RequestTimer) -> None:
+        """Record the stages of one finished request.
+
+        I/O stages are charged to the uplink codec, codec stages to the codec
+        that ran them; cache hits report no codec time and are left out of those.
+        """
+        stages = timer.stages
+        if "header" in stages:
+            self.observe(stats.source_method, "header", stages["header"])
+        if "receive" in stages:
+            self.observe(stats.source_method, "receive", stages["receive"], stats.original_size)
+        if stats.decompress_time:
+            self.observe(stats.source_method, "decompress", stats.decompress_time, stats.decompressed_size)
+        if stats.recompress_time:
+            self.observe(stats.target_method, "recompress", stats.recompress_time, stats.decompressed_size)
+        if "send" in stages:
+            self.observe(stats.source_method, "send", stages["send"], stats.recompressed_size)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = [("satellite_stage_seconds", "Time spent in each request stage",
+                         {(("codec", codec), ("stage", stage)): summary
+                          for (codec, stage), summary in self._seconds.items()}),
+                        ("satellite_stage_bytes_per_second",
+                         "Stage throughput; codec stages count uncompressed bytes",
+                         {(("codec", codec), ("stage", stage)): summary
+                          for (codec, stage), summary in self._throughput.items()})]
+            families += [(name, help_text, summaries) for name, (help_text, summaries) in self._summaries.items()]
+            for name, help_text, summaries in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} summary")
+                for label_items, summary in sorted(summaries.items()):
+                    labels = dict(label_items)
+                    for q, value in summary.quantiles():
+                        lines.append(f'{name}{{{_labels(labels)},quantile="{q}"}} {value:.9g}')
+                    lines.append(f"{name}_sum{{{_labels(labels)}}} {summary.total:.9g}")
+                    lines.append(f"{name}_count{{{_labels(labels)}}} {summary.count}")
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    suffix = f"{{{_labels(labels)}}}" if labels else ""
+                    lines.append(f"{name}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+def start_metrics_server(metrics: Metrics, host='127.0.0.1', port=9464) -> ThreadingHTTPServer:
+    """Serve metrics.render() at /metrics from a background thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would drown out the request log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
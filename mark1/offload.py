@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from profiling import RequestProfiler, reset_worker_profilers
+
+# Codecs that hold the CPU for long enough to be worth a trip to a worker process
+SLOW_CODECS = {"lzma", "bzip2", "brotli"}
+# Payloads below this size are cheaper to process inline than to hand over
+INLINE_THRESHOLD = 64 * 1024
+
+def _process_shared(process_fn, shm_name: str, payload_size: int, compression_method: str, options,
+                    profile_dir=None):
+    """Worker side: process a payload read from shared memory and publish the result there.
+
+    profile_dir is set when the request was submitted during a profiling window.
+    """
+    payload_shm = shared_memory.SharedMemory(name=shm_name)
+    payload = payload_shm.buf[:payload_size]
+    try:
+        if profile_dir is None:
+            stats, result = process_fn(payload, compression_method, **options)
+        else:
+            stats, result = RequestProfiler(profile_dir).profile_call(process_fn, payload, compression_method,
+                                                                      options)
+    finally:
+        payload.release()
+        payload_shm.close()
+
+    result_shm = shared_memory.SharedMemory(create=True, size=max(1, len(result)))
+    result_shm.buf[:len(result)] = result
+    result_shm.close()
+    # The parent unlinks the segment once it has read the result
+    return stats, result_shm.name, len(result)
+
+class CodecExecutor:
+    """Runs a process function either inline or in a pool of worker processes.
+
+    process_fn takes (payload, compression_method, **options) and returns (stats, result);
+    it must be a module level function so the workers can import it. Payloads and
+    results travel through shared memory, only names and sizes are pickled.
+    Requests submitted while profiler (a RequestProfiler) has a window open are
+    profiled in the worker that runs them.
+    """
+
+    def __init__(self, process_fn, workers=None, inline_threshold=INLINE_THRESHOLD,
+                 slow_codecs=SLOW_CODECS, profiler=None):
+        self.process_fn = process_fn
+        self.workers = os.cpu_count() if workers is None else workers
+        self.inline_threshold = inline_threshold
+        self.slow_codecs = set(slow_codecs)
+        self.profiler = profiler
+        self._pool = None
+        # Submitted to the pool and not finished yet, including work whose caller gave up on it
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def should_offload(self, payload_size: int, compression_method: str, target_method=None,
+                       smallest=False, **options) -> bool:
+        # Candidate races fan out to their own pools from the calling thread
+        return (self.workers > 0
+                and not smallest
+                and payload_size >= self.inline_threshold
+                and (compression_method in self.slow_codecs or target_method in self.slow_codecs))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Start the tracker first so the workers share it instead of each starting their own
+            resource_tracker.ensure_running()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=reset_worker_profilers)
+        return self._pool
+
+    def _submit(self, payload, compression_method: str, options):
+        payload_shm = shared_memory.SharedMemory(create=True, size=max(1, len(payload)))
+        payload_shm.buf[:len(payload)] = payload
+        profiling = self.profiler is not None and self.profiler.active
+        future = self._get_pool().submit(_process_shared, self.process_fn, payload_shm.name,
+                                         len(payload), compression_method, options,
+                                         self.profiler.directory if profiling else None)
+        with self._lock:
+            self.in_flight += 1
+        future.add_done_callback(self._finished)
+        return payload_shm, future
+
+    def _finished(self, _) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _collect(payload_shm, outcome):
+        payload_shm.close()
+        payload_shm.unlink()
+        stats, result_name, result_size = outcome
+        result_shm = shared_memory.SharedMemory(name=result_name)
+        try:
+            return stats, bytes(result_shm.buf[:result_size])
+        finally:
+            result_shm.close()
+            result_shm.unlink()
+
+    def run(self, payload, compression_method: str, **options):
+        """Process a payload, blocking until the result is ready."""
+        if not self.should_offload(len(payload), compression_method, **options):
+            return self.process_fn(payload, compression_method, **options)
+        payload_shm, future = self._submit(payload, compression_method, options)
+        try:
+            outcome = future.result()
+        except BaseException:
+            payload_shm.close()
+            payload_shm.unlink()
+            raise
+        return self._collect(payload_shm, outcome)
+
+    async def run_async(self, payload, compression_method: str, **options):
+        """Process a payload without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        if not self.should_offload(len(payload), compression_method, **options):
+            return await loop.run_in_executor(
+                None, functools.partial(self.process_fn, payload, compression_method, **options))
+        payload_shm, future = self._submit(payload, compression_method, options)
+        try:
+            outcome = await asyncio.wrap_future(future)
+        except BaseException:
+            payload_shm.close()
+            payload_shm.unlink()
+            raise
+        return self._collect(payload_shm, outcome)
+
+    def submit(self, payload, compression_method: str, **options) -> Future:
+        """Always process a payload in a worker, returning a future for (stats, result).
+
+        Cancelling the future drops the work if it has not started yet.
+        """
+        payload_shm, future = self._submit(payload, compression_method, options)
+        result = Future()
+        result.add_done_callback(lambda f: f.cancelled() and future.cancel())
+
+        def done(finished):
+            try:
+                outcome = finished.result()
+            except BaseException as e:
+                payload_shm.close()
+                payload_shm.unlink()
+                if result.set_running_or_notify_cancel():
+                    result.set_exception(e)
+                return
+            # Results of abandoned futures are still collected so their segments are freed
+            outcome = self._collect(payload_shm, outcome)
+            if result.set_running_or_notify_cancel():
+                result.set_result(outcome)
+
+        future.add_done_callback(done)
+        return result
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
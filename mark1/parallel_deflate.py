@@ -0,0 +1,88 @@
+import zlib
+from collections import deque
+
+# Parallel single-stream DEFLATE, the way pigz does it.
+#
+# The input is cut into blocks that are deflated concurrently, each primed
+# with the 32 KiB of input before it as a preset dictionary so matches can
+# still reach back across block boundaries. Every block but the last ends
+# with a sync flush, which leaves it byte aligned and not final, so the raw
+# outputs concatenate into one deflate stream. That stream is wrapped in a
+# zlib header and the Adler-32 of the whole input, combined from the
+# per-block checksums; stock zlib.decompress reads the result.
+
+DEFAULT_BLOCK_SIZE = 128 * 1024
+WINDOW_SIZE = 32 * 1024
+ADLER_BASE = 65521
+
+def adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    """Adler-32 of two concatenated pieces from their checksums and the second one's length
+    (zlib's adler32_combine, which the zlib module does not expose)."""
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xffff) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + ADLER_BASE - remainder
+    return (sum1 % ADLER_BASE) | ((sum2 % ADLER_BASE) << 16)
+
+def zlib_header(level=None) -> bytes:
+    """Header zlib itself writes for a 32 KiB window at this level."""
+    level = 6 if level is None or level < 0 else level
+    level_flags = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    cmf, flg = 0x78, level_flags << 6
+    return bytes([cmf, flg + 31 - (cmf * 256 + flg) % 31])
+
+def deflate_block(block, dictionary, level, last: bool):
+    """Raw deflate one block after its dictionary; returns (compressed bytes, Adler-32 of the block)."""
+    options = {"zdict": dictionary} if dictionary else {}
+    compressor = zlib.compressobj(-1 if level is None else level, zlib.DEFLATED, -zlib.MAX_WBITS, **options)
+    compressed = compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.adler32(block)
+
+class ParallelDeflateCompressor:
+    """Incremental compressor with the compress/flush interface of zlib compression objects.
+
+    Full blocks are handed to the pool as soon as they are buffered and written
+    out in order as they finish, with at most two blocks per thread in flight.
+    The last block is held back until flush() so it can be marked final.
+    """
+
+    def __init__(self, pool, threads: int, level=None, block_size=DEFAULT_BLOCK_SIZE):
+        self.pool = pool
+        self.threads = threads
+        self.level = level
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.window = b""
+        self.pending = deque()
+        self.adler = 1
+        self.started = False
+
+    def _submit(self, block, last: bool) -> None:
+        self.pending.append((self.pool.submit(deflate_block, block, self.window, self.level, last), len(block)))
+        self.window = (self.window + block)[-WINDOW_SIZE:]
+
+    def _collect(self, wait: bool) -> bytes:
+        output = []
+        if not self.started:
+            output.append(zlib_header(self.level))
+            self.started = True
+        while self.pending and (wait or self.pending[0][0].done() or len(self.pending) > 2 * self.threads):
+            future, length = self.pending.popleft()
+            compressed, adler = future.result()
+            output.append(compressed)
+            self.adler = adler32_combine(self.adler, adler, length)
+        return b"".join(output)
+
+    def compress(self, data) -> bytes:
+        self.buffer += data
+        # Strictly more than a block, so the final block is never submitted here
+        while len(self.buffer) > self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]), last=False)
+            del self.buffer[:self.block_size]
+        return self._collect(wait=False)
+
+    def flush(self) -> bytes:
+        self._submit(bytes(self.buffer), last=True)
+        self.buffer = bytearray()
+        return self._collect(wait=True) + self.adler.to_bytes(4, "big")
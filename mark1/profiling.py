@@ -0,0 +1,138 @@
+import cProfile
+import functools
+import itertools
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+
+# On-demand profiling of the request hot path.
+#
+# While a profiling window is open every request processed in this process
+# runs under its own cProfile profiler, and tracemalloc tracks its peak
+# allocation. Both are written to files named after the codec and payload
+# size. While the window is closed the only cost is one attribute check.
+#
+# Worker processes never inherit an open window: their pool resets every
+# profiler when it starts them, and a request submitted while the window is
+# open is profiled in the worker with profile_call instead.
+
+DEFAULT_PROFILE_DIR = "profiles"
+DEFAULT_PROFILE_WINDOW = 30.0
+TOP_ALLOCATIONS = 20
+
+# Every profiler of this process, so a freshly started worker can reset them all
+_profilers = weakref.WeakSet()
+
+def reset_worker_profilers() -> None:
+    """Pool initializer: close any window a forked worker inherited from its parent."""
+    for profiler in list(_profilers):
+        profiler.active = False
+        # The timer thread did not survive the fork, and the lock may have been held across it
+        profiler._timer = None
+        profiler._lock = threading.Lock()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+class RequestProfiler:
+    def __init__(self, directory=DEFAULT_PROFILE_DIR, window=DEFAULT_PROFILE_WINDOW):
+        self.directory = directory
+        self.window = window
+        self.active = False
+        self._timer = None
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        _profilers.add(self)
+
+    def configure(self, directory=None, window=None) -> None:
+        if directory is not None:
+            self.directory = directory
+        if window is not None:
+            self.window = window
+
+    def start(self, window=None) -> None:
+        """Open a profiling window of window seconds (the configured window by default)."""
+        window = window or self.window
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            os.makedirs(self.directory, exist_ok=True)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._timer = threading.Timer(window, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            self.active = True
+        print(f"Profiling requests for {window:.0f} s into {self.directory}")
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.active:
+                return
+            self.active = False
+            tracemalloc.stop()
+        print("Profiling stopped")
+
+    def toggle(self, *_) -> None:
+        """Signal handler: open a window when closed, close it when open."""
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def profiled(self, process_fn):
+        """Decorate a (payload, compression_method, ...) function so it is profiled during a window."""
+        @functools.wraps(process_fn)
+        def wrapper(payload, compression_method, *args, **kwargs):
+            if not self.active:
+                return process_fn(payload, compression_method, *args, **kwargs)
+            return self._profile(process_fn, payload, compression_method, args, kwargs)
+        return wrapper
+
+    def profile_call(self, process_fn, payload, compression_method: str, kwargs: dict):
+        """Profile one call whether or not a window is open, as workers do for submitted requests."""
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        try:
+            return self._profile(process_fn, payload, compression_method, (), kwargs)
+        finally:
+            if not tracing:
+                tracemalloc.stop()
+
+    def _profile(self, process_fn, payload, compression_method, args, kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another request already holds the interpreter-wide profiler
+            return process_fn(payload, compression_method, *args, **kwargs)
+        # The peak is process wide, so concurrent requests inflate each other's figure
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            return process_fn(payload, compression_method, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            profile.disable()
+            self._dump(profile, compression_method, len(payload), elapsed)
+
+    def _dump(self, profile, compression_method: str, payload_size: int, elapsed: float) -> None:
+        if not tracemalloc.is_tracing():
+            return  # The window closed while this request was running
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+        base = os.path.join(self.directory, f"{compression_method}-{payload_size}-"
+                                            f"{int(time.time() * 1000)}-{os.getpid()}-{next(self._sequence)}")
+        try:
+            profile.dump_stats(f"{base}.prof")
+            with open(f"{base}.mem.txt", "w") as f:
+                f.write(f"codec: {compression_method}\npayload size: {payload_size} bytes\n"
+                        f"elapsed: {elapsed:.6f} s\npeak traced memory: {peak} bytes\n\n")
+                f.writelines(f"{stat}\n" for stat in allocations)
+        except OSError as e:
+            print(f"Could not write profile {base}: {e}")
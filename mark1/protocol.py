@@ -0,0 +1,340 @@
+import struct
+import threading
+from collections import namedtuple
+
+# Wire protocol shared by the satellite server and the ground station.
+#
+# Single exchange (one payload per connection):
+#   PREAMBLE + "!I" payload size + "<method>\n" + payload
+#   -> STATS_HEADER_FORMAT header + recompressed payload
+#
+# Session (many payloads per connection, responses may arrive out of order):
+#   SESSION_PREAMBLE, then any number of frames of
+#   SESSION_FRAME_FORMAT (request id, payload size) + "<method>\n" + payload
+#   -> SESSION_RESPONSE_FORMAT (request id, status, body length) + body
+#   The client half-closes the connection once it has sent its last frame.
+#
+# Streaming (bounded memory on the satellite, one payload per connection):
+#   STREAM_PREAMBLE + "!I" payload size + "<method>\n" + payload
+#   -> chunks of STREAM_CHUNK_FORMAT length + data, a zero-length chunk,
+#      then the STATS_HEADER_FORMAT header as a trailer.
+#   A chunk length of STREAM_ERROR_MARKER is followed by a "!I" length and
+#   an error message instead.
+#
+# Binary header (codec parameters negotiated per request):
+#   HEADER_FORMATS[version] header + payload, parsed with one struct.unpack_from.
+#   Every request is answered with SESSION_RESPONSE_FORMAT + body, keyed by the
+#   request id from the header, and the connection stays open for further
+#   headers until the client half-closes it. A request with FLAG_STREAM set is
+#   answered with the chunked streaming framing instead and ends the connection.
+#   From header version 3 on, the stats in responses and stream trailers use
+#   EXTENDED_STATS_FORMATS instead of STATS_HEADER_FORMAT.
+#   A request with FLAG_SMALLEST set (version 4) is recompressed with every
+#   candidate codec the satellite is configured with, and the smallest output
+#   ready within the header's deadline is returned; the target codec id in the
+#   extended stats names the winner. It cannot be combined with FLAG_STREAM.
+#   With FLAG_TIMINGS set, STAGE_TIMINGS_FORMAT follows the extended stats.
+#   Version 5 headers are laid out like version 4 but are answered with the
+#   version 5 extended stats, which add the level and window log the target
+#   codec actually ran with (a memory-budgeted satellite may lower them).
+#   Version 6 adds a priority byte; the async satellite schedules codec work
+#   of telecommands ahead of bulk payloads, see scheduler.py.
+#   With FLAG_SHARED set, the payload is not on the connection: it sits in a
+#   shared memory segment of the client and only SHARED_DESCRIPTOR_FORMAT
+#   (segment name, offset) follows the header. The client may reuse the
+#   region once the request is answered. Only the shm transport, over a Unix
+#   domain socket, accepts it; see transport.py.
+#   With FLAG_CHUNKED set (only together with FLAG_STREAM), the payload is sent
+#   as STREAM_CHUNK_FORMAT framed chunks ending with a zero-length chunk, so
+#   the client can compress while it sends without knowing the compressed
+#   size up front; the header's payload size is then only a hint (the
+#   uncompressed size will do) used to schedule the request.
+#
+# Control (operator commands, one per connection):
+#   CONTROL_PREAMBLE + CONTROL_FORMAT (command, argument)
+#   -> CONTROL_RESPONSE_FORMAT status
+
+PREAMBLE = b'\xaa\xbb\xcc\xdd'
+SESSION_PREAMBLE = b'\xaa\xbb\xcc\xde'
+STREAM_PREAMBLE = b'\xaa\xbb\xcc\xdf'
+HEADER_PREAMBLE = b'\xaa\xbb\xcc\xee'
+CONTROL_PREAMBLE = b'\xaa\xbb\xcc\xef'
+
+STATS_HEADER_FORMAT = "iii f"
+STATS_HEADER_SIZE = struct.calcsize(STATS_HEADER_FORMAT)
+EXTENDED_STATS_FORMATS = {
+    # original size, decompressed size, recompressed size, compression ratio,
+    # source codec id, target codec id, decompress seconds, recompress seconds
+    3: "!IIIfBBff",
+    # version 3 + effective target level (-1 = codec default),
+    # effective target window log (0 = codec default)
+    5: "!IIIfBBffbB",
+}
+EXTENDED_STATS_FORMAT = EXTENDED_STATS_FORMATS[5]
+EXTENDED_STATS_SIZE = struct.calcsize(EXTENDED_STATS_FORMAT)
+# header read seconds, payload receive seconds
+STAGE_TIMINGS_FORMAT = "!ff"
+STAGE_TIMINGS_SIZE = struct.calcsize(STAGE_TIMINGS_FORMAT)
+
+SESSION_FRAME_FORMAT = "!II"
+SESSION_FRAME_SIZE = struct.calcsize(SESSION_FRAME_FORMAT)
+SESSION_RESPONSE_FORMAT = "!IBI"
+SESSION_RESPONSE_SIZE = struct.calcsize(SESSION_RESPONSE_FORMAT)
+
+STREAM_CHUNK_FORMAT = "!I"
+STREAM_CHUNK_HEADER_SIZE = struct.calcsize(STREAM_CHUNK_FORMAT)
+STREAM_ERROR_MARKER = 0xFFFFFFFF
+# Amount of compressed input fed to the codecs at a time in streaming mode
+STREAM_CHUNK_SIZE = 64 * 1024
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+CONTROL_FORMAT = "!BI"
+CONTROL_SIZE = struct.calcsize(CONTROL_FORMAT)
+CONTROL_RESPONSE_FORMAT = "!B"
+# Argument: profiling window in seconds (0 = satellite default)
+CONTROL_PROFILE_START = 1
+CONTROL_PROFILE_STOP = 2
+
+# Preamble + version, enough to know how long the rest of the header is
+HEADER_PREFIX_SIZE = 5
+HEADER_VERSION = 6
+HEADER_FORMATS = {
+    # preamble, version, codec id, level (-1 = codec default),
+    # window log (0 = codec default), flags, reserved, request id, payload size
+    1: "!4sBBbBBxII",
+    # version 1 + dictionary id (0 = no dictionary)
+    2: "!4sBBbBBxIII",
+    # version 2 + target codec id (0 = same as the source), target level,
+    # target window log, reserved, target dictionary id
+    3: "!4sBBbBBxIIIBbBxI",
+    # version 3 + deadline in milliseconds for FLAG_SMALLEST (0 = satellite default)
+    4: "!4sBBbBBxIIIBbBxII",
+    # same layout as version 4, answered with version 5 extended stats
+    5: "!4sBBbBBxIIIBbBxII",
+    # version 5 + priority (PRIORITY_AUTO = classified by payload size)
+    6: "!4sBBbBBxIIIBbBxIIB",
+}
+
+FLAG_STREAM = 0x01
+FLAG_SMALLEST = 0x02
+FLAG_TIMINGS = 0x04
+FLAG_SHARED = 0x08
+FLAG_CHUNKED = 0x10
+
+# Shared memory segment name (NUL padded) and offset of a FLAG_SHARED payload
+SHARED_DESCRIPTOR_FORMAT = "!32sQ"
+SHARED_DESCRIPTOR_SIZE = struct.calcsize(SHARED_DESCRIPTOR_FORMAT)
+
+PRIORITY_AUTO = 0
+PRIORITY_COMMAND = 1
+PRIORITY_NORMAL = 2
+PRIORITY_BULK = 3
+
+CODEC_IDS = {
+    "deflate": 1,
+    "lzma": 2,
+    "brotli": 3,
+    "lz4": 4,
+    "zstd": 5,
+    "bzip2": 6,
+    "rle": 7,
+    "lossless_image": 8,
+    "zstd_mt": 9,
+    "lzma_mt": 10,
+    "blocks": 11,
+    "deflate_mt": 12,
+}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+RequestHeader = namedtuple(
+    "RequestHeader",
+    ["version", "compression_method", "level", "window_log", "flags", "request_id", "payload_size",
+     "dict_id", "target_method", "target_level", "target_window_log", "target_dict_id", "deadline_ms",
+     "priority"],
+    defaults=[None, None, None, None, None, None, PRIORITY_AUTO])
+
+TranscodeStats = namedtuple(
+    "TranscodeStats",
+    ["original_size", "decompressed_size", "recompressed_size", "compression_ratio",
+     "source_method", "target_method", "decompress_time", "recompress_time",
+     "target_level", "target_window_log"],
+    defaults=[None, None])
+
+StageTimings = namedtuple("StageTimings", ["header_time", "receive_time"])
+
+def pack_session_frame(request_id: int, payload: bytes, compression_method: str) -> bytes:
+    """Frame one request of a session."""
+    return (struct.pack(SESSION_FRAME_FORMAT, request_id, len(payload))
+            + f"{compression_method}\n".encode('utf-8') + payload)
+
+def pack_session_response(request_id: int, status: int, body_length: int) -> bytes:
+    return struct.pack(SESSION_RESPONSE_FORMAT, request_id, status, body_length)
+
+def pack_stream_chunk_header(chunk: bytes) -> bytes:
+    return struct.pack(STREAM_CHUNK_FORMAT, len(chunk))
+
+def pack_shared_descriptor(segment_name: str, offset: int) -> bytes:
+    return struct.pack(SHARED_DESCRIPTOR_FORMAT, segment_name.encode('ascii'), offset)
+
+def unpack_shared_descriptor(buffer):
+    """(segment name, offset) of a FLAG_SHARED payload."""
+    name, offset = struct.unpack(SHARED_DESCRIPTOR_FORMAT, buffer)
+    return name.rstrip(b"\x00").decode('ascii'), offset
+
+def pack_stream_error(message: bytes) -> bytes:
+    return struct.pack("!II", STREAM_ERROR_MARKER, len(message)) + message
+
+def header_size(prefix: bytes) -> int:
+    """Size of a whole binary header, given its first HEADER_PREFIX_SIZE bytes."""
+    if prefix[:4] != HEADER_PREAMBLE:
+        raise ValueError("Invalid header preamble.")
+    version = prefix[4]
+    if version not in HEADER_FORMATS:
+        raise ValueError(f"Unsupported header version: {version}")
+    return struct.calcsize(HEADER_FORMATS[version])
+
+def pack_header(compression_method: str, payload_size: int, level=None, window_log=None,
+                flags=0, request_id=0, dict_id=None, target_method=None, target_level=None,
+                target_window_log=None, target_dict_id=None, deadline_ms=None, priority=PRIORITY_AUTO) -> bytes:
+    """Pack a current-version header; target_method None asks for the source codec back."""
+    return struct.pack(HEADER_FORMATS[HEADER_VERSION], HEADER_PREAMBLE, HEADER_VERSION,
+                       CODEC_IDS[compression_method], -1 if level is None else level,
+                       window_log or 0, flags, request_id, payload_size, dict_id or 0,
+                       CODEC_IDS[target_method] if target_method else 0,
+                       -1 if target_level is None else target_level,
+                       target_window_log or 0, target_dict_id or 0, deadline_ms or 0, priority)
+
+def codec_name(codec_id: int) -> str:
+    if codec_id not in CODEC_NAMES:
+        raise ValueError(f"Unknown codec id: {codec_id}")
+    return CODEC_NAMES[codec_id]
+
+def unpack_header(buffer) -> RequestHeader:
+    """Parse a whole binary header in one go."""
+    version = buffer[4]
+    fields = struct.unpack_from(HEADER_FORMATS[version], buffer)
+    preamble, version, codec_id, level, window_log, flags, request_id, payload_size = fields[:8]
+    dict_id = fields[8] if version >= 2 else 0
+    target_codec_id, target_level, target_window_log, target_dict_id = \
+        fields[9:13] if version >= 3 else (0, -1, 0, 0)
+    deadline_ms = fields[13] if version >= 4 else 0
+    priority = fields[14] if version >= 6 else PRIORITY_AUTO
+    return RequestHeader(version, codec_name(codec_id), None if level == -1 else level,
+                         window_log or None, flags, request_id, payload_size, dict_id or None,
+                         codec_name(target_codec_id) if target_codec_id else None,
+                         None if target_level == -1 else target_level,
+                         target_window_log or None, target_dict_id or None, deadline_ms or None, priority)
+
+def stats_format(version: int) -> str:
+    """Extended stats layout answering a header of the given version."""
+    return EXTENDED_STATS_FORMATS[5 if version >= 5 else 3]
+
+def pack_stats(stats: TranscodeStats, version: int, timings=None) -> bytes:
+    """Pack stats for a request of the given header version (0 for the preamble modes):
+    the legacy layout before version 3, the matching extended one from then on,
+    followed by the stage timings when given."""
+    if version < 3:
+        return struct.pack(STATS_HEADER_FORMAT, stats.original_size, stats.decompressed_size,
+                           stats.recompressed_size, stats.compression_ratio)
+    fields = (stats.original_size, stats.decompressed_size, stats.recompressed_size, stats.compression_ratio,
+              CODEC_IDS.get(stats.source_method, 0), CODEC_IDS.get(stats.target_method, 0),
+              stats.decompress_time, stats.recompress_time)
+    if version >= 5:
+        fields += (-1 if stats.target_level is None else stats.target_level, stats.target_window_log or 0)
+    packed = struct.pack(stats_format(version), *fields)
+    if timings is not None:
+        packed += struct.pack(STAGE_TIMINGS_FORMAT, *timings)
+    return packed
+
+def unpack_extended_stats(buffer, version=HEADER_VERSION) -> TranscodeStats:
+    fields = struct.unpack_from(stats_format(version), buffer)
+    (original_size, decompressed_size, recompressed_size, compression_ratio,
+     source_codec_id, target_codec_id, decompress_time, recompress_time) = fields[:8]
+    target_level, target_window_log = fields[8:10] if version >= 5 else (-1, 0)
+    return TranscodeStats(original_size, decompressed_size, recompressed_size, compression_ratio,
+                          CODEC_NAMES.get(source_codec_id), CODEC_NAMES.get(target_codec_id),
+                          decompress_time, recompress_time,
+                          None if target_level == -1 else target_level, target_window_log or None)
+
+def unpack_stage_timings(buffer, offset=EXTENDED_STATS_SIZE) -> StageTimings:
+    return StageTimings(*struct.unpack_from(STAGE_TIMINGS_FORMAT, buffer, offset))
+
+def recv_exactly(sock, size: int) -> bytes:
+    """Read exactly size bytes from a blocking socket."""
+    data = bytearray(size)
+    recv_exactly_into(sock, memoryview(data))
+    return bytes(data)
+
+def recv_exactly_into(sock, view) -> None:
+    """Fill a writable memoryview from a blocking socket without intermediate copies."""
+    received = 0
+    size = len(view)
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed unexpectedly.")
+        received += count
+
+def send_buffers(sock, buffers) -> None:
+    """Send several buffers back to back with scatter-gather I/O, without concatenating them."""
+    views = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer)]
+    if not hasattr(sock, 'sendmsg'):
+        for view in views:
+            sock.sendall(view)
+        return
+    while views:
+        sent = sock.sendmsg(views)
+        # Drop the fully sent buffers and trim the partially sent one
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+
+class BufferPool:
+    """Reusable receive buffers, bucketed by power-of-two size so they can be recycled.
+
+    At most max_retained_bytes are held while idle. Sizes above max_pooled_size are
+    allocated exactly and never kept, since holding on to them would cost more than
+    allocating them for the rare request that needs one.
+    """
+
+    def __init__(self, max_buffers_per_size=8, min_size=4096, max_pooled_size=4 * 1024 * 1024,
+                 max_retained_bytes=32 * 1024 * 1024):
+        self.max_buffers_per_size = max_buffers_per_size
+        self.min_size = min_size
+        self.max_pooled_size = max_pooled_size
+        self.max_retained_bytes = max_retained_bytes
+        self.retained = 0
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, size: int) -> int:
+        bucket = self.min_size
+        while bucket < size:
+            bucket *= 2
+        return bucket
+
+    def acquire(self, size: int) -> bytearray:
+        """Return a buffer of at least size bytes."""
+        bucket = self._bucket(size)
+        if bucket > self.max_pooled_size:
+            return bytearray(size)
+        with self._lock:
+            free = self._free.get(bucket)
+            if free:
+                self.retained -= bucket
+                return free.pop()
+        return bytearray(bucket)
+
+    def release(self, buffer: bytearray) -> None:
+        """Hand a buffer back to the pool; buffers beyond the size or retention limits are dropped."""
+        if len(buffer) > self.max_pooled_size:
+            return
+        with self._lock:
+            free = self._free.setdefault(len(buffer), [])
+            if len(free) < self.max_buffers_per_size and self.retained + len(buffer) <= self.max_retained_bytes:
+                free.append(buffer)
+                self.retained += len(buffer)
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Content-addressed cache of processed payloads.
+#
+# Entries are keyed by a BLAKE2b digest of the payload together with the
+# codec and every processing option, so a repeated request with the same
+# bytes and parameters can be answered without running any codec. The
+# memory tier is an LRU bounded by the total size of the cached results;
+# the optional disk tier keeps one file per entry and is bounded the same
+# way, evicting the least recently used files first.
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+# Charged per entry on top of its result, so entries holding only a small value still count
+ENTRY_OVERHEAD = 256
+
+def cache_key(payload, compression_method: str, options) -> str:
+    """Digest of the payload bytes, the codec and its options."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((compression_method, sorted(options.items()))).encode('utf-8'))
+    digest.update(payload)
+    return digest.hexdigest()
+
+def entry_size(entry) -> int:
+    return len(entry[1]) + ENTRY_OVERHEAD
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, directory=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or bool(self.directory)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.result")
+
+    def get(self, key: str):
+        """Return the cached (stats, result) for a key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, stats, result) -> None:
+        entry = (stats, bytes(result))
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def _remember(self, key: str, entry) -> None:
+        """Insert into the memory tier and evict down to the budget; caller holds the lock."""
+        size = entry_size(entry)
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= entry_size(previous)
+        self._entries[key] = entry
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= entry_size(evicted)
+
+    def _read_disk(self, key: str):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                stats, result = pickle.load(f)
+            os.utime(path)  # Mark as recently used for disk eviction
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return stats, result
+
+    def _write_disk(self, key: str, entry) -> None:
+        if not self.directory:
+            return
+        # Write under a temporary name so readers never see a partial file
+        temporary = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self._path(key))
+        except OSError as e:
+            print(f"Could not write cache entry {key}: {e}")
+            return
+        if self.max_disk_bytes:
+            self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".result"):
+                try:
+                    info = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+    def counters(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self._size}
@@ -1,122 +1,507 @@
-import socket
-import zlib
-import lzma
-import brotli
-import lz4.frame
-import zstandard as zstd
-import bz2
+import asyncio
+import argparse
+import os
+import signal
 import struct
-from PIL import Image
-import io
-
-# Compression with RLE (Run-Length Encoding)
-def compress_with_rle(data: bytes) -> bytes:
-    if not data:
-        return b""
-    compressed = bytearray()
-    previous_byte = data[0]
-    count = 1
-    for current_byte in data[1:]:
-        if current_byte == previous_byte and count < 255:
-            count += 1
-        else:
-            compressed.append(previous_byte)
-            compressed.append(count)
-            previous_byte = current_byte
-            count = 1
-    compressed.append(previous_byte)
-    compressed.append(count)
-    return bytes(compressed)
-
-def decompress_with_rle(data: bytes) -> bytes:
-    decompressed = bytearray()
-    i = 0
-    while i < len(data):
-        byte = data[i]
-        count = data[i + 1]
-        decompressed.extend([byte] * count)
-        i += 2
-    return bytes(decompressed)
-
-def compress_with_deflate(data: bytes) -> bytes:
-    """Compress data using DEFLATE (zlib)."""
-    return zlib.compress(data)
+import time
+from candidates import DEFAULT_CANDIDATES, DEFAULT_DEADLINE, CandidateRunner, parse_candidates
+from codec_registry import MULTITHREAD_THRESHOLD, DecompressionLimitExceeded, available_codecs, bound_decoders, \
+                           configure_block_codec, configure_context_cache, configure_multithreading, get_codec, \
+                           load_report, resident_memory, set_allowed_codecs
+from dictionaries import DICTIONARY_DIR, DictionaryStore
+from memory_budget import MemoryBudget, parse_size
+from metrics import Metrics, RequestTimer, start_metrics_server
+from offload import INLINE_THRESHOLD, CodecExecutor
+from profiling import DEFAULT_PROFILE_DIR, DEFAULT_PROFILE_WINDOW, RequestProfiler
+from result_cache import DEFAULT_CACHE_BYTES, ResultCache, cache_key
+from transport import DEFAULT_SOCKET_PATH, TRANSPORTS, SharedSegments, describe, listen_socket
+from scheduler import BULK_SIZE, CLASSES, COMMAND_SIZE, DEFAULT_WEIGHTS, WeightedFairScheduler
+from protocol import PREAMBLE, SESSION_PREAMBLE, STREAM_PREAMBLE, HEADER_PREAMBLE, HEADER_PREFIX_SIZE, \
+                     CONTROL_PREAMBLE, CONTROL_FORMAT, CONTROL_SIZE, CONTROL_RESPONSE_FORMAT, \
+                     CONTROL_PROFILE_START, CONTROL_PROFILE_STOP, \
+                     SESSION_FRAME_FORMAT, SESSION_FRAME_SIZE, STREAM_CHUNK_FORMAT, STREAM_CHUNK_HEADER_SIZE, \
+                     STREAM_CHUNK_SIZE, \
+                     STATUS_OK, STATUS_ERROR, PRIORITY_AUTO, FLAG_STREAM, FLAG_SMALLEST, FLAG_TIMINGS, FLAG_SHARED, FLAG_CHUNKED, \
+                     SHARED_DESCRIPTOR_SIZE, BufferPool, header_size, unpack_header, \
+                     pack_session_response, pack_stream_chunk_header, pack_stream_error, \
+                     pack_stats, recv_exactly, recv_exactly_into, send_buffers, StageTimings, TranscodeStats
+
+# Receive buffers are recycled between requests instead of reallocated for every payload
+buffer_pool = BufferPool()
+
+# Trained dictionaries, looked up by the id carried in the binary header.
+# Replaced in __main__ when a different directory is configured.
+dictionary_store = DictionaryStore()
+
+def lookup_dictionary(dict_id):
+    return dictionary_store.get(dict_id) if dict_id else None
+
+# Profiles requests while a window opened by SIGUSR1 or a control message is open.
+# Configured in __main__.
+profiler = RequestProfiler()
+
+# Codec/level candidates raced for FLAG_SMALLEST requests.
+# Replaced in __main__ when candidates or a deadline are configured.
+candidate_runner = CandidateRunner()
+
+# Bounds the memory codecs may allocate; unlimited unless --memory-budget is given
+memory_budget = MemoryBudget()
+# Under a budget, idle receive buffers and cached codec contexts may each hold 1/RETAINED_SHARE of it
+RETAINED_SHARE = 16
 
 # Decompression for bzip2, zstd, lzma, brotli, lz4, deflate
-def decompress_payload(payload: bytes, compression_method: str) -> bytes:
+def decompress_payload(payload: bytes, compression_method: str, window_log=None, dictionary=None,
+                       max_output=None) -> bytes:
+    """window_log widens the window the decoder accepts (deflate wbits, zstd max window);
+    max_output caps the decompressed size, see decompress_bounded()."""
     try:
-        if compression_method == "deflate":
-            return zlib.decompress(payload)
-        elif compression_method == "lzma":
-            return lzma.decompress(payload)
-        elif compression_method == "brotli":
-            return brotli.decompress(payload)
-        elif compression_method == "lz4":
-            return lz4.frame.decompress(payload)
-        elif compression_method == "zstd":
-            dctx = zstd.ZstdDecompressor()
-            return dctx.decompress(payload)
-        elif compression_method == "bzip2":
-            return bz2.decompress(payload)
-        elif compression_method == "rle":
-            return decompress_with_rle(payload)
-        elif compression_method == "lossless_image":
-            return compress_image_lossless(payload)  # In this case, it's recompression
-        else:
-            raise ValueError(f"Unknown compression method: {compression_method}")
+        codec = get_codec(compression_method)
+        codec.check_dictionary(dictionary)
+        if max_output is None:
+            return codec.decompress(payload, window_log, dictionary)
+        return codec.decompress_bounded(payload, max_output, window_log, dictionary)
+    except DecompressionLimitExceeded:
+        raise
     except Exception as e:
         raise RuntimeError(f"Decompression failed: {e}")
 
 # Compression functions (mirrors decompression)
-def recompress_payload(payload: bytes, compression_method: str) -> bytes:
+def recompress_payload(payload: bytes, compression_method: str, level=None, window_log=None,
+                       dictionary=None) -> bytes:
+    """level and window_log default to each codec's own defaults when None."""
     try:
-        if compression_method == "deflate":
-            return zlib.compress(payload)
-        elif compression_method == "lzma":
-            return lzma.compress(payload)
-        elif compression_method == "brotli":
-            return brotli.compress(payload)
-        elif compression_method == "lz4":
-            return lz4.frame.compress(payload)
-        elif compression_method == "zstd":
-            cctx = zstd.ZstdCompressor()
-            return cctx.compress(payload)
-        elif compression_method == "bzip2":
-            return bz2.compress(payload)
-        elif compression_method == "rle":
-            return compress_with_rle(payload)
-        elif compression_method == "lossless_image":
-            return compress_image_lossless(payload)  # Image is compressed in lossless JPEG
-        else:
-            raise ValueError(f"Unknown compression method: {compression_method}")
+        codec = get_codec(compression_method)
+        codec.check_dictionary(dictionary)
+        return codec.compress(payload, level, window_log, dictionary)
     except Exception as e:
         raise RuntimeError(f"Recompression failed: {e}")
 
-def start_echo_server():
-    server_ip = '0.0.0.0'  # Listen on all available interfaces
-    server_port = 1222      # Updated port to 1222
-    buffer_size = 1024      # Size of the chunks to read from clients
+def compression_ratio(decompressed_size: int, recompressed_size: int) -> float:
+    if not decompressed_size:
+        return 0.0
+    return ((decompressed_size - recompressed_size) / decompressed_size) * 100
+
+@profiler.profiled
+def process_payload(payload: bytes, compression_method: str, level=None, window_log=None, dict_id=None,
+                    target_method=None, target_level=None, target_window_log=None, target_dict_id=None,
+                    smallest=False, deadline=None, candidates=None, max_output=None):
+    """Decompress a payload and recompress it with the target codec (the source codec by default).
+
+    With smallest set, the candidates (the configured ones by default) are raced
+    instead and the smallest result ready within deadline seconds is kept.
+    max_output, set under a memory budget, caps the decompressed payload; one that
+    decompresses to more is transcoded piece by piece instead (and refused when
+    racing candidates, which need it whole).
+    Returns the TranscodeStats and the recompressed payload.
+    """
+    if target_method is None:
+        target_method, target_level, target_window_log, target_dict_id = \
+            compression_method, level, window_log, dict_id
+
+    start = time.perf_counter()
+    try:
+        decompressed_payload = decompress_payload(payload, compression_method, window_log,
+                                                  lookup_dictionary(dict_id), max_output)
+    except DecompressionLimitExceeded as e:
+        if smallest or not get_codec(target_method).streaming:
+            raise RuntimeError(f"Decompression failed: {e}")
+        print(f"{e}, transcoding it piece by piece")
+        decompressed_payload = None
+    if decompressed_payload is None:
+        return transcode_pieces(payload, max_output, compression_method, level, window_log,
+                                lookup_dictionary(dict_id), target_method, target_level, target_window_log,
+                                lookup_dictionary(target_dict_id))
+    decompress_time = time.perf_counter() - start
+    print(f"Decompressed payload size: {len(decompressed_payload)} bytes")
+
+    start = time.perf_counter()
+    if smallest:
+        target_method, target_level, recompressed_payload = candidate_runner.run(
+            decompressed_payload, deadline, candidates)
+        target_window_log = None
+    else:
+        recompressed_payload = recompress_payload(decompressed_payload, target_method, target_level,
+                                                  target_window_log, lookup_dictionary(target_dict_id))
+    recompress_time = time.perf_counter() - start
+    print(f"Recompressed payload size: {len(recompressed_payload)} bytes ({target_method})")
+
+    # Calculate statistics
+    stats = TranscodeStats(
+        original_size=len(payload),
+        decompressed_size=len(decompressed_payload),
+        recompressed_size=len(recompressed_payload),
+        compression_ratio=compression_ratio(len(decompressed_payload), len(recompressed_payload)),
+        source_method=compression_method,
+        target_method=target_method,
+        decompress_time=decompress_time,
+        recompress_time=recompress_time,
+        target_level=target_level,
+        target_window_log=target_window_log,
+    )
+    return stats, recompressed_payload
+
+class StreamingTranscoder:
+    """Pipes incoming compressed chunks through a decompressor straight into a compressor,
+    so only a chunk, a piece of its decompressed output and the codec windows are held in
+    memory at any time: every piece is recompressed before the next one is decompressed."""
+
+    def __init__(self, compression_method: str, level=None, window_log=None, dictionary=None,
+                 target_method=None, target_level=None, target_window_log=None, target_dictionary=None,
+                 max_output=None):
+        if target_method is None:
+            target_method, target_level, target_window_log, target_dictionary = \
+                compression_method, level, window_log, dictionary
+        source_codec = get_codec(compression_method)
+        target_codec = get_codec(target_method)
+        source_codec.check_dictionary(dictionary)
+        target_codec.check_dictionary(target_dictionary)
+        self.decompress_chunk, self.finish_decompress = source_codec.piecewise_decompressor(
+            self._recompress, window_log, dictionary)
+        self.compress_chunk, self.finish_compress = target_codec.stream_compressor(
+            target_level, target_window_log, target_dictionary)
+        self.source_method = compression_method
+        self.target_method = target_method
+        self.target_level = target_level
+        self.target_window_log = target_window_log
+        self.original_size = 0
+        self.decompressed_size = 0
+        self.recompressed_size = 0
+        self.decompress_time = 0.0
+        self.recompress_time = 0.0
+        self.output = []
+        # Cap on the recompressed bytes, for output that is held whole rather than sent on
+        self.max_output = max_output
+        self.output_size = 0
+
+    def _recompress(self, piece) -> None:
+        self.decompressed_size += len(piece)
+        start = time.perf_counter()
+        output = self.compress_chunk(piece)
+        self.recompress_time += time.perf_counter() - start
+        if output:
+            self.output.append(output)
+            self.output_size += len(output)
+            if self.max_output is not None and self.output_size > self.max_output:
+                raise ValueError(f"Recompressed output exceeds {self.max_output} bytes")
+
+    def _transcode(self, decompress, *args) -> bytes:
+        recompress_time = self.recompress_time
+        start = time.perf_counter()
+        decompress(*args)
+        # Recompression runs inside the decompressor, piece by piece
+        self.decompress_time += time.perf_counter() - start - (self.recompress_time - recompress_time)
+        output = b"".join(self.output)
+        self.output.clear()
+        return output
+
+    def feed(self, chunk) -> bytes:
+        """Transcode one chunk of the payload, returning whatever output is ready."""
+        self.original_size += len(chunk)
+        try:
+            output = self._transcode(self.decompress_chunk, chunk)
+        except Exception as e:
+            raise RuntimeError(f"Streaming transcode failed: {e}")
+        self.recompressed_size += len(output)
+        return output
+
+    def finish(self) -> bytes:
+        """Flush both codecs, returning the tail of the recompressed stream."""
+        try:
+            output = self._transcode(self.finish_decompress)
+            start = time.perf_counter()
+            output += self.finish_compress()
+            self.recompress_time += time.perf_counter() - start
+        except Exception as e:
+            raise RuntimeError(f"Streaming transcode failed: {e}")
+        self.recompressed_size += len(output)
+        return output
+
+    def stats(self) -> TranscodeStats:
+        return TranscodeStats(self.original_size, self.decompressed_size, self.recompressed_size,
+                              compression_ratio(self.decompressed_size, self.recompressed_size),
+                              self.source_method, self.target_method,
+                              self.decompress_time, self.recompress_time,
+                              self.target_level, self.target_window_log)
+
+def transcode_pieces(payload, max_output: int, compression_method: str, level=None, window_log=None,
+                     dictionary=None, target_method=None, target_level=None, target_window_log=None,
+                     target_dictionary=None):
+    """process_payload for a payload too large to decompress whole: it goes through a
+    StreamingTranscoder chunk by chunk, and only the recompressed output is held."""
+    transcoder = StreamingTranscoder(compression_method, level, window_log, dictionary, target_method,
+                                     target_level, target_window_log, target_dictionary, max_output)
+    output = [transcoder.feed(payload[offset:offset + STREAM_CHUNK_SIZE])
+              for offset in range(0, len(payload), STREAM_CHUNK_SIZE)]
+    output.append(transcoder.finish())
+    recompressed_payload = b"".join(output)
+    print(f"Transcoded {transcoder.decompressed_size} decompressed bytes into {len(recompressed_payload)} bytes "
+          f"({target_method})")
+    return transcoder.stats(), recompressed_payload
+
+def open_transcoder(compression_method: str, level=None, window_log=None, dict_id=None, target_method=None,
+                    target_level=None, target_window_log=None, target_dict_id=None, smallest=False,
+                    deadline=None, candidates=None) -> StreamingTranscoder:
+    """StreamingTranscoder for the same keyword arguments process_payload takes."""
+    if smallest:
+        raise ValueError("Smallest-candidate recompression is not available for streamed requests")
+    return StreamingTranscoder(compression_method, level, window_log, lookup_dictionary(dict_id),
+                               target_method, target_level, target_window_log,
+                               lookup_dictionary(target_dict_id))
+
+# Slow codecs on large payloads go to worker processes, everything else runs inline.
+# Replaced in __main__ once the worker count is known.
+codec_executor = CodecExecutor(process_payload, workers=0, profiler=profiler)
+
+# Results of repeated requests, keyed by payload bytes and parameters.
+# Replaced in __main__ once the budget and disk tier are known.
+result_cache = ResultCache()
+
+def cache_hit_stats(cached):
+    """A cached result with its codec timings zeroed, since no codec ran for this request."""
+    stats, recompressed_payload = cached
+    return stats._replace(decompress_time=0.0, recompress_time=0.0), recompressed_payload
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((server_ip, server_port))
-        print(f"Server listening on {server_ip}:{server_port}")
+def cache_metrics():
+    counters = result_cache.counters()
+    return [
+        ("satellite_cache_hits_total", "counter", "Requests answered from the result cache",
+         [({"tier": "memory"}, counters["hits"] - counters["disk_hits"]), ({"tier": "disk"}, counters["disk_hits"])]),
+        ("satellite_cache_misses_total", "counter", "Requests that missed the result cache", [({}, counters["misses"])]),
+        ("satellite_cache_bytes", "gauge", "Bytes held by the memory tier of the result cache", [({}, counters["bytes"])]),
+    ]
 
-        server_socket.listen(15)
+def codec_load_metrics():
+    report = [(name, load_time, load_memory) for name, loaded, load_time, load_memory in load_report() if loaded]
+    return [
+        ("satellite_codec_import_seconds", "gauge", "Time taken to import each loaded codec",
+         [({"codec": name}, load_time) for name, load_time, _ in report]),
+        ("satellite_codec_import_resident_bytes", "gauge", "Resident memory added by importing each loaded codec",
+         [({"codec": name}, load_memory) for name, _, load_memory in report]),
+    ]
+
+def memory_budget_metrics():
+    counters = memory_budget.counters()
+    return [
+        ("satellite_memory_budget_bytes", "gauge", "Memory budget for codecs (0 when unlimited)",
+         [({}, counters["total"])]),
+        ("satellite_memory_reserved_bytes", "gauge", "Estimated codec memory held by running requests",
+         [({}, counters["reserved"])]),
+        ("satellite_memory_downgraded_total", "counter", "Requests run with parameters lowered to fit the budget",
+         [({}, counters["downgraded"])]),
+        ("satellite_memory_refused_total", "counter", "Requests refused for not fitting the budget",
+         [({}, counters["refused"])]),
+    ]
+
+def scheduler_metrics():
+    counters = scheduler.counters()
+    return [
+        ("satellite_scheduler_queued", "gauge", "Requests waiting for a codec slot",
+         [({"class": name}, counters[name]["queued"]) for name in CLASSES]),
+        ("satellite_scheduler_running", "gauge", "Requests holding a codec slot",
+         [({"class": name}, counters[name]["running"]) for name in CLASSES]),
+        ("satellite_scheduler_dispatched_total", "counter", "Codec slots handed out",
+         [({"class": name}, counters[name]["dispatched"]) for name in CLASSES]),
+    ]
+
+def observe_wait(name: str, seconds: float) -> None:
+    metrics.observe_summary("satellite_scheduler_wait_seconds", "Time spent waiting for a codec slot",
+                            {"class": name}, seconds)
+
+# Per-stage timings of every request, served by --metrics-port
+metrics = Metrics()
+metrics.add_collector(cache_metrics)
+metrics.add_collector(codec_load_metrics)
+metrics.add_collector(memory_budget_metrics)
+metrics.add_collector(scheduler_metrics)
+
+# Orders codec work of the async server by request class.
+# Replaced in __main__ once the slots and weights are known.
+scheduler = WeightedFairScheduler()
+scheduler.on_wait = observe_wait
+
+def print_codec_report() -> None:
+    """Startup report of which codecs are enabled and what loading them cost."""
+    print(f"Resident memory: {resident_memory() // 1024} KiB")
+    for name, loaded, load_time, load_memory in load_report():
+        if loaded:
+            print(f"  {name}: imported in {load_time * 1000:.1f} ms, +{load_memory // 1024} KiB resident")
+        else:
+            print(f"  {name}: loaded on first use")
+
+def response_timings(timer: RequestTimer, timed_stats: bool):
+    """Stage timings for the response stats, when the request asked for them."""
+    if not timed_stats:
+        return None
+    return StageTimings(timer.stages.get("header", 0.0), timer.stages.get("receive", 0.0))
+
+# Under a memory budget a whole payload may decompress to this many times its size,
+# and to at least MIN_DECOMPRESSED_ALLOWANCE bytes, before it is transcoded piece by piece
+DECOMPRESSED_ALLOWANCE = 2
+MIN_DECOMPRESSED_ALLOWANCE = 1024 * 1024
+
+def admit_request(payload_size: int, compression_method: str, options: dict, streamed=False):
+    """Reserve the request's memory, returning its options as lowered to fit and the reservation.
+
+    Called with the size announced by the header before the payload is read, so a
+    request that does not fit is refused before its buffer is allocated. A streamed
+    request is admitted for one chunk; a whole payload under a budget also gets a
+    decompressed size allowance, reserved with it and passed on as max_output.
+    """
+    if streamed or not memory_budget.enabled:
+        # A chunk plus its recompressed output
+        return memory_budget.admit(compression_method, 2 * payload_size, options, candidate_runner.candidates)
+    allowance = max(DECOMPRESSED_ALLOWANCE * payload_size, MIN_DECOMPRESSED_ALLOWANCE)
+    # The received payload, the decompressed payload and the recompressed output, both up to the allowance
+    return memory_budget.admit(compression_method, payload_size + 2 * allowance,
+                               dict(options, max_output=allowance), candidate_runner.candidates)
+
+def discard_payload(client_socket, size: int) -> None:
+    """Read a refused payload off the connection a chunk at a time, so the refusal reaches
+    the client instead of a reset and the connection stays in step for the next request."""
+    buffer = buffer_pool.acquire(min(size, STREAM_CHUNK_SIZE))
+    try:
+        while size:
+            received = client_socket.recv_into(buffer, min(len(buffer), size))
+            if not received:
+                raise ConnectionError("Connection closed before the refused payload was read")
+            size -= received
+    finally:
+        buffer_pool.release(buffer)
+
+async def discard_async_payload(reader, read_timeout, size: int) -> None:
+    """Async counterpart of discard_payload."""
+    while size:
+        chunk = await asyncio.wait_for(reader.read(min(size, STREAM_CHUNK_SIZE)), read_timeout)
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"", size)
+        size -= len(chunk)
+
+def refuse_request(request_id: int, error: Exception, client_address=None) -> list:
+    """Session response refusing a request whose payload has not been read."""
+    print(f"{client_address or 'Client'}: request {request_id} refused: {error}")
+    error_message = f"Request refused: {error}".encode('utf-8')
+    return [pack_session_response(request_id, STATUS_ERROR, len(error_message)), error_message]
+
+def run_cached(payload, compression_method: str, **options):
+    """Answer from the result cache when possible, otherwise process through the codec executor.
+
+    options are the ones admit_request returned for the request.
+    """
+    if not result_cache.enabled:
+        return codec_executor.run(payload, compression_method, **options)
+    key = cache_key(payload, compression_method, options)
+    cached = result_cache.get(key)
+    if cached is not None:
+        print(f"Cache hit for {compression_method} payload of {len(payload)} bytes "
+              f"({result_cache.hits} hits, {result_cache.misses} misses)")
+        return cache_hit_stats(cached)
+    stats, recompressed_payload = codec_executor.run(payload, compression_method, **options)
+    result_cache.put(key, stats, recompressed_payload)
+    return stats, recompressed_payload
+
+async def run_cached_async(payload, compression_method: str, priority_class=None, **options):
+    """Async counterpart of run_cached; hashing and the disk tier stay off the event loop.
+
+    The request waits for a codec slot of its scheduling class (by payload size when None);
+    it has been admitted before its payload was read.
+    """
+    async with scheduler.slot(priority_class or scheduler.classify(PRIORITY_AUTO, len(payload))):
+        if not result_cache.enabled:
+            return await codec_executor.run_async(payload, compression_method, **options)
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(None, cache_key, payload, compression_method, options)
+        cached = await loop.run_in_executor(None, result_cache.get, key)
+        if cached is not None:
+            print(f"Cache hit for {compression_method} payload of {len(payload)} bytes "
+                  f"({result_cache.hits} hits, {result_cache.misses} misses)")
+            return cache_hit_stats(cached)
+        stats, recompressed_payload = await codec_executor.run_async(payload, compression_method, **options)
+        await loop.run_in_executor(None, result_cache.put, key, stats, recompressed_payload)
+        return stats, recompressed_payload
+
+def receive_and_process(client_socket, payload_size: int, compression_method: str, timer: RequestTimer,
+                        shared=None, **options):
+    """Receive a payload straight into a pooled buffer and process it in place.
+
+    With shared set (a SharedSegments), only a descriptor is received and the
+    payload is read where it lies in the client's shared memory. The request must
+    already be admitted, options are the ones admit_request returned.
+    """
+    if shared is not None:
+        buffer = None
+        payload = shared.receive(client_socket, payload_size)
+    else:
+        buffer = buffer_pool.acquire(payload_size)
+        payload = memoryview(buffer)[:payload_size]
+    try:
+        if buffer is not None:
+            recv_exactly_into(client_socket, payload)
+        timer.lap("receive")
+        print(f"Received payload of size: {len(payload)} bytes")
+        result = run_cached(payload, compression_method, **options)
+        timer.lap()  # Codec time is carried by the stats themselves
+        return result
+    finally:
+        # The codecs return fresh objects, so the buffer can be reused straight away
+        payload.release()
+        if buffer is not None:
+            buffer_pool.release(buffer)
+
+def run_control(command: int, argument: int) -> int:
+    """Execute an operator command received over the control preamble."""
+    if command == CONTROL_PROFILE_START:
+        profiler.start(argument or None)
+    elif command == CONTROL_PROFILE_STOP:
+        profiler.stop()
+    else:
+        print(f"Unknown control command: {command}")
+        return STATUS_ERROR
+    return STATUS_OK
+
+def start_echo_server(server_ip='0.0.0.0', server_port=1222, transport="tcp", socket_path=DEFAULT_SOCKET_PATH,
+                      read_timeout=15.0):
+    with listen_socket(transport, server_ip, server_port, socket_path) as server_socket:
+        print(f"Server listening on {describe(transport, server_ip, server_port, socket_path)}")
 
         while True:
             client_socket, client_address = server_socket.accept()
+            client_address = client_address or "local client"
             print(f"Connection from {client_address}")
+            # Clients are served one at a time, so one that goes quiet must not hold the server
+            client_socket.settimeout(read_timeout)
+            # Segments of payloads passed by shared memory, only accepted on the shm transport
+            segments = SharedSegments() if transport == "shm" else None
 
             with client_socket:
                 try:
                     # Step 1: Read the 4-byte preamble
                     preamble = client_socket.recv(4)
-                    if preamble != b'\xaa\xbb\xcc\xdd':
+                    if preamble == SESSION_PREAMBLE:
+                        print("Session preamble received.")
+                        serve_session(client_socket)
+                        print(f"Connection closed from {client_address}")
+                        continue
+                    if preamble == STREAM_PREAMBLE:
+                        print("Stream preamble received.")
+                        serve_stream(client_socket)
+                        print(f"Connection closed from {client_address}")
+                        continue
+                    if preamble == HEADER_PREAMBLE:
+                        serve_binary(client_socket, preamble, segments)
+                        print(f"Connection closed from {client_address}")
+                        continue
+                    if preamble == CONTROL_PREAMBLE:
+                        command, argument = struct.unpack(CONTROL_FORMAT, recv_exactly(client_socket, CONTROL_SIZE))
+                        status = run_control(command, argument)
+                        client_socket.sendall(struct.pack(CONTROL_RESPONSE_FORMAT, status))
+                        print(f"Connection closed from {client_address}")
+                        continue
+                    if preamble != PREAMBLE:
                         raise ValueError("Invalid preamble received.")
                     print("Preamble received and validated.")
 
                     # Step 2: Read the 4-byte payload size header
+                    timer = RequestTimer()
                     size_header = client_socket.recv(4)
                     if len(size_header) != 4:
                         raise ValueError("Incomplete size header received.")
@@ -132,49 +517,705 @@ def start_echo_server():
                         compression_method += byte
                     compression_method = compression_method.decode('utf-8').strip()
                     print(f"Compression method: {compression_method}")
+                    timer.lap("header")
 
-                    # Step 4: Read the payload based on the payload size
-                    payload = b""
-                    while len(payload) < payload_size:
-                        chunk = client_socket.recv(min(buffer_size, payload_size - len(payload)))
-                        if not chunk:
-                            raise ConnectionError("Connection closed unexpectedly.")
-                        payload += chunk
-                    print(f"Received payload of size: {len(payload)} bytes")
-
-                    # Process the payload (decompress, recompress, etc.)
-                    decompressed_payload = decompress_payload(payload, compression_method)
-                    print(f"Decompressed payload size: {len(decompressed_payload)} bytes")
-
-                    recompressed_payload = recompress_payload(decompressed_payload, compression_method)
-                    print(f"Recompressed payload size: {len(recompressed_payload)} bytes")
-
-                    # Calculate statistics
-                    original_size = len(payload)
-                    decompressed_size = len(decompressed_payload)
-                    recompressed_size = len(recompressed_payload)
-                    compression_ratio = ((decompressed_size - recompressed_size) / decompressed_size) * 100
-
-                    # Pack the stats header using struct.pack
-                    header_format = "iii f"
-                    packed_header = struct.pack(
-                        header_format,
-                        original_size,
-                        decompressed_size,
-                        recompressed_size,
-                        compression_ratio
-                    )
+                    # Step 4: Read the payload based on the payload size and process it
+                    # (decompress, recompress, etc.)
+                    try:
+                        options, reserved = admit_request(payload_size, compression_method, {})
+                    except ValueError:
+                        discard_payload(client_socket, payload_size)
+                        raise
+                    try:
+                        stats, recompressed_payload = receive_and_process(
+                            client_socket, payload_size, compression_method, timer, **options)
+                    finally:
+                        memory_budget.release(reserved)
 
                     # Send the packed header and recompressed payload to the client
-                    client_socket.sendall(packed_header + recompressed_payload)
+                    send_buffers(client_socket, [pack_stats(stats, 0), recompressed_payload])
+                    timer.lap("send")
+                    metrics.observe_request(stats, timer)
                     print("Response sent to client.")
 
+                except (ConnectionError, TimeoutError) as e:
+                    # Dropped or gone quiet: there is nobody left to answer
+                    print(f"Connection from {client_address} lost: {e!r}")
                 except Exception as e:
                     error_message = f"Error processing payload: {e}"
                     print(error_message)
-                    client_socket.sendall(error_message.encode('utf-8') + b'\x00')
+                    try:
+                        client_socket.sendall(error_message.encode('utf-8') + b'\x00')
+                    except OSError as send_error:
+                        print(f"Could not report the error to {client_address}: {send_error!r}")
+                finally:
+                    if segments is not None:
+                        segments.close()
+
+            print(f"Connection closed from {client_address}")
+
+def serve_session(client_socket):
+    """Serve session frames one after another until the client half-closes the connection."""
+    while True:
+        try:
+            frame_header = recv_exactly(client_socket, SESSION_FRAME_SIZE)
+        except (ConnectionError, TimeoutError):
+            break
+        timer = RequestTimer()
+        request_id, payload_size = struct.unpack(SESSION_FRAME_FORMAT, frame_header)
+        compression_method = b""
+        while True:
+            byte = recv_exactly(client_socket, 1)
+            if byte == b'\n':
+                break
+            compression_method += byte
+        compression_method = compression_method.decode('utf-8').strip()
+        timer.lap("header")
+        print(f"Session request {request_id}: {compression_method} payload of {payload_size} bytes")
+        serve_session_request_sync(client_socket, request_id, payload_size, compression_method, timer=timer)
+
+def serve_session_request_sync(client_socket, request_id: int, payload_size: int,
+                               compression_method: str, stats_version=0, timed_stats=False,
+                               timer=None, shared=None, **options):
+    """Receive and process one request, answering it with a session response."""
+    timer = timer or RequestTimer()
+    try:
+        options, reserved = admit_request(payload_size, compression_method, options)
+    except ValueError as e:
+        send_buffers(client_socket, refuse_request(request_id, e))
+        discard_payload(client_socket, SHARED_DESCRIPTOR_SIZE if shared is not None else payload_size)
+        return
+    try:
+        stats, recompressed_payload = receive_and_process(
+            client_socket, payload_size, compression_method, timer, shared, **options)
+    except (ConnectionError, TimeoutError):
+        # The connection is unusable, so the caller drops it instead of answering
+        raise
+    except Exception as e:
+        error_message = f"Error processing payload: {e}".encode('utf-8')
+        send_buffers(client_socket, [pack_session_response(request_id, STATUS_ERROR, len(error_message)),
+                                     error_message])
+        return
+    finally:
+        memory_budget.release(reserved)
+    packed_header = pack_stats(stats, stats_version, response_timings(timer, timed_stats))
+    body_length = len(packed_header) + len(recompressed_payload)
+    send_buffers(client_socket, [pack_session_response(request_id, STATUS_OK, body_length),
+                                 packed_header, recompressed_payload])
+    timer.lap("send")
+    metrics.observe_request(stats, timer)
+
+def header_options(header) -> dict:
+    """Codec parameters requested by a binary header, as keyword arguments for process_payload."""
+    return {"level": header.level, "window_log": header.window_log, "dict_id": header.dict_id,
+            "target_method": header.target_method, "target_level": header.target_level,
+            "target_window_log": header.target_window_log, "target_dict_id": header.target_dict_id,
+            "smallest": bool(header.flags & FLAG_SMALLEST),
+            "deadline": header.deadline_ms / 1000 if header.deadline_ms else None}
+
+def shared_segments(header, segments):
+    """Segments to read a binary request's payload from, or None when it follows on the connection."""
+    if not header.flags & FLAG_SHARED:
+        return None
+    if segments is None:
+        raise ValueError("Shared memory payloads are only accepted on the shm transport")
+    if header.flags & FLAG_STREAM:
+        raise ValueError("FLAG_SHARED cannot be combined with FLAG_STREAM")
+    return segments
+
+def chunked_upload(header) -> bool:
+    """Whether a binary request's payload arrives in chunks of unknown total size."""
+    if not header.flags & FLAG_CHUNKED:
+        return False
+    if not header.flags & FLAG_STREAM:
+        raise ValueError("FLAG_CHUNKED is only accepted together with FLAG_STREAM")
+    return True
+
+def read_binary_header(client_socket, preamble: bytes):
+    """Read the rest of a binary header whose preamble has already been consumed."""
+    prefix = preamble + recv_exactly(client_socket, HEADER_PREFIX_SIZE - len(preamble))
+    header = prefix + recv_exactly(client_socket, header_size(prefix) - HEADER_PREFIX_SIZE)
+    return unpack_header(header)
+
+def serve_binary(client_socket, preamble: bytes, segments=None):
+    """Serve binary-header requests until the client half-closes the connection."""
+    while True:
+        timer = RequestTimer()
+        header = read_binary_header(client_socket, preamble)
+        timer.lap("header")
+        shared = shared_segments(header, segments)
+        chunked = chunked_upload(header)
+        options = header_options(header)
+        print(f"Request {header.request_id}: {header.compression_method} payload of "
+              f"{header.payload_size} bytes, {options}")
+        stats_version = header.version
+        timed_stats = bool(header.flags & FLAG_TIMINGS)
+        if header.flags & FLAG_STREAM:
+            transcode_stream(client_socket, header.payload_size, header.compression_method,
+                             stats_version, timed_stats, timer, chunked, **options)
+            return
+        serve_session_request_sync(client_socket, header.request_id, header.payload_size,
+                                   header.compression_method, stats_version, timed_stats, timer, shared,
+                                   **options)
+        try:
+            preamble = recv_exactly(client_socket, len(HEADER_PREAMBLE))
+        except (ConnectionError, TimeoutError):
+            # Half-closed, or idle for longer than the read timeout
+            break
+
+def serve_stream(client_socket):
+    """Read a streaming request and transcode it."""
+    timer = RequestTimer()
+    size_header = recv_exactly(client_socket, 4)
+    payload_size = struct.unpack("!I", size_header)[0]
+    compression_method = b""
+    while True:
+        byte = recv_exactly(client_socket, 1)
+        if byte == b'\n':
+            break
+        compression_method += byte
+    compression_method = compression_method.decode('utf-8').strip()
+    timer.lap("header")
+    transcode_stream(client_socket, payload_size, compression_method, timer=timer)
+
+def receive_chunks(client_socket, buffer, payload_size: int, chunked=False):
+    """Yield the incoming payload in views of buffer of at most STREAM_CHUNK_SIZE bytes.
+
+    A chunked payload is read frame by frame until its zero-length frame;
+    otherwise payload_size bytes are read.
+    """
+    while True:
+        if chunked:
+            remaining = struct.unpack(STREAM_CHUNK_FORMAT, recv_exactly(client_socket, STREAM_CHUNK_HEADER_SIZE))[0]
+            if not remaining:
+                return
+        else:
+            remaining = payload_size
+        while remaining:
+            chunk = memoryview(buffer)[:min(STREAM_CHUNK_SIZE, remaining)]
+            recv_exactly_into(client_socket, chunk)
+            remaining -= len(chunk)
+            yield chunk
+        if not chunked:
+            return
+
+async def receive_async_chunks(reader, read_timeout, payload_size: int, chunked=False):
+    """Async counterpart of receive_chunks."""
+    while True:
+        if chunked:
+            frame_header = await asyncio.wait_for(reader.readexactly(STREAM_CHUNK_HEADER_SIZE), read_timeout)
+            remaining = struct.unpack(STREAM_CHUNK_FORMAT, frame_header)[0]
+            if not remaining:
+                return
+        else:
+            remaining = payload_size
+        while remaining:
+            chunk = await asyncio.wait_for(reader.readexactly(min(STREAM_CHUNK_SIZE, remaining)), read_timeout)
+            remaining -= len(chunk)
+            yield chunk
+        if not chunked:
+            return
+
+def transcode_stream(client_socket, payload_size: int, compression_method: str, stats_version=0,
+                     timed_stats=False, timer=None, chunked=False, **options):
+    """Transcode one payload chunk by chunk, streaming the output back with chunked framing."""
+    print(f"Streaming {compression_method} payload of {'about ' if chunked else ''}{payload_size} bytes")
+    timer = timer or RequestTimer()
+    buffer = buffer_pool.acquire(STREAM_CHUNK_SIZE)
+    chunks = receive_chunks(client_socket, buffer, payload_size, chunked)
+    reserved = 0
+    try:
+        options, reserved = admit_request(STREAM_CHUNK_SIZE, compression_method, options, streamed=True)
+        transcoder = open_transcoder(compression_method, **options)
+        for chunk in chunks:
+            timer.lap("receive")
+            output = transcoder.feed(chunk)
+            timer.lap()
+            if output:
+                send_buffers(client_socket, [pack_stream_chunk_header(output), output])
+                timer.lap("send")
+        output = transcoder.finish()
+        timer.lap()
+    except (ConnectionError, TimeoutError):
+        # The connection is unusable, so the caller drops it instead of answering
+        raise
+    except Exception as e:
+        error_message = f"Error processing payload: {e}"
+        print(error_message)
+        client_socket.sendall(pack_stream_error(error_message.encode('utf-8')))
+        # Read the rest of the upload past, so the error is not lost to a reset connection
+        for _ in chunks:
+            pass
+        return
+    finally:
+        memory_budget.release(reserved)
+        buffer_pool.release(buffer)
+
+    stats = transcoder.stats()
+    send_buffers(client_socket, [pack_stream_chunk_header(output), output, pack_stream_chunk_header(b""),
+                                 pack_stats(stats, stats_version, response_timings(timer, timed_stats))])
+    timer.lap("send")
+    metrics.observe_request(stats, timer)
+    print(f"Streamed {transcoder.recompressed_size} recompressed bytes "
+          f"({transcoder.decompressed_size} bytes decompressed)")
+
+async def serve_async_stream(reader, writer, client_address, read_timeout, write_timeout):
+    """Async counterpart of serve_stream."""
+    timer = RequestTimer()
+    size_header = await asyncio.wait_for(reader.readexactly(4), read_timeout)
+    payload_size = struct.unpack("!I", size_header)[0]
+    compression_method = await asyncio.wait_for(reader.readuntil(b'\n'), read_timeout)
+    compression_method = compression_method.decode('utf-8').strip()
+    timer.lap("header")
+    await transcode_async_stream(reader, writer, client_address, read_timeout, write_timeout,
+                                 payload_size, compression_method, timer=timer)
+
+async def transcode_async_stream(reader, writer, client_address, read_timeout, write_timeout,
+                                 payload_size: int, compression_method: str, stats_version=0,
+                                 timed_stats=False, timer=None, priority_class=None, chunked=False, **options):
+    """Async counterpart of transcode_stream; every chunk waits for a codec slot of its own,
+    so a long stream cannot hold up higher priority requests."""
+    print(f"{client_address}: streaming {compression_method} payload of {payload_size} bytes")
+    priority_class = priority_class or scheduler.classify(PRIORITY_AUTO, payload_size)
+    loop = asyncio.get_running_loop()
+    timer = timer or RequestTimer()
+    chunks = receive_async_chunks(reader, read_timeout, payload_size, chunked)
+    reserved = 0
+    try:
+        options, reserved = admit_request(STREAM_CHUNK_SIZE, compression_method, options, streamed=True)
+        transcoder = open_transcoder(compression_method, **options)
+        async for chunk in chunks:
+            timer.lap("receive")
+            async with scheduler.slot(priority_class):
+                output = await loop.run_in_executor(None, transcoder.feed, chunk)
+            timer.lap()
+            if output:
+                writer.writelines([pack_stream_chunk_header(output), output])
+                await asyncio.wait_for(writer.drain(), write_timeout)
+                timer.lap("send")
+        async with scheduler.slot(priority_class):
+            output = await loop.run_in_executor(None, transcoder.finish)
+        timer.lap()
+    except (ValueError, RuntimeError) as e:
+        error_message = f"Error processing payload: {e}"
+        print(error_message)
+        writer.write(pack_stream_error(error_message.encode('utf-8')))
+        await asyncio.wait_for(writer.drain(), write_timeout)
+        # Read the rest of the upload past, so the error is not lost to a reset connection
+        async for _ in chunks:
+            pass
+        return
+    finally:
+        memory_budget.release(reserved)
+
+    stats = transcoder.stats()
+    writer.writelines([pack_stream_chunk_header(output), output, pack_stream_chunk_header(b""),
+                       pack_stats(stats, stats_version, response_timings(timer, timed_stats))])
+    await asyncio.wait_for(writer.drain(), write_timeout)
+    timer.lap("send")
+    metrics.observe_request(stats, timer)
+
+async def serve_session_request(writer, write_lock, window, client_address, request_id,
+                                payload, compression_method, write_timeout, options=None, stats_version=0,
+                                timed_stats=False, timer=None, priority_class=None, reserved=0):
+    """Process one session request and write its response as soon as it is ready.
+
+    reserved is the request's memory reservation, handed back once it is answered.
+    """
+    timer = timer or RequestTimer()
+    stats = None
+    try:
+        try:
+            stats, recompressed_payload = await run_cached_async(
+                payload, compression_method, priority_class, **(options or {}))
+            timer.lap()  # Codec time is carried by the stats themselves
+            packed_header = pack_stats(stats, stats_version, response_timings(timer, timed_stats))
+            parts = [pack_session_response(request_id, STATUS_OK,
+                                           len(packed_header) + len(recompressed_payload)),
+                     packed_header, recompressed_payload]
+        except Exception as e:
+            error_message = f"Error processing payload: {e}".encode('utf-8')
+            print(f"{client_address}: request {request_id} failed: {e}")
+            parts = [pack_session_response(request_id, STATUS_ERROR, len(error_message)), error_message]
 
+        # Responses are written whole so frames from concurrent requests never interleave
+        async with write_lock:
+            writer.writelines(parts)
+            await asyncio.wait_for(writer.drain(), write_timeout)
+        timer.lap("send")
+        if stats is not None:
+            metrics.observe_request(stats, timer)
+    finally:
+        memory_budget.release(reserved)
+        window.release()
+
+async def serve_async_session(reader, writer, client_address, read_timeout, write_timeout,
+                              session_window):
+    """Read pipelined session frames and process them concurrently, answering out of order."""
+    write_lock = asyncio.Lock()
+    window = asyncio.Semaphore(session_window)
+    pending = set()
+    try:
+        while True:
+            try:
+                frame_header = await asyncio.wait_for(
+                    reader.readexactly(SESSION_FRAME_SIZE), read_timeout)
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise
+                break  # Client finished sending frames
+            timer = RequestTimer()
+            request_id, payload_size = struct.unpack(SESSION_FRAME_FORMAT, frame_header)
+            compression_method = await asyncio.wait_for(reader.readuntil(b'\n'), read_timeout)
+            compression_method = compression_method.decode('utf-8').strip()
+            timer.lap("header")
+            try:
+                options, reserved = admit_request(payload_size, compression_method, {})
+            except ValueError as e:
+                await write_refusal(writer, write_lock, write_timeout, refuse_request(request_id, e, client_address))
+                await discard_async_payload(reader, read_timeout, payload_size)
+                continue
+            try:
+                payload = await asyncio.wait_for(reader.readexactly(payload_size), read_timeout)
+                timer.lap("receive")
+
+                # Stop reading new frames while too many requests of this session are in flight
+                await window.acquire()
+            except BaseException:
+                memory_budget.release(reserved)
+                raise
+            timer.lap()
+            task = asyncio.create_task(serve_session_request(
+                writer, write_lock, window, client_address, request_id,
+                payload, compression_method, write_timeout, options, timer=timer, reserved=reserved))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    finally:
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+async def write_refusal(writer, write_lock, write_timeout, parts) -> None:
+    async with write_lock:
+        writer.writelines(parts)
+        await asyncio.wait_for(writer.drain(), write_timeout)
+
+async def release_after(view, coroutine):
+    """Await coroutine, then release the shared memory view it worked on."""
+    try:
+        return await coroutine
+    finally:
+        view.release()
+
+async def serve_async_binary(reader, writer, client_address, preamble, read_timeout, write_timeout,
+                             session_window, segments=None):
+    """Async counterpart of serve_binary; requests are processed concurrently like a session."""
+    write_lock = asyncio.Lock()
+    window = asyncio.Semaphore(session_window)
+    pending = set()
+    try:
+        while True:
+            timer = RequestTimer()
+            prefix = preamble + await asyncio.wait_for(
+                reader.readexactly(HEADER_PREFIX_SIZE - len(preamble)), read_timeout)
+            header = unpack_header(prefix + await asyncio.wait_for(
+                reader.readexactly(header_size(prefix) - HEADER_PREFIX_SIZE), read_timeout))
+            timer.lap("header")
+            shared = shared_segments(header, segments)
+            chunked = chunked_upload(header)
+            options = header_options(header)
+            stats_version = header.version
+            timed_stats = bool(header.flags & FLAG_TIMINGS)
+            priority_class = scheduler.classify(header.priority, header.payload_size)
+            print(f"{client_address}: request {header.request_id}: {header.compression_method} payload of "
+                  f"{header.payload_size} bytes ({priority_class}), {options}")
+
+            if header.flags & FLAG_STREAM:
+                # Streamed output is not tagged, so earlier responses must be out first
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+                await transcode_async_stream(reader, writer, client_address, read_timeout, write_timeout,
+                                             header.payload_size, header.compression_method,
+                                             stats_version, timed_stats, timer, priority_class, chunked,
+                                             **options)
+                break
+
+            try:
+                options, reserved = admit_request(header.payload_size, header.compression_method, options)
+            except ValueError as e:
+                await write_refusal(writer, write_lock, write_timeout,
+                                    refuse_request(header.request_id, e, client_address))
+                await discard_async_payload(reader, read_timeout,
+                                            SHARED_DESCRIPTOR_SIZE if shared is not None else header.payload_size)
+            else:
+                try:
+                    if shared is not None:
+                        descriptor = await asyncio.wait_for(reader.readexactly(SHARED_DESCRIPTOR_SIZE),
+                                                            read_timeout)
+                        payload = shared.view(descriptor, header.payload_size)
+                    else:
+                        payload = await asyncio.wait_for(reader.readexactly(header.payload_size), read_timeout)
+                    timer.lap("receive")
+                    await window.acquire()
+                except BaseException:
+                    memory_budget.release(reserved)
+                    raise
+                timer.lap()
+                request = serve_session_request(
+                    writer, write_lock, window, client_address, header.request_id,
+                    payload, header.compression_method, write_timeout, options, stats_version,
+                    timed_stats, timer, priority_class, reserved)
+                task = asyncio.create_task(release_after(payload, request) if shared is not None else request)
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            try:
+                preamble = await asyncio.wait_for(reader.readexactly(len(HEADER_PREAMBLE)), read_timeout)
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise
+                break  # Client finished sending requests
+    finally:
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+async def handle_client(reader, writer, semaphore, read_timeout, write_timeout, session_window=64,
+                        transport="tcp"):
+    """Serve one ground station connection using the same wire protocol as start_echo_server."""
+    client_address = writer.get_extra_info('peername') or "local client"
+    print(f"Connection from {client_address}")
+    segments = SharedSegments() if transport == "shm" else None
+
+    # Connections beyond the concurrency limit wait here until a slot frees up
+    async with semaphore:
+        try:
+            # Step 1: Read the 4-byte preamble
+            preamble = await asyncio.wait_for(reader.readexactly(4), read_timeout)
+            if preamble == SESSION_PREAMBLE:
+                print(f"Session started by {client_address}")
+                await serve_async_session(reader, writer, client_address, read_timeout,
+                                          write_timeout, session_window)
+                return
+            if preamble == STREAM_PREAMBLE:
+                await serve_async_stream(reader, writer, client_address, read_timeout, write_timeout)
+                return
+            if preamble == HEADER_PREAMBLE:
+                await serve_async_binary(reader, writer, client_address, preamble, read_timeout,
+                                         write_timeout, session_window, segments)
+                return
+            if preamble == CONTROL_PREAMBLE:
+                control = await asyncio.wait_for(reader.readexactly(CONTROL_SIZE), read_timeout)
+                status = run_control(*struct.unpack(CONTROL_FORMAT, control))
+                writer.write(struct.pack(CONTROL_RESPONSE_FORMAT, status))
+                await asyncio.wait_for(writer.drain(), write_timeout)
+                return
+            if preamble != PREAMBLE:
+                raise ValueError("Invalid preamble received.")
+
+            # Step 2: Read the 4-byte payload size header
+            timer = RequestTimer()
+            size_header = await asyncio.wait_for(reader.readexactly(4), read_timeout)
+            payload_size = struct.unpack("!I", size_header)[0]
+
+            # Step 3: Read the compression method (up to the first newline character)
+            compression_method = await asyncio.wait_for(reader.readuntil(b'\n'), read_timeout)
+            compression_method = compression_method.decode('utf-8').strip()
+            print(f"{client_address}: {compression_method} payload of {payload_size} bytes")
+            timer.lap("header")
+
+            # Step 4: Read the payload based on the payload size, once the request is admitted
+            try:
+                options, reserved = admit_request(payload_size, compression_method, {})
+            except ValueError:
+                await discard_async_payload(reader, read_timeout, payload_size)
+                raise
+            try:
+                payload = await asyncio.wait_for(reader.readexactly(payload_size), read_timeout)
+                timer.lap("receive")
+
+                # Codecs are CPU bound, so keep them off the event loop
+                stats, recompressed_payload = await run_cached_async(
+                    payload, compression_method, **options)
+            finally:
+                memory_budget.release(reserved)
+            timer.lap()
+
+            writer.writelines([pack_stats(stats, 0), recompressed_payload])
+            await asyncio.wait_for(writer.drain(), write_timeout)
+            timer.lap("send")
+            metrics.observe_request(stats, timer)
+            print(f"Response sent to {client_address}.")
+
+        except asyncio.TimeoutError:
+            print(f"Timeout while serving {client_address}")
+        except asyncio.IncompleteReadError:
+            print(f"Connection closed unexpectedly by {client_address}")
+        except Exception as e:
+            error_message = f"Error processing payload: {e}"
+            print(error_message)
+            writer.write(error_message.encode('utf-8') + b'\x00')
+            try:
+                await asyncio.wait_for(writer.drain(), write_timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            if segments is not None:
+                segments.close()
             print(f"Connection closed from {client_address}")
 
+async def start_async_server(server_ip='0.0.0.0', server_port=1222, max_concurrency=256,
+                             read_timeout=15.0, write_timeout=15.0, session_window=64,
+                             transport="tcp", socket_path=DEFAULT_SOCKET_PATH):
+    """Event-loop server that serves many ground stations concurrently."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    def client_connected(reader, writer):
+        return handle_client(reader, writer, semaphore, read_timeout, write_timeout,
+                             session_window, transport)
+
+    server_socket = listen_socket(transport, server_ip, server_port, socket_path, max(15, max_concurrency))
+    server = await asyncio.start_server(client_connected, sock=server_socket)
+    print(f"Async server listening on {describe(transport, server_ip, server_port, socket_path)} "
+          f"(max {max_concurrency} concurrent sessions)")
+    async with server:
+        await server.serve_forever()
+
+def parse_weights(spec: str) -> dict:
+    """Parse "command=16,bulk=1" into {"command": 16, "bulk": 1}."""
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in CLASSES:
+            raise ValueError(f"Unknown request class: {name}")
+        weights[name] = float(weight)
+        if weights[name] <= 0:
+            raise ValueError(f"Weight of {name} must be positive")
+    return weights
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Satellite compression echo server")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync",
+                        help="sync serves one client at a time, async serves many concurrently")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=1222)
+    parser.add_argument("--transport", choices=TRANSPORTS, default="tcp",
+                        help="tcp; unix for a Unix domain socket at --socket-path; shm to also read "
+                             "large payloads from the ground station's shared memory (same host only)")
+    parser.add_argument("--socket-path", default=DEFAULT_SOCKET_PATH,
+                        help="Unix domain socket of the unix and shm transports")
+    parser.add_argument("--max-concurrency", type=int, default=256,
+                        help="Maximum number of sessions served at once (async mode)")
+    parser.add_argument("--read-timeout", type=float, default=15.0,
+                        help="Per-connection read timeout in seconds; idle connections are closed after it")
+    parser.add_argument("--write-timeout", type=float, default=15.0,
+                        help="Per-connection write timeout in seconds (async mode)")
+    parser.add_argument("--session-window", type=int, default=64,
+                        help="Maximum requests in flight per session connection (async mode)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes for slow codecs on large payloads (0 runs everything inline)")
+    parser.add_argument("--inline-threshold", type=int, default=INLINE_THRESHOLD,
+                        help="Payloads smaller than this many bytes are always processed inline")
+    parser.add_argument("--dictionary-dir", default=DICTIONARY_DIR,
+                        help="Directory holding the trained compression dictionaries")
+    parser.add_argument("--candidates", type=parse_candidates, default=DEFAULT_CANDIDATES,
+                        help="Comma separated codec[:level] candidates raced for smallest-output requests")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE,
+                        help="Seconds a smallest-output request may spend when the client sets no deadline")
+    parser.add_argument("--candidate-threads", type=int, default=None,
+                        help="Threads for candidates whose codecs release the GIL (default: one per candidate for "
+                             "each of two overlapping races); candidates with no free thread are skipped")
+    parser.add_argument("--cache-bytes", type=int, default=None,
+                        help="Memory budget of the result cache in bytes (0 disables the memory tier; "
+                             f"default {DEFAULT_CACHE_BYTES}, or a quarter of --memory-budget when set)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory for the on-disk result cache tier (disabled when not set)")
+    parser.add_argument("--cache-disk-bytes", type=int, default=None,
+                        help="Size budget of the on-disk tier in bytes (unbounded when not set)")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="Address of the Prometheus metrics endpoint")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Port of the Prometheus metrics endpoint (0 disables it)")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR,
+                        help="Directory the per-request profiles are written to")
+    parser.add_argument("--profile-window", type=float, default=DEFAULT_PROFILE_WINDOW,
+                        help="Seconds a profiling window stays open once SIGUSR1 or a control message opens it")
+    parser.add_argument("--codecs", type=lambda spec: [name.strip() for name in spec.split(",")],
+                        default=None, help="Comma separated codecs this server accepts (default: all)")
+    parser.add_argument("--preload", action="store_true",
+                        help="Import the enabled codecs at startup instead of on first use")
+    parser.add_argument("--memory-budget", type=parse_size, default=None,
+                        help="Memory the server may use for request buffers, codecs and the result cache, "
+                             "e.g. 192M; codec parameters are lowered or requests refused to stay within it")
+    parser.add_argument("--scheduler-slots", type=int, default=os.cpu_count(),
+                        help="Requests running codecs at once in async mode; the rest queue by class")
+    parser.add_argument("--bulk-slots", type=int, default=None,
+                        help="Slots bulk requests may hold at once (default: all but one)")
+    parser.add_argument("--class-weights", type=parse_weights, default=DEFAULT_WEIGHTS,
+                        help="Scheduling weights, e.g. command=16,normal=4,bulk=1")
+    parser.add_argument("--command-size", type=parse_size, default=COMMAND_SIZE,
+                        help="Requests without a priority up to this size are scheduled as telecommands")
+    parser.add_argument("--bulk-size", type=parse_size, default=BULK_SIZE,
+                        help="Requests without a priority from this size on are scheduled as bulk")
+    parser.add_argument("--block-codec", default="zstd",
+                        help="Codec the blocks of seekable containers (the blocks method) are compressed with")
+    parser.add_argument("--codec-threads", type=int, default=None,
+                        help="Worker threads of the zstd_mt and lzma_mt codecs (default: one per core)")
+    parser.add_argument("--multithread-threshold", type=parse_size, default=None,
+                        help="Payload size from which zstd and lzma compress with every codec thread, e.g. 8M "
+                             f"(0 never; default {MULTITHREAD_THRESHOLD // (1 << 20)}M, never with --memory-budget)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    start_echo_server()
+    args = parse_args()
+    if args.codecs:
+        set_allowed_codecs(args.codecs)
+    threshold = args.multithread_threshold
+    if threshold is None:
+        # Thread counts are not part of the memory estimates of the plain codecs
+        threshold = MULTITHREAD_THRESHOLD if args.memory_budget is None else 0
+    configure_multithreading(args.codec_threads, threshold or None)
+    if "blocks" in available_codecs():
+        configure_block_codec(args.block_codec)
+    if args.preload:
+        for name in available_codecs():
+            get_codec(name)
+    print_codec_report()
+    dictionary_store = DictionaryStore(args.dictionary_dir)
+    codec_executor = CodecExecutor(process_payload, workers=args.workers,
+                                   inline_threshold=args.inline_threshold, profiler=profiler)
+    cache_bytes = args.cache_bytes
+    if cache_bytes is None:
+        cache_bytes = DEFAULT_CACHE_BYTES if args.memory_budget is None else args.memory_budget // 4
+    if args.memory_budget is not None:
+        # The memory tier of the cache comes out of the budget first, then what is held between
+        # requests: idle receive buffers and the codec contexts threads keep cached
+        retained = args.memory_budget // RETAINED_SHARE
+        buffer_pool.max_retained_bytes = min(buffer_pool.max_retained_bytes, retained)
+        configure_context_cache(retained)
+        bound_decoders()
+        memory_budget = MemoryBudget(max(0, args.memory_budget - cache_bytes - buffer_pool.max_retained_bytes
+                                         - retained))
+        print(f"Memory budget: {memory_budget.total // 1024} KiB for requests, {cache_bytes // 1024} KiB for the cache, "
+              f"{(buffer_pool.max_retained_bytes + retained) // 1024} KiB for idle buffers and codec contexts")
+    result_cache = ResultCache(cache_bytes, args.cache_dir, args.cache_disk_bytes)
+    candidates = [(method, level) for method, level in args.candidates if method in available_codecs()]
+    candidate_runner = CandidateRunner(candidates, args.deadline, args.candidate_threads,
+                                       args.workers or None)
+    scheduler = WeightedFairScheduler(args.scheduler_slots, args.class_weights, args.bulk_slots,
+                                      args.command_size, args.bulk_size)
+    scheduler.on_wait = observe_wait
+    if args.metrics_port:
+        start_metrics_server(metrics, args.metrics_host, args.metrics_port)
+    profiler.configure(args.profile_dir, args.profile_window)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profiler.toggle)
+    if args.mode == "async":
+        asyncio.run(start_async_server(args.host, args.port, args.max_concurrency,
+                                       args.read_timeout, args.write_timeout,
+                                       args.session_window, args.transport, args.socket_path))
+    else:
+        start_echo_server(args.host, args.port, args.transport, args.socket_path, args.read_timeout)
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from protocol import PRIORITY_AUTO, PRIORITY_COMMAND, PRIORITY_NORMAL, PRIORITY_BULK
+
+# Priority-aware scheduling of codec work in the async server.
+#
+# Requests fall into three classes, by the priority in their header or, when
+# they carry none, by payload size. Codec work runs in a fixed number of
+# slots; when one frees up it goes to the class with the lowest virtual
+# time, which advances by 1 / weight per dispatch (stride scheduling), so
+# every class gets its weighted share and none starves. Bulk work may hold
+# at most bulk_slots slots at once, leaving the rest for telecommands.
+
+CLASSES = ("command", "normal", "bulk")
+PRIORITY_CLASSES = {PRIORITY_COMMAND: "command", PRIORITY_NORMAL: "normal", PRIORITY_BULK: "bulk"}
+DEFAULT_WEIGHTS = {"command": 16, "normal": 4, "bulk": 1}
+# Payloads up to this size count as telecommands, from BULK_SIZE on as bulk
+COMMAND_SIZE = 4 * 1024
+BULK_SIZE = 1024 * 1024
+
+def request_class(priority: int, payload_size: int, command_size=COMMAND_SIZE, bulk_size=BULK_SIZE) -> str:
+    """Scheduling class of a request from its header priority, falling back to its size."""
+    if priority != PRIORITY_AUTO:
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown request priority: {priority}")
+        return PRIORITY_CLASSES[priority]
+    if payload_size <= command_size:
+        return "command"
+    return "bulk" if payload_size >= bulk_size else "normal"
+
+class WeightedFairScheduler:
+    def __init__(self, slots=None, weights=None, bulk_slots=None, command_size=COMMAND_SIZE, bulk_size=BULK_SIZE):
+        self.slots = slots or os.cpu_count() or 1
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        # At least one slot always stays free of bulk work when there is more than one
+        self.bulk_slots = bulk_slots or max(1, self.slots - 1)
+        self.command_size = command_size
+        self.bulk_size = bulk_size
+        self.queues = {name: deque() for name in CLASSES}
+        self.running = {name: 0 for name in CLASSES}
+        self.dispatched = {name: 0 for name in CLASSES}
+        self.virtual_time = {name: 0.0 for name in CLASSES}
+        self.clock = 0.0
+        # Called with (class, seconds waited) for every dispatch, e.g. to record metrics
+        self.on_wait = None
+
+    def classify(self, priority: int, payload_size: int) -> str:
+        return request_class(priority, payload_size, self.command_size, self.bulk_size)
+
+    def _eligible(self, name: str) -> bool:
+        return name != "bulk" or self.running["bulk"] < self.bulk_slots
+
+    def _start(self, name: str, queued_at: float) -> None:
+        self.running[name] += 1
+        self.dispatched[name] += 1
+        self.clock = self.virtual_time[name]
+        self.virtual_time[name] += 1 / self.weights[name]
+        if self.on_wait is not None:
+            self.on_wait(name, time.perf_counter() - queued_at)
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting requests, lowest virtual time first."""
+        while sum(self.running.values()) < self.slots:
+            ready = [name for name in CLASSES if self.queues[name] and self._eligible(name)]
+            if not ready:
+                return
+            name = min(ready, key=self.virtual_time.get)
+            future, queued_at = self.queues[name].popleft()
+            if future.cancelled():
+                continue
+            self._start(name, queued_at)
+            future.set_result(None)
+
+    async def acquire(self, name: str) -> None:
+        queued_at = time.perf_counter()
+        if not self.queues[name]:
+            # A class coming back from idle does not get to spend the time it was away
+            self.virtual_time[name] = max(self.virtual_time[name], self.clock)
+            if sum(self.running.values()) < self.slots and self._eligible(name) \
+                    and not any(self.queues.values()):
+                self._start(name, queued_at)
+                return
+        future = asyncio.get_running_loop().create_future()
+        self.queues[name].append((future, queued_at))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(name)  # Granted just as the waiter was cancelled
+            raise
+
+    def release(self, name: str) -> None:
+        self.running[name] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        """Hold one codec slot for the duration of the block."""
+        await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def counters(self) -> dict:
+        return {name: {"queued": len(self.queues[name]), "running": self.running[name],
+                       "dispatched": self.dispatched[name]} for name in CLASSES}
@@ -0,0 +1,93 @@
+import io
+import os
+import struct
+import pytest
+from block_container import BLOCK_HEADER_FORMAT, CONTAINER_HEADER_SIZE, FOOTER_SIZE, INDEX_ENTRY_SIZE, \
+                            BlockReader, BlockStreamCompressor, BlockStreamDecompressor, compress_blocks, \
+                            decompress_blocks
+from codec_registry import DecompressionLimitExceeded
+
+BLOCK_SIZE = 64 * 1024
+
+def sample_payload(size: int) -> bytes:
+    # Half random, half zeros, so blocks neither vanish nor stay incompressible
+    return b"".join(os.urandom(512) + bytes(512) for _ in range(size // 1024))
+
+def stream_decode(container: bytes, chunk_size=10_000) -> bytes:
+    decompressor = BlockStreamDecompressor()
+    output = [decompressor.decompress(container[offset:offset + chunk_size])
+              for offset in range(0, len(container), chunk_size)]
+    return b"".join(output) + decompressor.flush()
+
+@pytest.mark.parametrize("method", ["zstd", "deflate", "lzma", "lz4"])
+def test_container_round_trip(method):
+    payload = sample_payload(5 * BLOCK_SIZE + 1000)
+    container = compress_blocks(payload, method, block_size=BLOCK_SIZE)
+    assert decompress_blocks(container) == payload
+    assert stream_decode(container) == payload
+
+def test_streamed_container_reads_like_a_whole_one():
+    payload = sample_payload(3 * BLOCK_SIZE + 1000)
+    compressor = BlockStreamCompressor(block_size=BLOCK_SIZE)
+    container = b"".join(compressor.compress(payload[offset:offset + 5000])
+                         for offset in range(0, len(payload), 5000)) + compressor.flush()
+    assert container == compress_blocks(payload, block_size=BLOCK_SIZE)
+    assert decompress_blocks(container) == payload
+
+def test_reader_reads_ranges_from_a_file():
+    payload = sample_payload(4 * BLOCK_SIZE)
+    reader = BlockReader(io.BytesIO(compress_blocks(payload, block_size=BLOCK_SIZE)))
+    assert len(reader) == len(payload)
+    assert len(reader.entries) == 4
+    assert reader.read(BLOCK_SIZE - 10, 20) == payload[BLOCK_SIZE - 10:BLOCK_SIZE + 10]
+    assert reader.read(len(payload) - 5) == payload[-5:]
+    assert reader.read(len(payload)) == b""
+
+def test_empty_container_round_trip():
+    container = compress_blocks(b"")
+    assert decompress_blocks(container) == b""
+    assert stream_decode(container) == b""
+
+def test_reader_rejects_other_data():
+    with pytest.raises(ValueError, match="Not a block container"):
+        BlockReader(b"\x28\xb5\x2f\xfd" + bytes(100))
+    with pytest.raises(ValueError, match="Not a block container"):
+        BlockReader(b"BLKS")
+    with pytest.raises(ValueError, match="Not a block container"):
+        stream_decode(b"\x28\xb5\x2f\xfd" + bytes(100))
+
+def test_truncated_container_is_refused():
+    container = compress_blocks(sample_payload(3 * BLOCK_SIZE), block_size=BLOCK_SIZE)
+    with pytest.raises(ValueError, match="truncated"):
+        BlockReader(container[:-1])
+    # Cut inside the blocks and inside the index
+    for size in (len(container) // 2, len(container) - FOOTER_SIZE - INDEX_ENTRY_SIZE):
+        with pytest.raises(ValueError, match="Truncated block container"):
+            stream_decode(container[:size])
+
+def test_corrupt_block_is_refused():
+    container = bytearray(compress_blocks(sample_payload(3 * BLOCK_SIZE), block_size=BLOCK_SIZE))
+    reader = BlockReader(bytes(container))
+    container[reader.entries[1].offset + 10] ^= 0xff
+    reader = BlockReader(bytes(container))
+    assert reader.block(0)
+    with pytest.raises(ValueError, match="is corrupt"):
+        reader.block(1)
+    with pytest.raises(ValueError, match="is corrupt"):
+        stream_decode(bytes(container))
+
+def test_corrupt_index_is_refused():
+    container = bytearray(compress_blocks(sample_payload(3 * BLOCK_SIZE), block_size=BLOCK_SIZE))
+    # The compressed CRC of the last index entry
+    container[-FOOTER_SIZE - 5] ^= 0xff
+    with pytest.raises(ValueError, match="index is corrupt"):
+        BlockReader(bytes(container))
+    with pytest.raises(ValueError, match="does not match its checksum"):
+        stream_decode(bytes(container))
+
+def test_block_larger_than_its_header_states_is_refused():
+    container = bytearray(compress_blocks(bytes(BLOCK_SIZE), block_size=BLOCK_SIZE))
+    codec_id, compressed_size, _ = struct.unpack_from(BLOCK_HEADER_FORMAT, container, CONTAINER_HEADER_SIZE)
+    struct.pack_into(BLOCK_HEADER_FORMAT, container, CONTAINER_HEADER_SIZE, codec_id, compressed_size, 1000)
+    with pytest.raises(DecompressionLimitExceeded):
+        stream_decode(bytes(container))
@@ -0,0 +1,17 @@
+import lzma
+import os
+import pytest
+from candidates import CandidateRunner
+
+def test_race_without_a_free_worker_compresses_inline():
+    payload = os.urandom(2 * 1024 * 1024)
+    runner = CandidateRunner([("lzma", 9)], deadline=0.001, thread_workers=1, process_workers=1)
+    try:
+        # The candidate misses the deadline but keeps the only thread busy
+        with pytest.raises(RuntimeError, match="No compression candidate finished"):
+            runner.run(payload)
+        method, level, compressed = runner.run(payload)
+        assert (method, level) == ("lzma", 9)
+        assert lzma.decompress(compressed) == payload
+    finally:
+        runner.shutdown()
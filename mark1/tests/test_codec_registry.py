@@ -0,0 +1,84 @@
+import lzma
+import os
+import pytest
+import zlib
+import zstandard
+from codec_registry import MULTITHREAD_THRESHOLD, configure_multithreading, get_codec
+from parallel_deflate import adler32_combine
+
+def sample_payload(size: int) -> bytes:
+    """Compressible but not trivially so: random words of a small vocabulary."""
+    words = [os.urandom(8).hex().encode() for _ in range(512)]
+    indices = os.urandom(size // 8)
+    return b" ".join(words[index] for index in indices)[:size]
+
+@pytest.fixture
+def four_threads():
+    configure_multithreading(threads=4)
+    yield
+    configure_multithreading()
+
+def test_lzma_mt_output_decodes_with_stock_lzma(four_threads):
+    payload = sample_payload(5 * 1024 * 1024)
+    compressed = get_codec("lzma_mt").compress(payload, level=1)
+    assert lzma.decompress(compressed) == payload
+    assert get_codec("lzma").decompress(compressed) == payload
+
+def test_lzma_mt_stream_decodes_with_stock_lzma(four_threads):
+    payload = sample_payload(3 * 1024 * 1024)
+    compress_chunk, finish = get_codec("lzma_mt").stream_compressor(level=1)
+    compressed = b"".join(compress_chunk(payload[offset:offset + 100_000])
+                          for offset in range(0, len(payload), 100_000)) + finish()
+    assert lzma.decompress(compressed) == payload
+
+def test_lzma_mt_writes_an_empty_payload():
+    assert lzma.decompress(get_codec("lzma_mt").compress(b"")) == b""
+
+def test_zstd_mt_output_decodes_with_stock_zstandard(four_threads):
+    payload = sample_payload(4 * 1024 * 1024)
+    compressed = get_codec("zstd_mt").compress(payload, level=3)
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compressed) == payload
+    assert get_codec("zstd").decompress(compressed) == payload
+
+def test_zstd_mt_stream_decodes_with_stock_zstandard(four_threads):
+    payload = sample_payload(2 * 1024 * 1024)
+    compress_chunk, finish = get_codec("zstd_mt").stream_compressor()
+    compressed = b"".join(compress_chunk(payload[offset:offset + 100_000])
+                          for offset in range(0, len(payload), 100_000)) + finish()
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compressed) == payload
+
+@pytest.mark.parametrize("level", [None, 1, 9])
+def test_deflate_mt_output_decodes_with_stock_zlib(four_threads, level):
+    payload = sample_payload(1024 * 1024 + 123)
+    compressed = get_codec("deflate_mt").compress(payload, level=level)
+    assert zlib.decompress(compressed) == payload
+    assert get_codec("deflate").decompress(compressed) == payload
+
+def test_deflate_mt_stream_decodes_with_stock_zlib(four_threads):
+    payload = sample_payload(1024 * 1024)
+    compress_chunk, finish = get_codec("deflate_mt").stream_compressor()
+    # Chunks that end exactly on the 128 KiB block boundaries as well as between them
+    compressed = b"".join(compress_chunk(payload[offset:offset + 64 * 1024])
+                          for offset in range(0, len(payload), 64 * 1024)) + finish()
+    assert zlib.decompress(compressed) == payload
+
+def test_deflate_mt_writes_an_empty_payload():
+    assert zlib.decompress(get_codec("deflate_mt").compress(b"")) == b""
+
+def test_adler32_combine_matches_zlib():
+    first, second = os.urandom(100_000), os.urandom(70_000)
+    assert adler32_combine(zlib.adler32(first), zlib.adler32(second), len(second)) == zlib.adler32(first + second)
+    assert adler32_combine(zlib.adler32(first), 1, 0) == zlib.adler32(first)
+
+def test_plain_codecs_go_multithreaded_above_the_threshold(four_threads):
+    assert get_codec("lzma").compress_threads(MULTITHREAD_THRESHOLD - 1) == 0
+    assert get_codec("lzma").compress_threads(MULTITHREAD_THRESHOLD) == 4
+    assert get_codec("lzma_mt").compress_threads(1) == 4
+
+def test_truncated_zstd_payload_is_refused():
+    payload = sample_payload(256 * 1024)
+    compressed = get_codec("zstd").compress(payload)
+    with pytest.raises(ValueError, match="truncated"):
+        get_codec("zstd").decompress(compressed[:len(compressed) // 2])
+    with pytest.raises(ValueError, match="truncated"):
+        get_codec("zstd").decompress_bounded(compressed[:len(compressed) // 2], len(payload))
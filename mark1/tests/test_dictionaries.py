@@ -0,0 +1,56 @@
+import os
+import struct
+import pytest
+from codec_registry import get_codec
+from dictionaries import DictionaryStore, split_frames, train_dictionary
+import satellite
+
+def telemetry_capture(frames: int) -> bytes:
+    """256-byte frames sharing a layout and most of their contents, like housekeeping telemetry."""
+    return b"".join(struct.pack("!4sIHH", b"TLM1", number, number % 7, 0x1acf) + b"MODE=NOMINAL;BATT=OK;"
+                    + os.urandom(8) + bytes(range(200)) + os.urandom(11) for number in range(frames))
+
+@pytest.fixture(scope="module")
+def dictionary():
+    return train_dictionary(split_frames(telemetry_capture(2000), 256), 4096)
+
+def test_split_frames():
+    assert split_frames(b"abcdefg", 3) == [b"abc", b"def", b"g"]
+
+def test_store_hands_out_increasing_ids(tmp_path):
+    store = DictionaryStore(str(tmp_path / "dictionaries"))
+    assert store.ids() == []
+    assert store.add(b"first") == 1
+    assert store.add(b"second") == 2
+    # A fresh store, as in another process, reads the same files
+    other = DictionaryStore(store.directory)
+    assert other.ids() == [1, 2]
+    assert other.get(1) == b"first"
+    assert other.get(2) is other.get(2)
+    with pytest.raises(ValueError, match="Unknown dictionary id: 3"):
+        other.get(3)
+
+@pytest.mark.parametrize("method", ["zstd", "deflate"])
+def test_dictionary_round_trip(method, dictionary):
+    codec = get_codec(method)
+    frame = telemetry_capture(1)
+    compressed = codec.compress(frame, dictionary=dictionary)
+    assert len(compressed) < len(codec.compress(frame))
+    assert codec.decompress(compressed, dictionary=dictionary) == frame
+
+def test_codecs_without_dictionaries_refuse_one(dictionary):
+    with pytest.raises(ValueError, match="does not support dictionaries"):
+        get_codec("lzma").check_dictionary(dictionary)
+
+def test_satellite_transcodes_with_stored_dictionaries(tmp_path, monkeypatch, dictionary):
+    store = DictionaryStore(str(tmp_path))
+    monkeypatch.setattr(satellite, "dictionary_store", store)
+    source_id, target_id = store.add(dictionary), store.add(dictionary[::-1])
+    frame = telemetry_capture(1)
+    compressed = get_codec("zstd").compress(frame, dictionary=dictionary)
+    stats, recompressed = satellite.process_payload(compressed, "zstd", dict_id=source_id,
+                                                    target_method="deflate", target_dict_id=target_id)
+    assert stats.decompressed_size == len(frame)
+    assert get_codec("deflate").decompress(recompressed, dictionary=store.get(target_id)) == frame
+    with pytest.raises(ValueError, match="Unknown dictionary id"):
+        satellite.process_payload(compressed, "zstd", dict_id=target_id + 1)
@@ -0,0 +1,59 @@
+import socket
+import threading
+import pytest
+import transport
+from ground_client import GroundStationClient, Endpoint
+from protocol import FLAG_SHARED, HEADER_PREFIX_SIZE, SHARED_DESCRIPTOR_SIZE, STATUS_OK, StageTimings, \
+                     TranscodeStats, header_size, pack_session_response, pack_stats, recv_exactly, unpack_header
+
+PAYLOAD = bytes(300 * 1024)
+
+def serve(server_socket, headers, answers):
+    """Satellite stand-in: reads one shared request per connection, answering it or hanging up."""
+    for answer in answers:
+        connection, _ = server_socket.accept()
+        with connection:
+            prefix = recv_exactly(connection, HEADER_PREFIX_SIZE)
+            header = unpack_header(prefix + recv_exactly(connection, header_size(prefix) - HEADER_PREFIX_SIZE))
+            headers.append(header)
+            if header.flags & FLAG_SHARED:
+                recv_exactly(connection, SHARED_DESCRIPTOR_SIZE)
+            else:
+                recv_exactly(connection, header.payload_size)
+            if not answer:
+                continue
+            stats = pack_stats(TranscodeStats(header.payload_size, 0, 0, 1.0, "zstd", "zstd", 0.0, 0.0), 6,
+                               StageTimings(0.0, 0.0))
+            connection.sendall(pack_session_response(header.request_id, STATUS_OK, len(stats)) + stats)
+            connection.recv(1)  # Until the client hangs up
+
+@pytest.fixture
+def small_ring(monkeypatch):
+    # Room for one payload, so a region that is never given back would push the next one to the socket
+    ring = transport.SharedRing(size=len(PAYLOAD) * 3 // 2)
+    monkeypatch.setattr(transport, "_ring", ring)
+    yield ring
+    ring.close()
+
+def test_dropped_connection_gives_its_region_back(tmp_path, small_ring):
+    path = str(tmp_path / "satellite.sock")
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(path)
+    server_socket.listen(1)
+    headers = []
+    server = threading.Thread(target=serve, args=(server_socket, headers, [False, True]), daemon=True)
+    server.start()
+    client = GroundStationClient([Endpoint("shm", socket_path=path)], timeout=5)
+    try:
+        with pytest.raises(ConnectionError):
+            with client.transcode(PAYLOAD, "zstd"):
+                pass
+        assert not small_ring.regions
+        with client.transcode(PAYLOAD, "zstd") as response:
+            assert response.stats.original_size == len(PAYLOAD)
+    finally:
+        client.close()
+        server.join(5)
+        server_socket.close()
+    assert [bool(header.flags & FLAG_SHARED) for header in headers] == [True, True]
+    assert not small_ring.regions
@@ -0,0 +1,34 @@
+import os
+from contextlib import closing
+import pytest
+from groundstation import UPLOAD_CHUNK_SIZE, mapped_file, upload_chunks
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "payload.bin"
+    path.write_bytes(os.urandom(3 * UPLOAD_CHUNK_SIZE + 123))
+    return str(path)
+
+def test_upload_chunks_cover_the_file(local_file):
+    with mapped_file(local_file) as view, closing(upload_chunks(view)) as chunks:
+        assert b"".join(bytes(chunk) for chunk in chunks) == open(local_file, "rb").read()
+
+def test_failed_upload_raises_its_own_error(local_file):
+    # Like stream_transcode failing part way, with the current slice still referenced by the traceback
+    held = []
+    with pytest.raises(RuntimeError, match="not enabled"):
+        with mapped_file(local_file) as view, closing(upload_chunks(view)) as chunks:
+            for chunk in chunks:
+                held.append(chunk)
+                if len(held) == 2:
+                    raise RuntimeError("Compression method zstd is not enabled on this server")
+    for chunk in held:
+        with pytest.raises(ValueError, match="released"):
+            bytes(chunk)
+
+def test_failure_with_an_unreleased_view_keeps_the_error(local_file):
+    with pytest.raises(RuntimeError, match="satellite went away"):
+        with mapped_file(local_file) as view:
+            leaked = view[:UPLOAD_CHUNK_SIZE]
+            raise RuntimeError("satellite went away")
+    leaked.release()
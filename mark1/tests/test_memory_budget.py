@@ -0,0 +1,107 @@
+import lzma
+import zlib
+import pytest
+import zstandard
+from codec_registry import DecompressionLimitExceeded, get_codec
+from memory_budget import MemoryBudget, parse_size
+import satellite
+
+MiB = 1024 * 1024
+
+def test_parse_size():
+    assert parse_size("1048576") == MiB
+    assert parse_size("64KiB") == 64 * 1024
+    assert parse_size(" 256m ") == 256 * MiB
+    assert parse_size("2GB") == 2 << 30
+    with pytest.raises(ValueError, match="Invalid size"):
+        parse_size("12 bytes")
+
+def test_unlimited_budget_leaves_requests_alone():
+    budget = MemoryBudget()
+    options = {"level": 22}
+    assert budget.admit("zstd", 10 * MiB, options) == (options, 0)
+    assert budget.counters() == {"total": 0, "reserved": 0, "downgraded": 0, "refused": 0}
+
+def test_admitted_request_is_reserved_until_released():
+    zstd = get_codec("zstd")
+    budget = MemoryBudget(256 * MiB)
+    options, reserved = budget.admit("zstd", MiB, {"level": 3})
+    assert options == {"level": 3}
+    assert reserved == MiB + zstd.decompress_memory() + zstd.compress_memory(3)
+    assert budget.counters()["reserved"] == reserved
+    budget.release(reserved)
+    assert budget.counters()["reserved"] == 0
+
+def test_target_that_does_not_fit_is_lowered():
+    zstd = get_codec("zstd")
+    fixed = MiB + zstd.decompress_memory()
+    free = zstd.compress_memory(3)
+    budget = MemoryBudget(fixed + free)
+    options, reserved = budget.admit("zstd", MiB, {"level": 19, "window_log": None, "dict_id": None})
+    # Spelled out as a target, so the payload is still decoded with its own parameters
+    assert options["target_method"] == "zstd" and options["level"] == 19
+    fitted = options["target_level"], options["target_window_log"]
+    assert fitted != (19, None)
+    assert zstd.compress_memory(*fitted) <= free
+    assert reserved == fixed + zstd.compress_memory(*fitted)
+    assert budget.counters()["downgraded"] == 1
+
+def test_request_whose_buffers_do_not_fit_is_refused():
+    budget = MemoryBudget(8 * MiB)
+    with pytest.raises(ValueError, match="of the memory budget is left"):
+        budget.admit("zstd", 16 * MiB, {})
+    assert budget.counters() == {"total": 8 * MiB, "reserved": 0, "downgraded": 0, "refused": 1}
+
+def test_candidates_that_do_not_fit_are_dropped():
+    zstd, lzma_codec = get_codec("zstd"), get_codec("lzma")
+    fixed = MiB + zstd.decompress_memory()
+    free = zstd.compress_memory(3) + MiB
+    assert lzma_codec.compress_memory(0) > free
+    budget = MemoryBudget(fixed + free)
+    options, reserved = budget.admit("zstd", MiB, {"smallest": True}, [("lzma", 9), ("zstd", 3)])
+    assert options["candidates"] == [("zstd", 3)]
+    assert reserved == fixed + zstd.compress_memory(3)
+    with pytest.raises(ValueError, match="No compression candidate fits"):
+        MemoryBudget(fixed + MiB).admit("zstd", MiB, {"smallest": True}, [("lzma", 9)])
+
+def test_request_is_admitted_with_a_decompressed_allowance(monkeypatch):
+    monkeypatch.setattr(satellite, "memory_budget", MemoryBudget(256 * MiB))
+    options, reserved = satellite.admit_request(3 * MiB, "zstd", {})
+    assert options["max_output"] == satellite.DECOMPRESSED_ALLOWANCE * 3 * MiB
+    options, _ = satellite.admit_request(1000, "zstd", {})
+    assert options["max_output"] == satellite.MIN_DECOMPRESSED_ALLOWANCE
+    # Streamed requests are decompressed a chunk at a time
+    options, _ = satellite.admit_request(1000, "zstd", {}, streamed=True)
+    assert "max_output" not in options
+
+@pytest.mark.parametrize("method, compress", [
+    ("zstd", lambda data: zstandard.ZstdCompressor().compress(data)),
+    ("lzma", lzma.compress),
+    ("deflate", zlib.compress),
+    ("bzip2", lambda data: get_codec("bzip2").compress(data)),
+    ("blocks", lambda data: get_codec("blocks").compress(data)),
+])
+def test_decompress_bounded_stops_at_the_limit(method, compress):
+    codec = get_codec(method)
+    payload = bytes(16 * MiB)
+    compressed = compress(payload)
+    assert codec.decompress_bounded(compressed, len(payload)) == payload
+    with pytest.raises(DecompressionLimitExceeded):
+        codec.decompress_bounded(compressed, MiB)
+
+def test_streamed_zstd_frame_is_stopped_without_a_content_size():
+    compressor = zstandard.ZstdCompressor().compressobj()
+    compressed = compressor.compress(bytes(16 * MiB)) + compressor.flush()
+    assert zstandard.frame_content_size(compressed) == -1
+    with pytest.raises(DecompressionLimitExceeded):
+        get_codec("zstd").decompress_bounded(compressed, MiB)
+
+def test_payload_over_its_allowance_is_transcoded_piece_by_piece():
+    payload = bytes(8 * MiB)
+    compressed = zstandard.ZstdCompressor().compress(payload)
+    stats, recompressed = satellite.process_payload(compressed, "zstd", target_method="lzma", max_output=MiB)
+    assert stats.decompressed_size == len(payload)
+    assert lzma.decompress(recompressed) == payload
+    # Racing candidates needs the payload whole
+    with pytest.raises(RuntimeError, match="Decompression failed"):
+        satellite.process_payload(compressed, "zstd", smallest=True, max_output=MiB)
@@ -0,0 +1,70 @@
+import urllib.error
+import urllib.request
+import pytest
+from metrics import Metrics, RequestTimer, Summary, start_metrics_server
+from protocol import TranscodeStats
+
+def test_summary_quantiles_cover_the_window():
+    summary = Summary(window=100)
+    assert summary.quantiles() == [(0.5, 0.0), (0.95, 0.0), (0.99, 0.0)]
+    for value in range(200):
+        summary.observe(float(value))
+    # Quantiles from the last 100 samples, count and sum over all of them
+    assert summary.quantiles() == [(0.5, 150.0), (0.95, 195.0), (0.99, 199.0)]
+    assert (summary.count, summary.total) == (200, sum(range(200)))
+
+def test_request_timer_charges_consecutive_stages():
+    timer = RequestTimer()
+    timer.lap("receive")
+    timer.lap()
+    timer.lap("receive")
+    assert list(timer.stages) == ["receive"]
+    assert timer.stages["receive"] >= 0
+
+def test_request_stages_are_charged_to_their_codecs():
+    metrics = Metrics()
+    timer = RequestTimer()
+    timer.stages = {"header": 0.001, "receive": 0.5, "send": 0.25}
+    stats = TranscodeStats(1000, 4000, 800, 80.0, "lz4", "zstd", 0.1, 2.0)
+    metrics.observe_request(stats, timer)
+    text = metrics.render()
+    assert 'satellite_stage_seconds_count{codec="lz4",stage="receive"} 1' in text
+    assert 'satellite_stage_seconds_sum{codec="zstd",stage="recompress"} 2' in text
+    assert 'satellite_stage_seconds_count{codec="lz4",stage="decompress"} 1' in text
+    # Codec throughput counts uncompressed bytes, I/O throughput the bytes on the wire
+    assert 'satellite_stage_bytes_per_second{codec="zstd",stage="recompress",quantile="0.5"} 2000' in text
+    assert 'satellite_stage_bytes_per_second{codec="lz4",stage="receive",quantile="0.5"} 2000' in text
+    assert 'satellite_stage_bytes_per_second{codec="lz4",stage="send",quantile="0.5"} 3200' in text
+
+def test_cache_hits_report_no_codec_stages():
+    metrics = Metrics()
+    timer = RequestTimer()
+    timer.stages = {"receive": 0.5}
+    metrics.observe_request(TranscodeStats(1000, 4000, 800, 80.0, "lz4", "zstd", 0.0, 0.0), timer)
+    assert 'stage="decompress"' not in metrics.render()
+    assert 'stage="recompress"' not in metrics.render()
+
+def test_other_summaries_and_collectors_are_rendered():
+    metrics = Metrics()
+    metrics.observe_summary("satellite_queue_wait_seconds", "Time waiting for a codec slot", {"class": "bulk"}, 0.5)
+    metrics.add_collector(lambda: [("satellite_cache_hits_total", "counter", "Result cache hits", [({}, 3)]),
+                                   ("satellite_queue_depth", "gauge", "Queued requests",
+                                    [({"class": "bulk"}, 2)])])
+    text = metrics.render()
+    assert "# TYPE satellite_queue_wait_seconds summary" in text
+    assert 'satellite_queue_wait_seconds_count{class="bulk"} 1' in text
+    assert "# TYPE satellite_cache_hits_total counter\nsatellite_cache_hits_total 3\n" in text
+    assert 'satellite_queue_depth{class="bulk"} 2' in text
+
+def test_metrics_endpoint_serves_the_rendered_text():
+    metrics = Metrics()
+    metrics.observe("zstd", "decompress", 0.25)
+    with start_metrics_server(metrics, port=0) as server:
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(f"{url}/metrics") as response:
+                assert response.read().decode('utf-8') == metrics.render()
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{url}/other")
+        finally:
+            server.shutdown()
@@ -0,0 +1,83 @@
+import struct
+import pytest
+from protocol import BufferPool, CODEC_IDS, FLAG_SMALLEST, FLAG_STREAM, HEADER_FORMATS, HEADER_PREAMBLE, \
+                     HEADER_PREFIX_SIZE, HEADER_VERSION, PRIORITY_AUTO, PRIORITY_BULK, TranscodeStats, \
+                     header_size, pack_header, pack_stats, unpack_extended_stats, unpack_header
+
+# Every header version's fields after the preamble and version byte, as clients of that version send them
+HEADER_FIELDS = {
+    1: (CODEC_IDS["zstd"], 19, 23, FLAG_STREAM, 7, 1000),
+    2: (CODEC_IDS["zstd"], 19, 23, FLAG_STREAM, 7, 1000, 42),
+    3: (CODEC_IDS["zstd"], 19, 23, FLAG_STREAM, 7, 1000, 42, CODEC_IDS["lzma"], 9, 24, 43),
+    4: (CODEC_IDS["zstd"], 19, 23, FLAG_SMALLEST, 7, 1000, 42, CODEC_IDS["lzma"], 9, 24, 43, 250),
+    5: (CODEC_IDS["zstd"], 19, 23, FLAG_SMALLEST, 7, 1000, 42, CODEC_IDS["lzma"], 9, 24, 43, 250),
+    6: (CODEC_IDS["zstd"], 19, 23, FLAG_SMALLEST, 7, 1000, 42, CODEC_IDS["lzma"], 9, 24, 43, 250, PRIORITY_BULK),
+}
+
+def test_buffer_pool_recycles_within_its_retention_limit():
+    pool = BufferPool(max_buffers_per_size=8, min_size=4096, max_pooled_size=64 * 1024,
+                      max_retained_bytes=96 * 1024)
+    buffers = [pool.acquire(40 * 1024) for _ in range(3)]
+    assert all(len(buffer) == 64 * 1024 for buffer in buffers)
+    for buffer in buffers:
+        pool.release(buffer)
+    # Only one 64 KiB buffer fits in the 96 KiB limit
+    assert pool.retained == 64 * 1024
+    assert pool.acquire(64 * 1024) is buffers[0]
+    assert pool.retained == 0
+
+def test_buffer_pool_does_not_keep_its_largest_sizes():
+    pool = BufferPool(max_pooled_size=64 * 1024)
+    buffer = pool.acquire(100 * 1024)
+    # Allocated exactly rather than rounded up to a size class
+    assert len(buffer) == 100 * 1024
+    pool.release(buffer)
+    assert pool.retained == 0
+    assert pool.acquire(100 * 1024) is not buffer
+
+@pytest.mark.parametrize("version", sorted(HEADER_FORMATS))
+def test_unpack_header_reads_every_version(version):
+    buffer = struct.pack(HEADER_FORMATS[version], HEADER_PREAMBLE, version, *HEADER_FIELDS[version])
+    assert header_size(buffer[:HEADER_PREFIX_SIZE]) == len(buffer)
+    header = unpack_header(buffer)
+    assert header.version == version
+    assert (header.compression_method, header.level, header.window_log) == ("zstd", 19, 23)
+    assert (header.request_id, header.payload_size) == (7, 1000)
+    # Fields a version does not carry fall back to the codec and satellite defaults
+    assert header.dict_id == (42 if version >= 2 else None)
+    expected_target = ("lzma", 9, 24, 43) if version >= 3 else (None, None, None, None)
+    assert (header.target_method, header.target_level, header.target_window_log,
+            header.target_dict_id) == expected_target
+    assert header.deadline_ms == (250 if version >= 4 else None)
+    assert header.priority == (PRIORITY_BULK if version >= 6 else PRIORITY_AUTO)
+
+def test_pack_header_round_trips_codec_defaults():
+    buffer = pack_header("lzma", 123, request_id=5)
+    assert buffer[4] == HEADER_VERSION
+    assert header_size(buffer[:HEADER_PREFIX_SIZE]) == len(buffer)
+    header = unpack_header(buffer)
+    assert (header.compression_method, header.payload_size, header.request_id) == ("lzma", 123, 5)
+    assert header.level is None and header.window_log is None and header.dict_id is None
+    assert header.target_method is None and header.target_level is None
+    assert header.deadline_ms is None and header.priority == PRIORITY_AUTO
+
+def test_header_size_rejects_bad_prefixes():
+    with pytest.raises(ValueError, match="preamble"):
+        header_size(b"\x00\x00\x00\x00" + bytes([HEADER_VERSION]))
+    with pytest.raises(ValueError, match="Unsupported header version"):
+        header_size(HEADER_PREAMBLE + bytes([HEADER_VERSION + 1]))
+
+def test_unpack_header_rejects_unknown_codec_ids():
+    fields = (99,) + HEADER_FIELDS[1][1:]
+    with pytest.raises(ValueError, match="Unknown codec id"):
+        unpack_header(struct.pack(HEADER_FORMATS[1], HEADER_PREAMBLE, 1, *fields))
+
+@pytest.mark.parametrize("version", [3, 4, 5, 6])
+def test_extended_stats_round_trip(version):
+    stats = TranscodeStats(100, 400, 90, 1.25, "zstd", "lzma", 0.5, 1.5, 9, 24)
+    unpacked = unpack_extended_stats(pack_stats(stats, version), version)
+    assert unpacked[:6] == stats[:6]
+    assert unpacked.decompress_time == pytest.approx(0.5)
+    assert unpacked.recompress_time == pytest.approx(1.5)
+    # Target level and window only travel from version 5 on
+    assert (unpacked.target_level, unpacked.target_window_log) == ((9, 24) if version >= 5 else (None, None))
@@ -0,0 +1,66 @@
+import os
+from result_cache import ENTRY_OVERHEAD, ResultCache, cache_key
+
+def test_cache_key_covers_payload_codec_and_options():
+    key = cache_key(b"payload", "zstd", {"level": 3, "dict_id": None})
+    # Option order does not matter
+    assert key == cache_key(b"payload", "zstd", {"dict_id": None, "level": 3})
+    assert key != cache_key(b"payload!", "zstd", {"level": 3, "dict_id": None})
+    assert key != cache_key(b"payload", "lzma", {"level": 3, "dict_id": None})
+    assert key != cache_key(b"payload", "zstd", {"level": 4, "dict_id": None})
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=3 * (1000 + ENTRY_OVERHEAD))
+    for key in "abc":
+        cache.put(key, key.upper(), bytes(1000))
+    assert cache.get("a") == ("A", bytes(1000))
+    cache.put("d", "D", bytes(1000))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None and cache.get("d") is not None
+    assert cache.counters() == {"hits": 4, "disk_hits": 0, "misses": 1, "entries": 3,
+                                "bytes": 3 * (1000 + ENTRY_OVERHEAD)}
+
+def test_memory_tier_skips_results_larger_than_itself():
+    cache = ResultCache(max_bytes=1000)
+    cache.put("small", None, bytes(100))
+    cache.put("large", None, bytes(1000))
+    assert cache.get("large") is None
+    assert cache.get("small") is not None
+
+def test_cache_without_either_tier_is_disabled(tmp_path):
+    assert not ResultCache(max_bytes=0).enabled
+    assert ResultCache(max_bytes=0, directory=str(tmp_path)).enabled
+
+def test_disk_tier_outlives_the_memory_tier(tmp_path):
+    ResultCache(directory=str(tmp_path)).put("key", {"ratio": 2.0}, b"result")
+    # A new cache, as after a restart, with no memory tier at all
+    cache = ResultCache(max_bytes=0, directory=str(tmp_path))
+    assert cache.get("key") == ({"ratio": 2.0}, b"result")
+    assert cache.get("other") is None
+    assert cache.counters()["disk_hits"] == 1
+    assert cache.counters()["misses"] == 1
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    ResultCache(directory=str(tmp_path)).put("key", None, b"result")
+    cache = ResultCache(directory=str(tmp_path))
+    cache.get("key")
+    os.remove(tmp_path / "key.result")
+    assert cache.get("key") == (None, b"result")
+    assert cache.counters()["disk_hits"] == 1
+
+def test_disk_tier_evicts_least_recently_used_files(tmp_path):
+    cache = ResultCache(max_bytes=0, directory=str(tmp_path), max_disk_bytes=25_000)
+    for number, key in enumerate("abc"):
+        cache.put(key, None, os.urandom(10_000))
+        # Explicit times, the file system clock may be too coarse to order the writes
+        os.utime(tmp_path / f"{key}.result", (number, number))
+    assert sorted(os.listdir(tmp_path)) == ["b.result", "c.result"]
+    assert cache.get("b") is not None
+    cache.put("d", None, os.urandom(10_000))
+    assert sorted(os.listdir(tmp_path)) == ["b.result", "d.result"]
+
+def test_unreadable_disk_entry_is_a_miss(tmp_path):
+    (tmp_path / "key.result").write_bytes(b"not a pickle")
+    cache = ResultCache(directory=str(tmp_path))
+    assert cache.get("key") is None
+    assert cache.counters()["misses"] == 1
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from protocol import PRIORITY_AUTO, PRIORITY_BULK, PRIORITY_COMMAND
+from scheduler import BULK_SIZE, COMMAND_SIZE, WeightedFairScheduler, request_class
+
+def test_request_class_from_priority_then_size():
+    assert request_class(PRIORITY_AUTO, COMMAND_SIZE) == "command"
+    assert request_class(PRIORITY_AUTO, COMMAND_SIZE + 1) == "normal"
+    assert request_class(PRIORITY_AUTO, BULK_SIZE) == "bulk"
+    # An explicit priority wins over the size
+    assert request_class(PRIORITY_BULK, 10) == "bulk"
+    assert request_class(PRIORITY_COMMAND, 10 * BULK_SIZE) == "command"
+    with pytest.raises(ValueError, match="Unknown request priority"):
+        request_class(99, 10)
+
+async def run_queued(scheduler, names):
+    """Queue one request per name behind a slot held by a normal request; return the dispatch order."""
+    order = []
+
+    async def request(name):
+        async with scheduler.slot(name):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    await scheduler.acquire("normal")
+    tasks = [asyncio.create_task(request(name)) for name in names]
+    await asyncio.sleep(0)
+    scheduler.release("normal")
+    await asyncio.gather(*tasks)
+    return order
+
+def test_commands_overtake_queued_bulk_work():
+    order = asyncio.run(run_queued(WeightedFairScheduler(slots=1), ["bulk"] * 5 + ["command"] * 5))
+    # Both classes start at the same virtual time, after which bulk waits its 1/16 share out
+    assert order == ["command", "bulk"] + ["command"] * 4 + ["bulk"] * 4
+
+def test_bulk_work_keeps_its_weighted_share():
+    scheduler = WeightedFairScheduler(slots=1)
+    order = asyncio.run(run_queued(scheduler, ["command"] * 40 + ["bulk"] * 3))
+    # One bulk dispatch per 16 commands rather than none until the commands run out
+    assert order.index("bulk") <= 17
+    assert order[-1] == "command"
+    assert scheduler.counters()["bulk"] == {"queued": 0, "running": 0, "dispatched": 3}
+    assert scheduler.counters()["command"]["dispatched"] == 40
+
+def test_bulk_work_leaves_a_slot_free():
+    async def scenario():
+        scheduler = WeightedFairScheduler(slots=2)
+        assert scheduler.bulk_slots == 1
+        await scheduler.acquire("bulk")
+        second_bulk = asyncio.create_task(scheduler.acquire("bulk"))
+        await asyncio.sleep(0)
+        assert not second_bulk.done()
+        # The free slot still goes to a command
+        await asyncio.wait_for(scheduler.acquire("command"), 1)
+        scheduler.release("command")
+        scheduler.release("bulk")
+        await asyncio.wait_for(second_bulk, 1)
+        assert scheduler.running == {"command": 0, "normal": 0, "bulk": 1}
+
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_does_not_keep_a_slot():
+    async def scenario():
+        scheduler = WeightedFairScheduler(slots=1)
+        await scheduler.acquire("normal")
+        waiter = asyncio.create_task(scheduler.acquire("command"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        scheduler.release("normal")
+        assert sum(scheduler.running.values()) == 0
+        await asyncio.wait_for(scheduler.acquire("bulk"), 1)
+
+    asyncio.run(scenario())
+
+def test_on_wait_reports_every_dispatch():
+    waits = []
+    scheduler = WeightedFairScheduler(slots=1)
+    scheduler.on_wait = lambda name, seconds: waits.append(name)
+    asyncio.run(run_queued(scheduler, ["bulk", "command"]))
+    assert waits == ["normal", "command", "bulk"]
@@ -0,0 +1,47 @@
+import os
+import pytest
+from codec_registry import get_codec
+import satellite
+
+def sample_payload(size: int) -> bytes:
+    return b"".join(os.urandom(64) + bytes(192) for _ in range(size // 256))
+
+PAIRS = [("lz4", "zstd"), ("zstd", "lzma"), ("deflate", "brotli"), ("bzip2", "deflate"), ("zstd", "blocks")]
+
+@pytest.mark.parametrize("source, target", PAIRS)
+def test_payload_is_recompressed_with_the_target_codec(source, target):
+    payload = sample_payload(300 * 1024)
+    compressed = get_codec(source).compress(payload)
+    stats, recompressed = satellite.process_payload(compressed, source, target_method=target, target_level=1)
+    assert get_codec(target).decompress(recompressed) == payload
+    assert (stats.source_method, stats.target_method, stats.target_level) == (source, target, 1)
+    assert (stats.original_size, stats.decompressed_size, stats.recompressed_size) == \
+           (len(compressed), len(payload), len(recompressed))
+
+def test_without_a_target_the_source_codec_is_kept():
+    payload = sample_payload(100 * 1024)
+    stats, recompressed = satellite.process_payload(get_codec("lzma").compress(payload), "lzma", level=1)
+    assert (stats.target_method, stats.target_level) == ("lzma", 1)
+    assert get_codec("lzma").decompress(recompressed) == payload
+
+@pytest.mark.parametrize("source, target", PAIRS)
+def test_streamed_payload_is_recompressed_with_the_target_codec(source, target):
+    payload = sample_payload(300 * 1024)
+    compressed = get_codec(source).compress(payload)
+    transcoder = satellite.open_transcoder(source, target_method=target)
+    output = [transcoder.feed(compressed[offset:offset + 7000]) for offset in range(0, len(compressed), 7000)]
+    recompressed = b"".join(output) + transcoder.finish()
+    assert get_codec(target).decompress(recompressed) == payload
+    stats = transcoder.stats()
+    assert (stats.source_method, stats.target_method) == (source, target)
+    assert (stats.original_size, stats.decompressed_size, stats.recompressed_size) == \
+           (len(compressed), len(payload), len(recompressed))
+
+def test_streamed_requests_cannot_race_candidates():
+    with pytest.raises(ValueError, match="not available for streamed requests"):
+        satellite.open_transcoder("zstd", smallest=True)
+
+def test_corrupt_payload_fails_the_transcode():
+    compressed = get_codec("zstd").compress(sample_payload(100 * 1024))
+    with pytest.raises(RuntimeError, match="Decompression failed"):
+        satellite.process_payload(compressed[:len(compressed) // 2] + bytes(100), "zstd", target_method="lzma")
@@ -0,0 +1,157 @@
+import atexit
+import os
+import socket
+import stat
+import threading
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+from protocol import SHARED_DESCRIPTOR_SIZE, pack_shared_descriptor, recv_exactly, unpack_shared_descriptor
+
+# Links between the ground station and the satellite.
+#
+#   tcp   the default, works across hosts
+#   unix  the same framing over a Unix domain socket, for both ends on one host
+#   shm   a Unix domain socket, plus payloads of SHARED_THRESHOLD bytes or more
+#         written to a shared memory ring of the client; only a descriptor
+#         (FLAG_SHARED) travels over the socket and the satellite reads the
+#         payload in place. Responses still come back over the socket.
+
+TRANSPORTS = ("tcp", "unix", "shm")
+DEFAULT_SOCKET_PATH = "/tmp/mark1-satellite.sock"
+SHARED_THRESHOLD = 256 * 1024
+DEFAULT_RING_SIZE = 64 * 1024 * 1024
+
+def listen_socket(transport: str, server_ip='0.0.0.0', server_port=1222, socket_path=DEFAULT_SOCKET_PATH,
+                  backlog=15) -> socket.socket:
+    """Listening socket of the satellite for a transport."""
+    if transport == "tcp":
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((server_ip, server_port))
+    else:
+        # A socket file left behind by an earlier run would make bind fail
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_socket.bind(socket_path)
+    server_socket.listen(backlog)
+    return server_socket
+
+def connect(transport: str, server_ip='127.0.0.1', server_port=1222, socket_path=DEFAULT_SOCKET_PATH,
+            timeout=15) -> socket.socket:
+    """Connected socket of the ground station for a transport."""
+    if transport == "tcp":
+        return socket.create_connection((server_ip, server_port), timeout=timeout)
+    client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client_socket.settimeout(timeout)
+    try:
+        client_socket.connect(socket_path)
+    except OSError:
+        client_socket.close()
+        raise
+    return client_socket
+
+def describe(transport: str, server_ip: str, server_port: int, socket_path: str) -> str:
+    return f"{server_ip}:{server_port}" if transport == "tcp" else f"{socket_path} ({transport})"
+
+class SharedRing:
+    """Payload regions carved in order out of one shared memory segment owned by the sender.
+
+    Regions are reserved at the head, wrapping to the start of the segment when
+    they do not fit before its end, and reclaimed from the tail in allocation
+    order, so a request that is slow to be answered only holds up the space
+    reserved after it.
+    """
+
+    def __init__(self, size=DEFAULT_RING_SIZE):
+        self.segment = shared_memory.SharedMemory(create=True, size=size)
+        self.size = size
+        self.regions = deque()  # [offset, end, freed] in allocation order
+        self.live = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.segment.name
+
+    def _reserve(self, size: int):
+        if not self.regions:
+            return 0 if size <= self.size else None
+        tail, head = self.regions[0][0], self.regions[-1][1]
+        if head <= tail:
+            # Wrapped: the free space lies between the head and the tail
+            return head if head + size <= tail else None
+        if head + size <= self.size:
+            return head
+        return 0 if size <= tail else None
+
+    def put(self, payload):
+        """Copy a payload into the ring; returns its offset, or None when it does not fit right now."""
+        with self._lock:
+            offset = self._reserve(len(payload))
+            if offset is None:
+                return None
+            region = [offset, offset + len(payload), False]
+            self.regions.append(region)
+            self.live[offset] = region
+        self.segment.buf[offset:offset + len(payload)] = payload
+        return offset
+
+    def descriptor(self, offset: int) -> bytes:
+        return pack_shared_descriptor(self.name, offset)
+
+    def free(self, offset: int) -> None:
+        """Give back the region of an answered request."""
+        with self._lock:
+            self.live.pop(offset)[2] = True
+            while self.regions and self.regions[0][2]:
+                self.regions.popleft()
+
+    def close(self) -> None:
+        self.segment.close()
+        self.segment.unlink()
+
+_ring = None
+_ring_lock = threading.Lock()
+
+def shared_ring() -> SharedRing:
+    """Ring of this process, created on first use and removed at exit."""
+    global _ring
+    with _ring_lock:
+        if _ring is None:
+            _ring = SharedRing()
+            atexit.register(_ring.close)
+        return _ring
+
+def share_payload(payload, threshold=SHARED_THRESHOLD):
+    """Offset of a payload copied into the shared ring, or None when it should go over the socket."""
+    if len(payload) < threshold:
+        return None
+    return shared_ring().put(payload)
+
+class SharedSegments:
+    """Client segments attached by one connection of the satellite; detached when it closes."""
+
+    def __init__(self):
+        self.segments = {}
+
+    def view(self, descriptor, payload_size: int) -> memoryview:
+        """Payload a descriptor points at, read in place. Release the view before close()."""
+        name, offset = unpack_shared_descriptor(descriptor)
+        segment = self.segments.get(name)
+        if segment is None:
+            segment = shared_memory.SharedMemory(name=name)
+            # The client owns the segment, keep our resource tracker from unlinking it at exit
+            resource_tracker.unregister(segment._name, "shared_memory")
+            self.segments[name] = segment
+        if offset + payload_size > segment.size:
+            raise ValueError(f"Shared payload of {payload_size} bytes at {offset} lies outside segment {name}")
+        return segment.buf[offset:offset + payload_size]
+
+    def receive(self, client_socket, payload_size: int) -> memoryview:
+        return self.view(recv_exactly(client_socket, SHARED_DESCRIPTOR_SIZE), payload_size)
+
+    def close(self) -> None:
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
@@ -0,0 +1,127 @@
+import lzma
+import struct
+import zlib
+from collections import deque
+
+# Multi-block .xz streams compressed in parallel.
+#
+# The input is cut into blocks that are compressed independently as raw
+# LZMA2 on a thread pool (liblzma releases the GIL) and assembled into one
+# standard .xz stream with a block index, the way `xz -T` does. Any xz
+# decoder reads the result, including lzma.decompress and LZMADecompressor.
+
+MAGIC = b"\xfd7zXZ\x00"
+FOOTER_MAGIC = b"YZ"
+CHECK_CRC32 = 0x01
+CHECK_SIZE = 4
+STREAM_FLAGS = bytes([0x00, CHECK_CRC32])
+FILTER_LZMA2 = 0x21
+# Block flags: one filter, compressed and uncompressed sizes present
+BLOCK_FLAGS = 0x40 | 0x80
+MIN_BLOCK_SIZE = 1 << 20
+# Dictionary of the default preset
+DEFAULT_DICT_SIZE = 8 << 20
+
+def _varint(value: int) -> bytes:
+    """xz multibyte integer: 7 bits per byte, least significant first."""
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+def _crc32(data) -> bytes:
+    return struct.pack("<I", zlib.crc32(data))
+
+def _padding(size: int) -> bytes:
+    return b"\x00" * (-size % 4)
+
+def property_dict_size(prop: int) -> int:
+    return (2 | (prop & 1)) << (prop // 2 + 11)
+
+def dict_size_property(dict_size: int) -> int:
+    """Smallest LZMA2 dictionary property covering dict_size bytes."""
+    for prop in range(40):
+        if property_dict_size(prop) >= dict_size:
+            return prop
+    return 40
+
+def block_size(dict_size: int, total_size=None, threads=1) -> int:
+    """xz's default of three dictionaries per block, smaller when a payload of
+    known size would otherwise leave threads idle."""
+    size = max(MIN_BLOCK_SIZE, 3 * dict_size)
+    if total_size:
+        size = min(size, max(MIN_BLOCK_SIZE, -(-total_size // threads)))
+    return size
+
+def stream_header() -> bytes:
+    return MAGIC + STREAM_FLAGS + _crc32(STREAM_FLAGS)
+
+def encode_block(data, preset: int, dict_size: int):
+    """Compress one block; returns (block bytes, unpadded size, uncompressed size)."""
+    prop = dict_size_property(min(dict_size, max(len(data), 4096)))
+    filters = [{"id": lzma.FILTER_LZMA2, "preset": preset, "dict_size": property_dict_size(prop)}]
+    compressed = lzma.compress(data, format=lzma.FORMAT_RAW, filters=filters)
+    body = bytes([BLOCK_FLAGS]) + _varint(len(compressed)) + _varint(len(data)) + bytes([FILTER_LZMA2, 1, prop])
+    body += _padding(1 + len(body))
+    header = bytes([(1 + len(body) + 4) // 4 - 1]) + body
+    header += _crc32(header)
+    block = header + compressed + _padding(len(compressed)) + _crc32(data)
+    return block, len(header) + len(compressed) + CHECK_SIZE, len(data)
+
+def stream_trailer(records) -> bytes:
+    """Index of the (unpadded size, uncompressed size) block records, then the stream footer."""
+    index = b"\x00" + _varint(len(records))
+    for unpadded_size, uncompressed_size in records:
+        index += _varint(unpadded_size) + _varint(uncompressed_size)
+    index += _padding(len(index))
+    index += _crc32(index)
+    backward_size = struct.pack("<I", len(index) // 4 - 1)
+    return index + _crc32(backward_size + STREAM_FLAGS) + backward_size + STREAM_FLAGS + FOOTER_MAGIC
+
+class ParallelXZCompressor:
+    """Incremental compressor with the compress/flush interface of lzma.LZMACompressor.
+
+    Full blocks are handed to the pool as soon as they are buffered and written
+    out in order as they finish, with at most two blocks per thread in flight.
+    """
+
+    def __init__(self, pool, threads: int, preset=None, dict_size=None, total_size=None):
+        self.pool = pool
+        self.threads = threads
+        self.preset = lzma.PRESET_DEFAULT if preset is None else preset
+        self.dict_size = dict_size or DEFAULT_DICT_SIZE
+        self.block_size = block_size(self.dict_size, total_size, threads)
+        self.dict_size = min(self.dict_size, self.block_size)
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.records = []
+        self.started = False
+
+    def _submit(self, block) -> None:
+        self.pending.append(self.pool.submit(encode_block, block, self.preset, self.dict_size))
+
+    def _collect(self, wait: bool) -> bytes:
+        output = []
+        if not self.started:
+            output.append(stream_header())
+            self.started = True
+        while self.pending and (wait or self.pending[0].done() or len(self.pending) > 2 * self.threads):
+            block, unpadded_size, uncompressed_size = self.pending.popleft().result()
+            output.append(block)
+            self.records.append((unpadded_size, uncompressed_size))
+        return b"".join(output)
+
+    def compress(self, data) -> bytes:
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return self._collect(wait=False)
+
+    def flush(self) -> bytes:
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        return self._collect(wait=True) + stream_trailer(self.records)
@@ -3,9 +3,74 @@ import zlib
 import random
 import math
 import io
-from collections import Counter
+import hashlib
+import threading
+from collections import Counter, OrderedDict
 from codec import fpga_sim_deflate_compress
 
+# Total size of the results kept for payloads seen before
+CACHE_BYTES = 64 * 1024 * 1024
+# Charged per entry on top of its result, so entries holding only a number still count
+ENTRY_OVERHEAD = 256
+
+class ResultCache:
+    """Results keyed by payload digest and parameters; least recently used ones go first past max_bytes."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        # The FPGA simulation keeps its state in module globals, so only one may run at a time
+        self.simulation_lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value, result: bytes) -> None:
+        size = len(result) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key)[1]) + ENTRY_OVERHEAD
+            self.entries[key] = (value, result)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted) + ENTRY_OVERHEAD
+
+@st.cache_resource
+def result_cache() -> ResultCache:
+    """One cache for every session of the app, kept across reruns."""
+    return ResultCache()
+
+def memoized(payload: bytes, name: str, compute, lock=None):
+    """compute() once per distinct payload and name; it returns (value, result bytes).
+
+    With a lock, compute() runs under it and the cache is checked again first, so
+    sessions waiting for the same result do not compute it again.
+    """
+    cache = result_cache()
+    key = (hashlib.blake2b(payload, digest_size=16).hexdigest(), name)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    if lock is None:
+        cached = compute()
+    else:
+        with lock:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            cached = compute()
+    cache.put(key, *cached)
+    return cached
+
 def compress_with_deflate(data: bytes) -> bytes:
     return zlib.compress(data)
 
@@ -72,19 +137,25 @@ def main():
     elif payload_type == "Random":
         size = st.slider("Select the size of the random payload (in bytes)", 1, 15000, 100)
         entropy = st.slider("Select the entropy (bits per byte)", 0.0, 8.0, 4.0)
-        payload = generate_random_payload_with_entropy(size, entropy)
+        # Kept until the sliders move, so reruns do not start another FPGA simulation
+        if st.session_state.get("random_parameters") != (size, entropy):
+            st.session_state["random_payload"] = generate_random_payload_with_entropy(size, entropy)
+            st.session_state["random_parameters"] = (size, entropy)
+        payload = st.session_state["random_payload"]
 
     # Compression Algorithm selection
     if payload:
-        entropy = calculate_entropy(payload)
+        entropy = memoized(payload, "entropy", lambda: (calculate_entropy(payload), b""))[0]
         st.write(f"Entropy of the original payload: {entropy:.2f} bits per byte")
 
         st.write("Compressing with regular DEFLATE...")
-        compressed_payload = compress_with_deflate(payload)
+        compressed_payload = memoized(payload, "deflate", lambda: (None, compress_with_deflate(payload)))[1]
         st.write("Results for regular DEFLATE:")
         print_stats(payload, compressed_payload)
         with st.spinner("Simulating FPGA-based DEFLATE compression..."):
-            fpga_compressed_payload = fpga_sim_deflate_compress(payload)
+            fpga_compressed_payload = memoized(payload, "fpga_deflate",
+                                               lambda: (None, bytes(fpga_sim_deflate_compress(payload))),
+                                               result_cache().simulation_lock)[1]
             st.write("Results for simulated FPGA-based DEFLATE:")
             print_stats(payload, fpga_compressed_payload)
         